@@ -2,6 +2,7 @@ import pandas as pd
 import os
 
 from aux_functions import *
+from nic_reference import read_nic_attributes, read_nic_table
 
 def add_external_data_attributes(path: str, df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -115,16 +116,10 @@ def add_external_data_attributes(path: str, df: pd.DataFrame) -> pd.DataFrame:
     # 1) READ & PREP ATTRIBUTES (ACTIVE + CLOSED)
     # ------------------------------------------------------------------
 
-    # Build full paths for attributes CSVs
-    active_fp = os.path.join(path, "CSV_ATTRIBUTES_ACTIVE.CSV")
-    closed_fp = os.path.join(path, "CSV_ATTRIBUTES_CLOSED.CSV")
+    # Read attributes (active + closed) from the NIC cache: keep only the RSSD and charter code columns
+    attrs = read_nic_attributes(path, ["#ID_RSSD", "CHTR_TYPE_CD"])
 
-    # Read attributes: keep only the RSSD and charter code columns
-    active = pd.read_csv(active_fp, usecols=["#ID_RSSD", "CHTR_TYPE_CD"], low_memory=False)
-    closed = pd.read_csv(closed_fp, usecols=["#ID_RSSD", "CHTR_TYPE_CD"], low_memory=False)
-
-    # Combine, standardize, and de-duplicate by idrssd
-    attrs = pd.concat([active, closed], ignore_index=True)
+    # Standardize and de-duplicate by idrssd
     attrs = attrs.rename(columns={"#ID_RSSD": "idrssd"})
     attrs = attrs.dropna(subset=["idrssd"])
     attrs = attrs.drop_duplicates(subset=["idrssd"], keep="last")
@@ -160,10 +155,10 @@ def add_external_data_attributes(path: str, df: pd.DataFrame) -> pd.DataFrame:
         return df
 
     # Read with fixed column names; rename to simple 'pred' and 'succ'
-    x = pd.read_csv(
-        xfrm_fp,
-        usecols=["#ID_RSSD_PREDECESSOR", "ID_RSSD_SUCCESSOR"],
-        low_memory=False
+    x = read_nic_table(
+        path,
+        "transformations",
+        columns=["#ID_RSSD_PREDECESSOR", "ID_RSSD_SUCCESSOR"],
     ).rename(columns={
         "#ID_RSSD_PREDECESSOR": "pred",
         "ID_RSSD_SUCCESSOR": "succ"
@@ -230,32 +225,44 @@ def add_external_data_attributes(path: str, df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def add_external_data_tic(path: str, df: pd.DataFrame) -> pd.DataFrame:
+def add_external_data_tic(path: str, df: pd.DataFrame, df_tic_intervals: pd.DataFrame = None) -> pd.DataFrame:
 
     """
     Enrich a Call Reports DataFrame with bank holding company information,
     by merging in the columns 'tic' and 'top_parent_idrssd' from the NIC. 
 
+    The ticker spells built by create_tic_parent_intervals (one row per child bank and
+    validity interval) are attached with a sorted as-of interval join on 'date' within
+    'idrssd', so the quarter-by-quarter expansion of the family table is never built.
+
     Parameters
     ----------
     path : str
         Path to the "raw" data directory that contains the NIC files and the CRSP crosswalk.
     df : pd.DataFrame
-        A DataFrame that contains an 'idrssd' column.
+        A DataFrame that contains 'idrssd' and 'date' columns.
+    df_tic_intervals : pd.DataFrame, optional
+        Output of create_tic_parent_intervals(path), if it was already computed.
     Returns
     -------
     pd.DataFrame
-        A copy of `df` with new columns 'tic', 'top_parent_idrssd', 'permco' merged in.
+        A copy of `df` with new columns 'top_parent_idrssd', 'permco', 'tic' merged in.
     """
 
-    # use the path to get the tic and parent data
-    df_tic_parent = create_tic_parent_df(path)
-
-    # ! (Avoid creating a new copy of the dataset) merge the tic and parent data to the df:
-    df = pd.merge(df, df_tic_parent,
-                        how='left',
-                        left_on=['date', 'idrssd'],
-                        right_on=['date', 'child_idrssd']
-                        ).drop(columns=['child_idrssd'])
-    
-    return df
\ No newline at end of file
+    # use the path to get the tic and parent spells
+    if df_tic_intervals is None:
+        df_tic_intervals = create_tic_parent_intervals(path)
+
+    # attach each row to the spell that contains its date (rows without a spell get NaN)
+    df = interval_join(
+        df,
+        df_tic_intervals,
+        on='date',
+        start='dt_start',
+        end='dt_end',
+        left_by='idrssd',
+        right_by='child_idrssd',
+        how='left',
+    ).drop(columns=['child_idrssd', 'dt_start', 'dt_end'])
+
+    return df
@@ -3,6 +3,12 @@ import matplotlib.pyplot as plt
 import numpy as np
 import os
 import re
+import heapq
+
+from nic_reference import read_nic_attributes, read_nic_table
+from profiling import profile
+from expressions import Expr
+from panel_windows import quarter_number
 
 def extract_variables_from_mappings(mappings):
     """
@@ -30,6 +36,9 @@ def extract_variables_from_mappings(mappings):
             for key, value in mapping.items():
                 if key in ['first_col', 'second_col', 'first_col_post', 'second_col_post']:
                     extract_from_value(value)
+        elif isinstance(mapping, Expr):
+            for value in mapping.columns():
+                extract_from_value(value)
     
     # Convert to uppercase and return sorted list
     return sorted([var.upper() for var in variables])
@@ -109,8 +118,18 @@ def create_ticker_df(path_wrds: str,
     # Keep only relevant columns
     wrds_data = wrds_data[["date", "permco", "permno", "tic"]]
 
-    # Merge WRDS data with crosswalk on permco to add 'entity'
-    dt = wrds_data.merge(permco_idrssd_xwalk, on="permco").query("dt_start <= date <= dt_end")
+    # Attach to each WRDS row the crosswalk spells of its permco that contain the date (adds 'entity').
+    # The interval join never builds the permco cross product; spells without valid dates cannot match.
+    permco_idrssd_xwalk = permco_idrssd_xwalk.dropna(subset=["dt_start", "dt_end"])
+    dt = interval_join(
+        wrds_data,
+        permco_idrssd_xwalk,
+        on="date",
+        start="dt_start",
+        end="dt_end",
+        left_by="permco",
+        right_by="permco",
+    )
 
     return dt
 
@@ -219,37 +238,18 @@ def find_descendants_at_date(
 
     return visited & fdic_cert_filter
 
-def create_tic_parent_df(path):
+def _load_tic_parent_inputs(path):
     """
-    Create a DataFrame mapping each ticker to its parent entity.
-    The resulting DataFrame has columns:
-        - date (Timestamp)
-        - top_parent_idrssd (int)
-        - child_idrssd (int)
-        - permco (int)
-        - tic (str)
-
-    The key steps are:
-    - Read and process the relationships data to build a parent→offspring mapping.
-    - Merge this mapping with the ticker DataFrame to associate each child with its parent's ticker information.
-    - Filter out rows where the ticker is missing.
-
-    Key variables and functions:
-    - df_tickers: DataFrame with columns ['date', 'top_parent_idrssd', 'permco', 'tic']
-    - df_relationship: DataFrame with parent-child relationships and active dates.
-    - find_descendants_at_date: Function to find all descendants of a parent at a given date.
-    - df_family: DataFrame mapping each (top_parent_idrssd, date) to all its descendants.
-    - df_merged: Final merged DataFrame with tickers for each child bank.
-
-    Parameters
-    ----------
-    path : str
-        Base path containing the 'ffiec/extracted/nic' and 'wrds_compustat' subfolders.
+    Read and format the inputs shared by create_tic_parent_df and create_tic_parent_intervals.
 
     Returns
     -------
-    pd.DataFrame
-
+    df_tickers : pd.DataFrame
+        Columns ['date', 'permco', 'permno', 'tic', 'top_parent_idrssd', 'dt_start', 'dt_end'].
+    df_relationship : pd.DataFrame
+        Parent→offspring links with active dates, indexed by 'id_rssd_parent'.
+    fdic_cert_filter : set[int]
+        Ids of the institutions that have an FDIC certificate.
     """
 
     # Give the path for the raw data folders, define path to subfolders
@@ -267,7 +267,11 @@ def create_tic_parent_df(path):
     # Relationships dataframe
     # ------------------------------------------------------------------------
     # Read relationships data, format columns
-    df_relationship = pd.read_csv(os.path.join(nic_folder, "CSV_RELATIONSHIPS.csv"))
+    df_relationship = read_nic_table(
+        nic_folder,
+        "relationships",
+        columns=["#ID_RSSD_PARENT", "ID_RSSD_OFFSPRING", "D_DT_START", "D_DT_END"],
+    )
     df_relationship.columns = df_relationship.columns.str.replace("#", "")
     df_relationship.columns = [col.lower() for col in df_relationship.columns]
     df_relationship = df_relationship[["id_rssd_parent", "id_rssd_offspring", "d_dt_start", "d_dt_end"]]
@@ -287,22 +291,53 @@ def create_tic_parent_df(path):
     # ------------------------------------------------------------------------
     # Attributes dataframe
     # ------------------------------------------------------------------------
-    active_fp = os.path.join(nic_folder, "CSV_ATTRIBUTES_ACTIVE.CSV")
-    closed_fp = os.path.join(nic_folder, "CSV_ATTRIBUTES_CLOSED.CSV")
-
-    # Read attributes: keep only the RSSD and charter code columns
-    active = pd.read_csv(active_fp, usecols=["#ID_RSSD", "ID_FDIC_CERT"], low_memory=False)
-    closed = pd.read_csv(closed_fp, usecols=["#ID_RSSD", "ID_FDIC_CERT"], low_memory=False)
-
-    # Combine, standardize, and de-duplicate by idrssd
-    attrs = pd.concat([active, closed], ignore_index=True).drop_duplicates()
+    # Read attributes (active + closed) from the NIC cache: keep only the RSSD and FDIC cert columns
+    attrs = read_nic_attributes(nic_folder, ["#ID_RSSD", "ID_FDIC_CERT"]).drop_duplicates()
 
+    # Standardize column names
     attrs.columns = [col.lower() for col in attrs.columns]
     attrs.rename(columns={"#id_rssd": "id_rssd"}, inplace=True)
 
     # Get the ids of banks with an fdic_cert.
     fdic_cert_filter = set(attrs.loc[attrs["id_fdic_cert"] > 0, "id_rssd"].astype(int))
 
+    return df_tickers, df_relationship, fdic_cert_filter
+
+
+def create_tic_parent_df(path):
+    """
+    Create a DataFrame mapping each ticker to its parent entity.
+    The resulting DataFrame has columns:
+        - date (Timestamp)
+        - top_parent_idrssd (int)
+        - child_idrssd (int)
+        - permco (int)
+        - tic (str)
+
+    The key steps are:
+    - Read and process the relationships data to build a parent→offspring mapping.
+    - Merge this mapping with the ticker DataFrame to associate each child with its parent's ticker information.
+    - Filter out rows where the ticker is missing.
+
+    Key variables and functions:
+    - df_tickers: DataFrame with columns ['date', 'top_parent_idrssd', 'permco', 'tic']
+    - df_relationship: DataFrame with parent-child relationships and active dates.
+    - find_descendants_at_date: Function to find all descendants of a parent at a given date.
+    - df_family: DataFrame mapping each (top_parent_idrssd, date) to all its descendants.
+    - df_merged: Final merged DataFrame with tickers for each child bank.
+
+    Parameters
+    ----------
+    path : str
+        Base path containing the 'ffiec/extracted/nic' and 'wrds_compustat' subfolders.
+
+    Returns
+    -------
+    pd.DataFrame
+
+    """
+
+    df_tickers, df_relationship, fdic_cert_filter = _load_tic_parent_inputs(path)
 
     # ------------------------------------------------------------------------
     # Create "df_family": maps each (top_parent_idrssd, date) to all its descendants
@@ -312,20 +347,22 @@ def create_tic_parent_df(path):
 
     records = []
 
-    for pid in all_top_parents:
-        for d in all_unique_dates:
-            # get descendants (children, grandchildren, ...) at this date for this parent
-            family = find_descendants_at_date(df_relationship, pid, fdic_cert_filter, d)
-            if not family:
-                continue
-            # append one row per child
-            d_ts = pd.to_datetime(d, errors="coerce")
-            for k in sorted(family):
-                records.append({
-                    "date": d_ts,                 # keep as Timestamp for easy merging/filters
-                    "top_parent_idrssd": int(pid),
-                    "child_idrssd": int(k),
-                })
+    with profile("family_bfs", parents=len(all_top_parents), dates=len(all_unique_dates)) as rec:
+        for pid in all_top_parents:
+            for d in all_unique_dates:
+                # get descendants (children, grandchildren, ...) at this date for this parent
+                family = find_descendants_at_date(df_relationship, pid, fdic_cert_filter, d)
+                if not family:
+                    continue
+                # append one row per child
+                d_ts = pd.to_datetime(d, errors="coerce")
+                for k in sorted(family):
+                    records.append({
+                        "date": d_ts,                 # keep as Timestamp for easy merging/filters
+                        "top_parent_idrssd": int(pid),
+                        "child_idrssd": int(k),
+                    })
+        rec.meta["records"] = len(records)
 
     # Build final DataFrame
     df_family = (pd.DataFrame.from_records(records)
@@ -348,6 +385,261 @@ def create_tic_parent_df(path):
 
     return df_merged
 
+def _interval_layers(groups, starts, ends):
+    """
+    Split intervals into layers such that, within a layer and a group, no two intervals overlap.
+
+    Greedy interval partitioning: intervals are visited by (group, start) and reuse the layer
+    of the earliest-ending interval that is already closed, otherwise they open a new layer.
+    The number of layers equals the maximum number of intervals of a group that are active
+    at the same time (usually 1).
+
+    Parameters
+    ----------
+    groups, starts, ends : np.ndarray
+        Integer group codes and int64 interval bounds (inclusive), all of the same length.
+
+    Returns
+    -------
+    np.ndarray
+        Layer number of each interval.
+    """
+    order = np.lexsort((starts, groups))
+    layers = np.empty(len(order), dtype=np.int64)
+    heap, current_group, n_layers = [], None, 0
+
+    for i in order:
+        if groups[i] != current_group:
+            heap, current_group, n_layers = [], groups[i], 0
+        if heap and heap[0][0] < starts[i]:
+            _, layer = heapq.heappop(heap)
+        else:
+            layer = n_layers
+            n_layers += 1
+        layers[i] = layer
+        heapq.heappush(heap, (ends[i], layer))
+
+    return layers
+
+
+def _as_int64_points(values):
+    """
+    Convert a Series of dates or numbers to int64 (nanoseconds for dates) plus a validity mask.
+    """
+    values = pd.Series(values)
+    if not pd.api.types.is_numeric_dtype(values):
+        values = pd.to_datetime(values, errors="coerce").astype("datetime64[ns]")
+    ok = values.notna().to_numpy()
+    if values.dtype.kind == "M":
+        ints = values.to_numpy().view("int64")
+    else:
+        ints = values.fillna(0).to_numpy().astype("int64")
+    return ints, ok
+
+
+def interval_join(left, right, on, start, end, left_by=None, right_by=None, how="inner"):
+    """
+    Join each row of `left` to the rows of `right` whose [start, end] interval contains `left[on]`.
+
+    Equivalent to ``left.merge(right, left_on=left_by, right_on=right_by).query("start <= on <= end")``
+    but without building the cross product: intervals are split into non-overlapping layers
+    (see _interval_layers) and every layer is attached with one sorted as-of join.
+    The work is proportional to the size of the inputs plus the number of matches.
+
+    Parameters
+    ----------
+    left, right : pd.DataFrame
+    on : str
+        Column of `left` with the point to look up (e.g. 'date').
+    start, end : str
+        Columns of `right` with the inclusive interval bounds. A missing `end` means open-ended.
+    left_by, right_by : str, optional
+        Exact-match keys (e.g. 'permco'). Give both or neither.
+    how : {"inner", "left"}
+        "left" keeps the rows of `left` without a match, with missing values on the right.
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns of `left` followed by the columns of `right`, ordered like `left`.
+        A row of `left` appears once per matching interval.
+    """
+    if how not in ("inner", "left"):
+        raise ValueError("how must be 'inner' or 'left'.")
+    if (left_by is None) != (right_by is None):
+        raise ValueError("Give both left_by and right_by, or neither.")
+
+    # -- integer keys for both sides ------------------------------------------
+    if left_by is not None:
+        codes, _ = pd.factorize(pd.concat([left[left_by], right[right_by]], ignore_index=True))
+        l_grp, r_grp = codes[:len(left)], codes[len(left):]
+    else:
+        l_grp, r_grp = np.zeros(len(left), dtype=np.int64), np.zeros(len(right), dtype=np.int64)
+
+    l_on, l_ok = _as_int64_points(left[on])
+    r_start, r_ok = _as_int64_points(right[start])
+    r_end, r_end_ok = _as_int64_points(right[end])
+    r_end = np.where(r_end_ok, r_end, np.iinfo(np.int64).max)  # open-ended intervals
+
+    l_key = pd.DataFrame({"_row": np.arange(len(left)), "_grp": l_grp, "_on": l_on})
+    l_key = l_key[l_ok & (l_grp >= 0)].sort_values("_on", kind="stable")
+
+    r_key = pd.DataFrame({"_rrow": np.arange(len(right)), "_grp": r_grp, "_start": r_start, "_end": r_end})
+    r_key = r_key[r_ok & (r_grp >= 0) & (r_start <= r_end)]
+
+    # -- one as-of join per layer of non-overlapping intervals ----------------
+    layers = _interval_layers(r_key["_grp"].to_numpy(), r_key["_start"].to_numpy(), r_key["_end"].to_numpy())
+    pairs = []
+    for layer in np.unique(layers):
+        r_layer = r_key[layers == layer].sort_values("_start", kind="stable")
+        m = pd.merge_asof(l_key, r_layer, left_on="_on", right_on="_start", by="_grp", direction="backward")
+        m = m[m["_rrow"].notna() & (m["_on"] <= m["_end"])]
+        pairs.append(m[["_row", "_rrow"]].astype("int64"))
+
+    pairs = (pd.concat(pairs, ignore_index=True) if pairs
+             else pd.DataFrame({"_row": np.array([], dtype=np.int64), "_rrow": np.array([], dtype=np.int64)}))
+
+    if how == "left":
+        unmatched = np.setdiff1d(np.arange(len(left)), pairs["_row"].to_numpy())
+        pairs = pd.concat([pairs, pd.DataFrame({"_row": unmatched, "_rrow": -1})], ignore_index=True)
+
+    pairs = pairs.sort_values(["_row", "_rrow"], kind="stable")
+
+    # -- assemble the result --------------------------------------------------
+    left_part = left.iloc[pairs["_row"].to_numpy()].reset_index(drop=True)
+    right_part = right.reset_index(drop=True).reindex(pairs["_rrow"].to_numpy()).reset_index(drop=True)
+    if left_by is not None and left_by == right_by:
+        # same key name on both sides: keep a single copy, like merge(on=...)
+        right_part = right_part.drop(columns=[right_by])
+    overlap = [c for c in right_part.columns if c in left_part.columns]
+    if overlap:
+        left_part = left_part.rename(columns={c: f"{c}_x" for c in overlap})
+        right_part = right_part.rename(columns={c: f"{c}_y" for c in overlap})
+
+    return pd.concat([left_part, right_part], axis=1)
+
+
+def create_tic_parent_intervals(path):
+    """
+    Same information as create_tic_parent_df, stored as validity intervals instead of one row per quarter.
+
+    Consecutive quarters in which a child bank keeps the same top parent, permco and ticker are
+    collapsed into a single spell [dt_start, dt_end]. The family BFS is only run for the
+    (top parent, date) pairs that actually carry a ticker, and the quarterly expansion is never
+    materialized.
+
+    Example
+    -------
+        child  top_parent  permco  tic   quarters with a match
+        -----  ----------  ------  ----  ---------------------------------
+          11        100     2000   ABC   2001Q1, 2001Q2, 2001Q3, 2002Q2
+    becomes
+        child_idrssd  top_parent_idrssd  permco  tic  dt_start    dt_end
+        ------------  -----------------  ------  ---  ----------  ----------
+                  11                100    2000  ABC  2001-03-31  2001-09-30
+                  11                100    2000  ABC  2002-06-30  2002-06-30
+
+    Parameters
+    ----------
+    path : str
+        Base path containing the 'ffiec/extracted/nic' and 'wrds_compustat' subfolders.
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns ['child_idrssd', 'top_parent_idrssd', 'permco', 'tic', 'dt_start', 'dt_end'].
+    """
+
+    df_tickers, df_relationship, fdic_cert_filter = _load_tic_parent_inputs(path)
+
+    # Tickers by (top parent, date); rows without a ticker never produce a match.
+    df_tickers = (df_tickers.dropna(subset=["tic"])
+                            .drop_duplicates(subset=["top_parent_idrssd", "date", "permco", "tic"])
+                            .sort_values(["top_parent_idrssd", "date"]))
+
+    # Calendar quarter of each date: a spell only continues into the next calendar quarter, so a quarter
+    # missing from the WRDS extract ends it.
+    all_unique_dates = np.sort(df_tickers["date"].unique())
+    date_pos = dict(zip(map(pd.Timestamp, all_unique_dates), quarter_number(all_unique_dates).tolist()))
+
+    spells = []       # [child, parent, permco, tic, dt_start, dt_end, last quarter number]
+    open_spells = {}  # (child, parent, permco, tic) → index in spells
+
+    with profile("family_bfs", parents=df_tickers["top_parent_idrssd"].nunique(), dates=len(all_unique_dates)) as rec:
+        for (pid, d), tickers in df_tickers.groupby(["top_parent_idrssd", "date"], sort=True):
+            family = find_descendants_at_date(df_relationship, pid, fdic_cert_filter, d)
+            if not family:
+                continue
+            d_ts = pd.Timestamp(d)
+            pos = date_pos[d_ts]
+            ticker_pairs = list(zip(tickers["permco"].astype(int), tickers["tic"]))
+            for k in family:
+                for permco, tic in ticker_pairs:
+                    key = (int(k), int(pid), permco, tic)
+                    j = open_spells.get(key)
+                    if j is not None and spells[j][6] == pos - 1:
+                        # extend the running spell by one quarter
+                        spells[j][5] = d_ts
+                        spells[j][6] = pos
+                    else:
+                        open_spells[key] = len(spells)
+                        spells.append([key[0], key[1], permco, tic, d_ts, d_ts, pos])
+        rec.meta["spells"] = len(spells)
+
+    columns = ["child_idrssd", "top_parent_idrssd", "permco", "tic", "dt_start", "dt_end"]
+    df_intervals = pd.DataFrame([row[:6] for row in spells], columns=columns)
+
+    return df_intervals.sort_values(["child_idrssd", "dt_start"]).reset_index(drop=True)
+
+
+def binned_stats(x, y, q, x_axis="rank"):
+    """
+    Statistics of *y* in q-quantile bins of *x*, computed in a single grouped pass.
+
+    Parameters
+    ----------
+    x, y : array-like or pd.Series
+        Same length; values are paired by position.
+    q    : int
+        Number of equal-frequency bins (fewer if bin edges coincide).
+    x_axis : {"rank", "value"}
+        Bin centre reported in 'bin_center':
+        - "rank"  → mean percentile rank of *x* in the bin (0–1).
+        - "value" → mean of *x* in the bin (in data units).
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per bin, sorted by 'bin_center', with columns
+        ['bin_center', 'mean', 'median', 'p25', 'p75', 'count'] ('count' = non-missing *y*).
+    """
+    if x_axis not in ("rank", "value"):
+        raise ValueError("x_axis must be 'rank' or 'value'.")
+
+    x = pd.Series(np.asarray(x)) if not isinstance(x, pd.Series) else x
+    y = np.asarray(y, dtype=float)
+    if len(x) != len(y):
+        raise ValueError(f"x and y must have the same length ({len(x)} != {len(y)}).")
+
+    # -- percentile ranks & bin membership -----------------------------------
+    x_pct = x.rank(method="average", pct=True)
+    bins = pd.qcut(x_pct, q=q, labels=False, duplicates="drop")
+    centre = x_pct if x_axis == "rank" else x
+
+    # -- within-bin statistics, one groupby over all bins --------------------
+    frame = pd.DataFrame({"bin": bins.to_numpy(), "centre": centre.to_numpy(dtype=float), "y": y})
+    grouped = frame.groupby("bin", sort=True)
+    stats = grouped.agg(bin_center=("centre", "mean"), mean=("y", "mean"), count=("y", "count"))
+    quantiles = grouped["y"].quantile([0.25, 0.5, 0.75]).unstack()
+    stats["median"] = quantiles[0.5]
+    stats["p25"] = quantiles[0.25]
+    stats["p75"] = quantiles[0.75]
+
+    return (stats[["bin_center", "mean", "median", "p25", "p75", "count"]]
+            .sort_values("bin_center")
+            .reset_index(drop=True))
+
+
 def binned_scatter(
     x,
     y,
@@ -378,45 +670,19 @@ def binned_scatter(
         What to place on the x-axis:
         - "rank"  → percentile ranks of *x* (0–1).
         - "value" → the underlying *x* (in data units).
+
+    Returns
+    -------
+    pd.DataFrame
+        The per-bin statistics from binned_stats, so they can be reused without recomputing.
     """
 
-    # -- ensure pandas Series -------------------------------------------------
-    if not isinstance(x, pd.Series):
-        x = pd.Series(x, name=getattr(x, "name", None))
-    if not isinstance(y, pd.Series):
-        y = pd.Series(y, name=getattr(y, "name", None))
-
-    # -- percentile ranks & bin membership -----------------------------------
-    x_pct = x.rank(method="average", pct=True)
-    x_binned = pd.qcut(x_pct, q=q, duplicates="drop")
-
-    # -- within-bin statistics ------------------------------------------------
-    bin_centers, means, medians, mins, maxs = [], [], [], [], []
-
-    for interval in x_binned.unique():
-        mask = x_binned == interval
-        # centre depends on the chosen x-axis
-        if x_axis == "rank":
-            bin_center = x_pct[mask].mean()
-        elif x_axis == "value":
-            bin_center = x[mask].mean()
-        else:
-            raise ValueError("x_axis must be 'rank' or 'value'.")
-
-        ys = y[mask]
-        bin_centers.append(bin_center)
-        means.append(ys.mean())
-        medians.append(ys.median())
-        mins.append(ys.quantile(0.25))
-        maxs.append(ys.quantile(0.75))
-
-    # -- sort by x ------------------------------------------------------------
-    order = np.argsort(bin_centers)
-    bin_centers = np.array(bin_centers)[order]
-    means       = np.array(means)[order]
-    medians     = np.array(medians)[order]
-    mins        = np.array(mins)[order]
-    maxs        = np.array(maxs)[order]
+    stats = binned_stats(x, y, q, x_axis=x_axis)
+    bin_centers = stats["bin_center"].to_numpy()
+    means       = stats["mean"].to_numpy()
+    medians     = stats["median"].to_numpy()
+    mins        = stats["p25"].to_numpy()
+    maxs        = stats["p75"].to_numpy()
 
     # -- plot -----------------------------------------------------------------
     plt.scatter(
@@ -437,11 +703,13 @@ def binned_scatter(
 
     # -- labels & grid --------------------------------------------------------
     if x_axis == "rank":
-        plt.xlabel(f"Percentile Rank of {x.name or 'x'}")
+        plt.xlabel(f"Percentile Rank of {getattr(x, 'name', None) or 'x'}")
         ticks = np.linspace(0, 1, 6)
         plt.xticks(ticks, [f"{int(t*100)}" for t in ticks])
     else:  # actual values
-        plt.xlabel(x.name or "x")
+        plt.xlabel(getattr(x, "name", None) or "x")
 
-    plt.ylabel(y.name or "y")
+    plt.ylabel(getattr(y, "name", None) or "y")
     plt.grid(True, linestyle="--", alpha=0.5, linewidth=0.5, color="lightgrey")
+
+    return stats
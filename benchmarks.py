@@ -0,0 +1,138 @@
+import os
+import json
+import shutil
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from ingest_raw_ffiec_cdr import ingest
+from merge_cr_dates_fast import merge_cr_dates_fast
+from call_reports_cleaner import CallReportsCleaner
+from add_external_information import add_external_data_attributes
+from aux_functions import extract_variables_from_mappings, create_tic_parent_df
+from mappings import mappings
+from nic_reference import prepare_nic_reference, nic_cache_dir
+from profiling import enable_profiling, disable_profiling, profile
+from synthetic_data import generate_synthetic_dataset
+
+# Named problem sizes. 'small' runs in seconds and is meant for quick before/after checks;
+# 'large' approaches the width of the real files.
+SCALES = {
+    "small":  dict(n_banks=200,  n_quarters=4,  n_extra_columns=0,    hierarchy_depth=3),
+    "medium": dict(n_banks=2000, n_quarters=8,  n_extra_columns=500,  hierarchy_depth=3),
+    "large":  dict(n_banks=5000, n_quarters=16, n_extra_columns=2000, hierarchy_depth=4),
+}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmark(work_dir, scale="small", repeat=1, seed=0):
+    """
+    Generate (or reuse) a synthetic raw data tree and time the main pipeline functions on it.
+
+    Timed operations, in pipeline order:
+        ingest, merge_cr_dates_fast, CallReportsCleaner (select + construct_definitions),
+        nic_reference_cache (CSV → Parquet conversion), add_external_data_attributes,
+        create_tic_parent_df.
+
+    Args:
+        work_dir (str): Folder where the synthetic data for each scale is kept ('{work_dir}/{scale}').
+        scale (str): One of SCALES.
+        repeat (int): Number of timed repetitions of every operation.
+        seed (int): Seed of the synthetic data generator.
+
+    Returns:
+        list[dict]: One result per operation and repetition.
+    """
+    params = SCALES[scale]
+    base = os.path.join(work_dir, scale)
+    raw = os.path.join(base, "raw")
+    if not os.path.isdir(raw):
+        print(f"Generating synthetic data for scale '{scale}' in {base}…")
+        generate_synthetic_dataset(base, seed=seed, **params)
+
+    raw_ffiec = os.path.join(raw, "ffiec", "extracted", "cdr")
+    nic = os.path.join(raw, "ffiec", "extracted", "nic")
+    intermediate = os.path.join(base, "intermediate", "ffiec_cdr_all_dates")
+    merged = os.path.join(base, "intermediate", "ffiec_cdr_all_dates_merged")
+    variables = extract_variables_from_mappings(mappings)
+
+    results = []
+    for rep in range(repeat):
+        profiler = enable_profiling()
+        try:
+            with profile("ingest"):
+                ingest(raw_ffiec, intermediate)
+            with profile("merge_cr_dates_fast"):
+                merge_cr_dates_fast(intermediate, merged)
+            with profile("CallReportsCleaner") as rec:
+                df = CallReportsCleaner(merged, variables, verbose=False).construct_definitions(mappings)
+                rec.frame_out(df)
+            # drop the NIC cache so the conversion is timed on every repetition
+            shutil.rmtree(nic_cache_dir(nic), ignore_errors=True)
+            with profile("nic_reference_cache"):
+                prepare_nic_reference(nic)
+            with profile("add_external_data_attributes") as rec:
+                rec.frame_in(df)
+                add_external_data_attributes(nic, df[["idrssd"]].copy())
+            with profile("create_tic_parent_df") as rec:
+                rec.frame_out(create_tic_parent_df(raw))
+        finally:
+            disable_profiling()
+
+        for r in profiler.records:
+            if r.parent is not None:
+                continue
+            results.append({
+                "operation": r.name, "scale": scale, "repeat": rep, **params,
+                "wall_s": r.wall_s, "cpu_s": r.cpu_s, "peak_rss_mb": r.peak_rss_mb,
+                "bytes_read": r.bytes_read, "bytes_written": r.bytes_written,
+                "rows_out": r.rows_out, "cols_out": r.cols_out,
+            })
+    return results
+
+
+def record_results(results, output):
+    """
+    Append benchmark results to a JSON-lines file, stamped with the commit, time and library versions,
+    so runs on different commits can be compared.
+    """
+    stamp = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+    }
+    with open(output, "a") as f:
+        for r in results:
+            f.write(json.dumps({**stamp, **r}, default=str) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic FFIEC CDR data.")
+    parser.add_argument("work_dir", help="Folder for the synthetic data (reused across runs).")
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None,
+                        help="JSON-lines file the results are appended to (default: {work_dir}/benchmark_results.jsonl).")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.work_dir, scale=args.scale, repeat=args.repeat, seed=args.seed)
+    output = args.output or os.path.join(args.work_dir, "benchmark_results.jsonl")
+    record_results(results, output)
+
+    print(pd.DataFrame(results)[["operation", "repeat", "wall_s", "cpu_s", "peak_rss_mb"]].to_string(index=False))
+    print(f"Results appended to {output}")
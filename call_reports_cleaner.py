@@ -4,16 +4,74 @@ from pandas.api.types import is_numeric_dtype
 from tqdm import tqdm
 import numpy as np
 import os
+import shutil
+
+from profiling import profile
+from combine_kernels import combine_arrays, is_numeric_column, kernel_inputs, stack_columns
+from merge_cr_dates_fast import read_sparse_codes, load_sparse_columns
+from mdrm_catalog import read_column_stats, codes_without_data
+from expressions import Expr, Plan, definition_name, from_mapping
 
 from pyparsing import col
 
+# Columns always loaded, whatever the requested variables.
+ESSENTIAL_VARS = ['IDRSSD', 'Financial Institution Name', 'Date']
+
+
+def resolve_requested_columns(cols_available, variables=None, essential_vars=ESSENTIAL_VARS, warn=True):
+    """
+    Columns to load for the requested variables: each requested base plus ANY suffix variant (e.g. _x, _y, ...).
+
+    Parameters:
+      cols_available (list): Column names available in the merged call reports.
+      variables (list, optional): Additional variable names to select (besides essential_vars).
+      essential_vars (list): Variables that are always selected.
+      warn (bool): Print a warning for requested bases that match no column.
+
+    Returns:
+      list: The matching columns, in the order of cols_available.
+    """
+    # 1) Build the initial request list
+    if variables is None:
+        vars_requested_by_user = list(essential_vars)
+    else:
+        vars_requested_by_user = list(set(list(essential_vars) + list(variables)))
+
+    # 3) Expand to include any suffix variants of each requested base.
+    #    Index every column under each base it can be a variant of: 'A_B_C' under 'A_B_C', 'A_B' and 'A'.
+    by_base = {}
+    for col in cols_available:
+        by_base.setdefault(col, []).append(col)
+        for i, ch in enumerate(col):
+            if ch == "_":
+                by_base.setdefault(col[:i], []).append(col)
+    matched = set()
+    for base in vars_requested_by_user:
+        matched.update(by_base.get(base, ()))
+    vars_requested_by_user_available_extended = [col for col in cols_available if col in matched]
+
+    # 4) Warn for bases that didn’t match anything (even with suffixes)
+    missing = [base for base in vars_requested_by_user if base not in by_base]
+    if missing and warn:
+        print(
+            "Warning: The following requested variables (and any suffix variants) "
+            "are not in the data and will be skipped:", missing
+        )
+
+    return vars_requested_by_user_available_extended
+
+
 class CallReportsCleaner:
-    def __init__(self, folder_path, variables=None, verbose=True):
+    def __init__(self, folder_path, variables=None, verbose=True, data=None):
         """
         Initialize the analysis class with the folder path where 'call_reports_all_dates.csv' is stored.
 
         Parameters:
           folder_path (str): Path to the folder containing 'call_reports_all_dates.csv'.
+          variables (list, optional): Variables to select (see select_variables).
+          verbose (bool): Print the progress of the suffix-variant merging.
+          data (pd.DataFrame, optional): Merged call reports already in memory (e.g. one partition of banks).
+                                         When given, the CSV file is not read.
 
         Attributes:
           df_selected (pd.DataFrame): DataFrame to hold the selected variables for analysis.
@@ -22,10 +80,10 @@ class CallReportsCleaner:
         
         self.folder_path = folder_path
         # Build full path for the call_reports_all_dates.csv file.
-        self.file_path = os.path.join(folder_path, "call_reports_all_dates.csv")
+        self.file_path = os.path.join(folder_path, "call_reports_all_dates.csv") if folder_path else None
 
         # Define the essential_variables.
-        self.essential_vars = ['IDRSSD', 'Financial Institution Name', 'Date']
+        self.essential_vars = ESSENTIAL_VARS.copy()
 
         # Initialize dataframes to None.
         self.df_selected = None
@@ -34,16 +92,17 @@ class CallReportsCleaner:
         self.verbose = verbose
 
         # Run select_variables straigh after initialization:
-        self.select_variables(variables)
+        self.select_variables(variables, data=data)
 
         
 
-    def select_variables(self, variables=None):
+    def select_variables(self, variables=None, data=None):
         """
         Load and clean a subset of call report columns.
 
         1) Build vars_requested_by_user: union of essential_vars + any user-specified.
-        2) Read CSV header to discover available columns.
+        2) Discover available columns from the MDRM catalog (column_stats.parquet) if present, else from
+           the CSV header (or use the columns of `data`).
         3) Expand to include ANY suffix on each base variable (e.g. _x, _y, _z, ...).
         4) Warn if a requested base (and its variants) are completely absent.
         5) Read only the selected columns into memory (minimizing I/O).
@@ -51,47 +110,56 @@ class CallReportsCleaner:
         7) For each base, sequentially merge variants into one series using combine_first,
            checking overlaps for mismatches, and then drop raw variants.
         8) Reorder so essential_vars appear first, then all other columns.
+        9) Sort the rows by (idrssd, date).
 
         Parameters:
           variables (list, optional): Additional variable names to select.
+          data (pd.DataFrame, optional): Merged call reports to select from instead of the CSV file.
 
         Returns:
           DataFrame: The cleaned and ordered DataFrame of selected variables.
         """
-        # 1) Build the initial request list
-        if variables is None:
-            vars_requested_by_user = self.essential_vars.copy()
+        # 2) Available columns: from the MDRM catalog when the merge recorded one, otherwise from the
+        #    header (plus the codes stored in long form by merge_cr_dates_fast(storage='sparse'))
+        sparse_codes, stats = [], None
+        if data is not None:
+            cols_available = data.columns
         else:
-            vars_requested_by_user = list(set(self.essential_vars + variables))
+            sparse_codes = read_sparse_codes(self.folder_path)
+            stats = read_column_stats(self.folder_path)
+            if stats is not None:
+                cols_available = ["IDRSSD", "Date"] + list(stats["mdrm"].unique())
+            else:
+                try:
+                    cols_available = pd.read_csv(self.file_path, nrows=0).columns
+                except Exception as e:
+                    raise IOError(f"Error reading file header from {self.file_path}: {e}")
+                cols_available = list(cols_available) + sparse_codes
+
+        # 1), 3), 4) Requested bases and all their suffix variants
+        vars_requested_by_user_available_extended = resolve_requested_columns(
+            cols_available, variables, self.essential_vars, warn=(data is None or self.verbose)
+        )
 
-        # 2) Peek at header
-        try:
-            cols_available = pd.read_csv(self.file_path, nrows=0).columns
-        except Exception as e:
-            raise IOError(f"Error reading file header from {self.file_path}: {e}")
-
-        # 3) Expand to include any suffix variants of each requested base
-        vars_requested_by_user_available_extended = [
-            col for col in cols_available
-            if any(col == base or col.startswith(f"{base}_") for base in vars_requested_by_user)
-        ]
-
-        # 4) Warn for bases that didn’t match anything (even with suffixes)
-        missing = [
-            base for base in vars_requested_by_user
-            if not any(col == base or col.startswith(f"{base}_") for col in vars_requested_by_user_available_extended)
-        ]
-        if missing:
-            print(
-                "Warning: The following requested variables (and any suffix variants) "
-                "are not in the data and will be skipped:", missing
-            )
+        # 4b) Warn for columns that exist but are empty in every quarter
+        if stats is not None:
+            empty = codes_without_data(stats, [c for c in vars_requested_by_user_available_extended
+                                               if c not in self.essential_vars])
+            if empty:
+                print("Warning: The following requested columns have no data in any quarter:", empty)
 
         # 5) Load only the extended set of columns
-        self.df_selected = pd.read_csv(
-            self.file_path,
-            usecols=vars_requested_by_user_available_extended
-        )
+        if data is not None:
+            self.df_selected = data[vars_requested_by_user_available_extended].copy()
+        else:
+            is_sparse = set(sparse_codes)
+            requested_sparse = [c for c in vars_requested_by_user_available_extended if c in is_sparse]
+            with profile("read_selected_columns", columns=len(vars_requested_by_user_available_extended)) as rec:
+                self.df_selected = pd.read_csv(
+                    self.file_path,
+                    usecols=[c for c in vars_requested_by_user_available_extended if c not in is_sparse]
+                )
+                rec.frame_out(self.df_selected)
 
         # 6) Coerce Date
         self.df_selected['Date'] = pd.to_datetime(
@@ -99,6 +167,13 @@ class CallReportsCleaner:
             errors='coerce'
         )
 
+        # 6b) Pivot the requested sparse codes back to wide
+        if data is None and requested_sparse:
+            with profile("load_sparse_columns", columns=len(requested_sparse)):
+                sparse = load_sparse_columns(self.folder_path, requested_sparse)
+                self.df_selected = attach_sparse_columns(self.df_selected, sparse)
+            self.df_selected = self.df_selected[vars_requested_by_user_available_extended]
+
         # 7) Sequentially merge each suffix‐variant into its base,
         cols = list(self.df_selected.columns)
         base_vars = {c.split('_', 1)[0] for c in cols}
@@ -151,6 +226,9 @@ class CallReportsCleaner:
         # substitute spaces for underscores in column names and get rid of uppercase
         self.df_selected.columns = [col.replace('_', ' ').lower() for col in self.df_selected.columns]
 
+        # 9) Order the rows by bank and report date: 'ytd_diff' differences consecutive reports of a bank
+        self.df_selected = self.df_selected.sort_values(['idrssd', 'date'], kind='mergesort').reset_index(drop=True)
+
         #! There is no need to return self.df_selected, as it is an attribute of the class
         return None
     
@@ -243,11 +321,19 @@ class CallReportsCleaner:
                 raise ValueError(f"Logic error in combine_cols: first_col='{first_col}', second_col='{second_col}', available columns={len(df.columns)}")
 
 
-    def construct_definitions(self, mappings, skip_na=True):
+    def construct_definitions(self, mappings, skip_na=True, engine="numpy", keep=None):
 
         """
         This method constructs new variables based on the provided mappings. 
         It handles cases where variables may switch MDRM codes on a specific date, and allows for different methods of combining columns.
+        With engine="numpy" (default), independent mappings are combined in batches by the NumPy kernels of
+        combine_kernels.py; engine="pandas" runs combine_cols one mapping at a time. Both give the same result.
+
+        Entries of `mappings` can also be expressions of expressions.py, aliased to the variable they define
+        (e.g. ``col("rcon2170").coalesce(col("rcfd2170")).alias("total_assets")``). With engine="plan", which is
+        used whenever an expression or `keep` is given, dicts and expressions are compiled into one plan:
+        variables built on other variables are inlined, common subexpressions are computed once, and only the
+        variables listed in `keep` (default: all) are added to the data.
         -------------------------------------- Examples --------------------------------------
         1) **Variable that changes MDRM codes** – handled with ``switch_date``
            Suppose the variable "Held-to-maturity securities" switches MDRM codes on *2019‑03‑31*:
@@ -361,67 +447,296 @@ class CallReportsCleaner:
         if self.df_selected is None:
             raise ValueError("DataFrame is not initialized. Please run select_variables() first.")
         
+        if engine != "plan" and (keep is not None or any(isinstance(m, Expr) for m in mappings)):
+            engine = "plan"
+        if engine == "plan":
+            self.df_constructed = self._construct_plan(mappings, skip_na, keep)
+            new_vars = list(dict.fromkeys(keep if keep is not None else map(definition_name, mappings)))
+            print(f"✅ Finished constructing {len(new_vars)} variables: {', '.join(new_vars)}")
+            return self.df_constructed
+
         # Pre-create all new columns at once (avoids fragmentation warnings)
         new_vars = [m["new_var"] for m in mappings]
         nan_block = pd.DataFrame(np.nan, index=self.df_selected.index, columns=new_vars)
         self.df_constructed = pd.concat([self.df_selected.copy(), nan_block], axis=1)
 
-        for mapping in tqdm(mappings, desc="Constructing variables"):
+        # Mappings only depending on raw columns and on variables of earlier levels are combined together,
+        # batched by method, on NumPy arrays. The pandas path runs one mapping at a time, in list order.
+        levels = self._dependency_levels(mappings) if engine == "numpy" else None
+        if engine == "numpy" and levels is None:
+            print("Info: some new_vars are defined twice or used before their mapping; constructing one at a time.")
 
-            new_var = mapping['new_var']
+        if levels is None:
+            for mapping in tqdm(mappings, desc="Constructing variables"):
+                self._construct_one(mapping, skip_na)
+        else:
+            for level in tqdm(levels, desc="Constructing variables", unit="level"):
+                self._construct_level(level, skip_na)
 
-            #! (Avoid adding new columns for each iteration) print(f"Processing new_var: {new_var}")
-            #self.df_constructed[new_var] = np.nan  # Initialize new variable with NaN
+        print(f"✅ Finished constructing {len(new_vars)} variables: {', '.join(new_vars)}")
 
-            # get method and columns from mapping
-            method = mapping.get('method', 'first')
-            first_col = mapping['first_col']
+        return self.df_constructed
 
-            try:
-                second_col = mapping['second_col']
-            except KeyError:
-                second_col = None
+    def _construct_plan(self, mappings, skip_na=True, keep=None):
+        """Compile dict mappings and expressions into one Plan and evaluate it on df_selected."""
+        names = [definition_name(m) for m in mappings]
+        available = set(self.df_selected.columns) | set(names)
+        definitions = [(name, m if isinstance(m, Expr) else from_mapping(m, available, skip_na))
+                       for name, m in zip(names, mappings)]
+        plan = Plan(definitions, keep)
+        if self.verbose:
+            print(f"Info: {plan.explain().splitlines()[0]}")
+        constructed = plan.execute(self.df_selected)
+        selected = self.df_selected.drop(columns=[c for c in constructed.columns if c in self.df_selected.columns])
+        return pd.concat([selected.copy(), constructed], axis=1)
+
+    def _construct_one(self, mapping, skip_na=True):
+        """Construct one mapping on the pandas path (combine_cols), writing it into df_constructed."""
+        new_var = mapping['new_var']
+
+        #! (Avoid adding new columns for each iteration) print(f"Processing new_var: {new_var}")
+        #self.df_constructed[new_var] = np.nan  # Initialize new variable with NaN
+
+        # get method and columns from mapping
+        method = mapping.get('method', 'first')
+        first_col = mapping['first_col']
 
-            # get the switch_date for the mapping we are using, set default for a future date
-            switch_date = pd.Timestamp(mapping.get('switch_date', '2100-01-01'))
+        try:
+            second_col = mapping['second_col']
+        except KeyError:
+            second_col = None
 
-            
-            # get the time frame
-            pre_mask = self.df_selected['date'] < switch_date
+        # get the switch_date for the mapping we are using, set default for a future date
+        switch_date = pd.Timestamp(mapping.get('switch_date', '2100-01-01'))
 
-            # use df_constructed to create the new variable
+        
+        # get the time frame
+        pre_mask = self.df_selected['date'] < switch_date
+
+        # use df_constructed to create the new variable
+        with profile("construct_variable", new_var=new_var, method=method):
             self.df_constructed.loc[pre_mask, new_var] = self.combine_cols(
-                self.df_constructed.loc[pre_mask],
+                self.df_constructed.loc[pre_mask, self._input_columns(first_col, second_col)],
                 first_col,
                 second_col,
                 method,
                 skip_na=skip_na
             )
 
-            if 'switch_date' in mapping:
-                
-                method_post = mapping.get('method_post', method)
+        if 'switch_date' in mapping:
+            
+            method_post = mapping.get('method_post', method)
 
-                if 'first_col_post' not in mapping:
-                    raise ValueError(
-                        "Mapping must include 'first_col_post' for post-switch calculations."
-                    )
-                first_col_post = mapping['first_col_post']
-                second_col_post = mapping.get('second_col_post', None)
+            if 'first_col_post' not in mapping:
+                raise ValueError(
+                    "Mapping must include 'first_col_post' for post-switch calculations."
+                )
+            first_col_post = mapping['first_col_post']
+            second_col_post = mapping.get('second_col_post', None)
 
-                # treat the post-switch date
-                post_mask = self.df_selected['date'] >= switch_date
+            # treat the post-switch date
+            post_mask = self.df_selected['date'] >= switch_date
 
-                # use df_constructed to create the new variable after the switch date
+            # use df_constructed to create the new variable after the switch date
+            with profile("construct_variable", new_var=new_var, method=method_post, post_switch=True):
                 self.df_constructed.loc[post_mask, new_var] = self.combine_cols(
-                    self.df_constructed.loc[post_mask],
+                    self.df_constructed.loc[post_mask, self._input_columns(first_col_post, second_col_post)],
                     first_col_post,
                     second_col_post,
                     method_post,
                     skip_na=skip_na
                 )
 
-        print(f"✅ Finished constructing {len(new_vars)} variables: {', '.join(new_vars)}")
-
-        return self.df_constructed
+    def _input_columns(self, first_col, second_col):
+        """Columns combine_cols may read for these inputs (the ones that exist), plus the bank and date keys."""
+        cols = list(first_col) if isinstance(first_col, (list, tuple)) else [first_col]
+        cols += [second_col, 'idrssd', 'date']
+        return list(dict.fromkeys(c for c in cols if isinstance(c, str) and c in self.df_constructed.columns))
 
+    def _dependency_levels(self, mappings):
+        """
+        Group the mappings into levels: level 0 only uses columns of df_selected, level L uses new_vars of
+        levels < L. Returns None when a new_var is defined twice, shadows a selected column, or is used
+        before its mapping, since the result then depends on the list order.
+        """
+        new_vars = [m["new_var"] for m in mappings]
+        if len(set(new_vars)) != len(new_vars) or set(new_vars) & set(self.df_selected.columns):
+            return None
+        new_var_set = set(new_vars)
+        level_of, levels = {}, []
+        for mapping in mappings:
+            refs = []
+            for key in ("first_col", "second_col", "first_col_post", "second_col_post"):
+                value = mapping.get(key)
+                refs.extend(value if isinstance(value, (list, tuple)) else [value])
+            deps = [r for r in refs if isinstance(r, str) and r in new_var_set]
+            if any(d not in level_of for d in deps):
+                return None
+            level = 1 + max((level_of[d] for d in deps), default=-1)
+            level_of[mapping["new_var"]] = level
+            if level == len(levels):
+                levels.append([])
+            levels[level].append(mapping)
+        return levels
+
+    def _kernel_parts(self, mapping):
+        """
+        [(part, method, input columns), …] for the pre-switch ('pre') and post-switch ('post') parts of a
+        mapping, or None when a part needs the pandas path (ytd_diff, missing or non-numeric columns, …).
+        """
+        method = mapping.get('method', 'first')
+        parts = [("pre", method, kernel_inputs(mapping['first_col'], mapping.get('second_col'), method))]
+        if 'switch_date' in mapping:
+            if 'first_col_post' not in mapping:
+                return None
+            method_post = mapping.get('method_post', method)
+            parts.append(("post", method_post,
+                          kernel_inputs(mapping['first_col_post'], mapping.get('second_col_post'), method_post)))
+        for _, _, cols in parts:
+            if cols is None or any(c not in self.df_constructed.columns for c in cols):
+                return None
+            if not all(is_numeric_column(self.df_constructed, c) for c in cols):
+                return None
+        return parts
+
+    def _construct_level(self, level, skip_na=True, batch_bytes=2**26):
+        """
+        Construct mappings that do not depend on each other: parts with the same method and number of
+        inputs are stacked into (mappings, inputs, rows) arrays of at most `batch_bytes` and combined
+        in one kernel call each; the pre/post-switch parts are then put together with the date masks.
+        """
+        n = len(self.df_constructed)
+        groups, kernel_mappings = {}, []
+        for mapping in level:
+            parts = self._kernel_parts(mapping)
+            if parts is None:
+                self._construct_one(mapping, skip_na)
+                continue
+            kernel_mappings.append(mapping)
+            for part, method, cols in parts:
+                groups.setdefault((method, len(cols)), []).append((mapping['new_var'], part, cols))
+
+        results = {}
+        for (method, k), items in groups.items():
+            size = max(1, batch_bytes // (8 * k * max(n, 1)))
+            for i in range(0, len(items), size):
+                batch = items[i:i + size]
+                with profile("construct_batch", method=method, mappings=len(batch)) as rec:
+                    x = stack_columns(self.df_constructed, [cols for _, _, cols in batch])
+                    out = combine_arrays(method, x, skip_na)
+                    rec.rows_out, rec.cols_out = n, len(batch)
+                for (new_var, part, _), values in zip(batch, out):
+                    results[(new_var, part)] = values
+
+        dates = self.df_constructed['date']
+        for mapping in kernel_mappings:
+            new_var = mapping['new_var']
+            switch_date = pd.Timestamp(mapping.get('switch_date', '2100-01-01'))
+            value = np.full(n, np.nan)
+            pre_mask = (dates < switch_date).to_numpy()
+            value[pre_mask] = results[(new_var, "pre")][pre_mask]
+            if 'switch_date' in mapping:
+                post_mask = (dates >= switch_date).to_numpy()
+                value[post_mask] = results[(new_var, "post")][post_mask]
+            self.df_constructed[new_var] = value
+
+
+
+def attach_sparse_columns(df, sparse):
+    """
+    Left-join sparse codes pivoted back to wide (see load_sparse_columns) onto `df` by (IDRSSD, Date).
+    """
+    codes = [c for c in sparse.columns if c not in ("IDRSSD", "Date")]
+    sparse = sparse.assign(Date=pd.to_datetime(sparse["Date"]))
+    keys = pd.DataFrame({"IDRSSD": pd.to_numeric(df["IDRSSD"], errors="coerce"), "Date": pd.to_datetime(df["Date"])})
+    matched = keys.merge(sparse, on=["IDRSSD", "Date"], how="left")
+    return pd.concat([df, pd.DataFrame(matched[codes].to_numpy(), index=df.index, columns=codes)], axis=1)
+
+
+def estimate_csv_rows(file_path, sample_lines=2000):
+    """
+    Estimate the number of data rows of a large CSV from its size and the length of its first lines.
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        f.readline()  # header
+        sample = [len(f.readline()) for _ in range(sample_lines)]
+    sample = [n for n in sample if n > 0]
+    if not sample:
+        return 0
+    return int(size / (sum(sample) / len(sample)))
+
+
+def construct_definitions_partitioned(folder_path, variables, mappings, output_dir, n_partitions,
+                                      chunk_rows, verbose=False, budget=None):
+    """
+    Memory-bounded equivalent of CallReportsCleaner(folder_path, variables).construct_definitions(mappings).
+
+    1) Stream the selected columns of 'call_reports_all_dates.csv' in chunks of `chunk_rows` rows and
+       spill each chunk to disk, split into `n_partitions` partitions by IDRSSD (IDRSSD % n_partitions).
+    2) Clean and construct each partition on its own and write it as 'part-{k:05d}.parquet'.
+
+    All the rows of a bank land in the same partition, in their original order, so the methods that work
+    within a bank (e.g. 'ytd_diff') give the same results as on the full dataset. Only one partition is
+    in memory at a time.
+
+    Parameters:
+      folder_path (str): Folder containing 'call_reports_all_dates.csv'.
+      variables (list): Variables to select (as in CallReportsCleaner).
+      mappings (list): Variable definitions (as in construct_definitions).
+      output_dir (str): Folder for the constructed partitions (a '_spill' subfolder is used meanwhile).
+      n_partitions (int): Number of bank partitions.
+      chunk_rows (int): Rows read from the CSV at a time.
+      verbose (bool): Passed to CallReportsCleaner.
+      budget (MemoryBudget, optional): Checked after every chunk and every partition.
+
+    Returns:
+      list: Paths of the constructed partition files.
+    """
+    file_path = os.path.join(folder_path, "call_reports_all_dates.csv")
+    spill_dir = os.path.join(output_dir, "_spill")
+    shutil.rmtree(spill_dir, ignore_errors=True)
+    os.makedirs(spill_dir)
+
+    # 1) Spill the selected columns by partition (sparse codes are pivoted back to wide chunk by chunk)
+    sparse_codes = read_sparse_codes(folder_path)
+    cols_available = list(pd.read_csv(file_path, nrows=0).columns) + sparse_codes
+    selected = resolve_requested_columns(cols_available, variables)
+    is_sparse = set(sparse_codes)
+    requested_sparse = [c for c in selected if c in is_sparse]
+    usecols = [c for c in selected if c not in is_sparse]
+    sparse = load_sparse_columns(folder_path, requested_sparse) if requested_sparse else None
+    reader = pd.read_csv(file_path, usecols=usecols, chunksize=chunk_rows, low_memory=False)
+    for i, chunk in enumerate(tqdm(reader, desc="Spilling partitions", unit="chunk")):
+        if requested_sparse:
+            chunk = attach_sparse_columns(chunk, sparse)[selected]
+        part = pd.to_numeric(chunk["IDRSSD"], errors="coerce").fillna(0).astype("int64") % n_partitions
+        for k, rows in chunk.groupby(part.to_numpy(), sort=False):
+            part_dir = os.path.join(spill_dir, f"part-{k:05d}")
+            os.makedirs(part_dir, exist_ok=True)
+            rows.to_parquet(os.path.join(part_dir, f"chunk-{i:06d}.parquet"), index=False)
+        del chunk
+        if budget is not None:
+            budget.check("construct (spill)")
+
+    # 2) Construct every partition
+    outputs = []
+    for k in tqdm(range(n_partitions), desc="Constructing partitions", unit="part"):
+        part_dir = os.path.join(spill_dir, f"part-{k:05d}")
+        if not os.path.isdir(part_dir):
+            continue
+        chunk_files = sorted(os.listdir(part_dir))
+        data = pd.concat([pd.read_parquet(os.path.join(part_dir, f)) for f in chunk_files], ignore_index=True)
+        crc = CallReportsCleaner(None, variables, verbose=verbose, data=data)
+        del data
+        df = crc.construct_definitions(mappings)
+        out = os.path.join(output_dir, f"part-{k:05d}.parquet")
+        df.to_parquet(out, index=False)
+        outputs.append(out)
+        del crc, df
+        shutil.rmtree(part_dir)
+        if budget is not None:
+            budget.check(f"construct (partition {k})")
+
+    shutil.rmtree(spill_dir, ignore_errors=True)
+    return outputs
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+# combine_cols methods with a NumPy kernel. 'ytd_diff' works within banks and years and stays on pandas.
+KERNEL_METHODS = ("first", "secondary", "sum", "min", "max", "mean", "ratio", "rename")
+
+
+def combine_arrays(method, x, skip_na=True):
+    """
+    NumPy equivalent of CallReportsCleaner.combine_cols on stacked float arrays.
+
+    The inputs are stacked along the second-to-last axis, so one call can combine many mappings
+    of the same method at once: x has shape (k, n) for one mapping with k input columns of n rows,
+    or (m, k, n) for m mappings, and the result has shape (n,) or (m, n).
+
+    Missing values are NaN. As in combine_cols:
+      - first / secondary: first non-missing value, left to right / right to left;
+      - sum: NaN counts as 0 when skip_na (all-missing rows give 0), otherwise propagates;
+      - min / max / mean: ignore NaN when skip_na (all-missing rows give NaN), otherwise propagate;
+      - ratio: x[0] / x[1], with a missing numerator as 0 when skip_na and a zero denominator as NaN;
+      - rename: x[0].
+    """
+    x = np.asarray(x, dtype="float64")
+    if method == "rename":
+        return x[..., 0, :].copy()
+    if method in ("first", "secondary"):
+        order = range(x.shape[-2]) if method == "first" else range(x.shape[-2] - 1, -1, -1)
+        order = list(order)
+        out = x[..., order[0], :].copy()
+        for j in order[1:]:
+            missing = np.isnan(out)
+            out[missing] = x[..., j, :][missing]
+        return out
+    if method == "sum":
+        return np.nansum(x, axis=-2) if skip_na else np.sum(x, axis=-2)
+    if method in ("min", "max"):
+        if skip_na:
+            return (np.fmin if method == "min" else np.fmax).reduce(x, axis=-2)
+        return np.min(x, axis=-2) if method == "min" else np.max(x, axis=-2)
+    if method == "mean":
+        if not skip_na:
+            return np.mean(x, axis=-2)
+        filled = ~np.isnan(x)
+        count = filled.sum(axis=-2)
+        total = np.where(filled, x, 0.0).sum(axis=-2)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(count > 0, total / count, np.nan)
+    if method == "ratio":
+        num = x[..., 0, :]
+        if skip_na:
+            num = np.where(np.isnan(num), 0.0, num)
+        den = x[..., 1, :]
+        den = np.where(den == 0, np.nan, den)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return num / den
+    raise ValueError(f"No kernel for method '{method}'")
+
+
+def kernel_inputs(first_col, second_col, method):
+    """
+    Input columns of a mapping when it can run on a kernel, else None (the pandas path then
+    handles it, including its errors and messages for missing columns).
+    """
+    if method not in KERNEL_METHODS:
+        return None
+    if method == "sum":
+        if isinstance(first_col, (list, tuple)):
+            return list(first_col)
+        return [first_col, second_col] if second_col else [first_col]
+    if isinstance(first_col, (list, tuple)):
+        return None
+    if method == "rename":
+        return [first_col]
+    return [first_col, second_col] if second_col else None
+
+
+def is_numeric_column(df, col):
+    s = df[col]
+    return not isinstance(s, pd.DataFrame) and is_numeric_dtype(s.dtype)
+
+
+def column_array(df, col):
+    """A numeric column as a float64 array, without a copy when it is already float64."""
+    s = df[col]
+    if s.dtype == "float64":
+        return s.to_numpy()
+    return s.to_numpy(dtype="float64", na_value=np.nan)
+
+
+def stack_columns(df, batch):
+    """Gather the input columns of a batch of mappings into one (mappings, inputs, rows) float64 array."""
+    x = np.empty((len(batch), len(batch[0]), len(df)))
+    for i, cols in enumerate(batch):
+        for j, col in enumerate(cols):
+            x[i, j] = column_array(df, col)
+    return x
@@ -0,0 +1,250 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+from panel_store import open_panel, iter_report_dates, frame_digest
+from panel_windows import quarter_number
+from expressions import Expr, definition_name
+from stage_graph import content_digest
+from profiling import profile
+
+# Aggregations of a rule: a name, or ("wmean", weight column) for a mean weighted by another variable
+AGGREGATIONS = ("sum", "mean", "min", "max", "first", "count", "wmean")
+
+# Bookkeeping of a consolidated folder: the rules and the digest of the bank rows behind every quarter
+MANIFEST_FILE = "_consolidation.json"
+
+
+def default_rules(mappings, carry=("tic", "permco")):
+    """
+    Aggregation rules for the variables of mappings.py:
+      - 'sum' for every new_var (balance-sheet stocks and quarterly flows add up across subsidiaries);
+      - ('wmean', denominator) for a 'ratio' mapping, so that the consolidated value is
+        sum(numerator) / sum(denominator), the ratio of the consolidated figures;
+      - 'first' for the `carry` columns, which describe the holding company itself.
+
+    Returns:
+        dict: variable → rule, in the order of the mappings.
+    """
+    rules = {}
+    for m in mappings:
+        name = definition_name(m)
+        if not isinstance(m, Expr) and m.get("method") == "ratio" and m.get("second_col"):
+            rules[name] = ("wmean", m["second_col"])
+        else:
+            rules[name] = "sum"
+    for col in carry:
+        rules[col] = "first"
+    return rules
+
+
+def _parse_rule(var, rule):
+    how, weight = (rule[0], rule[1]) if isinstance(rule, (list, tuple)) else (rule, None)
+    if how not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation '{how}' for '{var}' (expected one of {AGGREGATIONS}).")
+    if (how == "wmean") != (weight is not None):
+        raise ValueError(f"'{var}': a weighted mean is written ('wmean', weight column), other rules take no weight.")
+    return how, weight
+
+
+def consolidate(df, rules, parent_col="top_parent_idrssd", date_col="date"):
+    """
+    Aggregate a bank-level panel to the (holding company, report date) level in one sort-based pass.
+
+    The rows are sorted once on a (parent, quarter) key; every group is then a contiguous slice, and each
+    aggregation is one NumPy reduceat over all groups and all the variables that share it. Missing values
+    are ignored: a group whose banks are all missing a variable gets NaN (0 banks for 'count').
+
+    Rules (variable → aggregation):
+      'sum', 'mean', 'min', 'max'   of the banks with a value
+      'count'                       number of banks with a value
+      'first'                       value of the first bank (lowest idrssd) with one; any column type
+      ('wmean', weight)             mean weighted by another column, over the banks where both are known
+
+    Banks without a parent (parent_col missing) are left out.
+
+    Parameters:
+      df (pd.DataFrame): Bank panel with parent_col, date_col and the variables (e.g. after add_external_data_tic).
+      rules (dict): Variable → rule (see default_rules). Rules of missing columns are skipped with a warning.
+      parent_col, date_col (str): Grouping columns.
+
+    Returns:
+        pd.DataFrame: One row per parent and date, sorted, with parent_col, date_col, 'n_banks'
+                      and one column per rule.
+    """
+    parsed = {v: _parse_rule(v, r) for v, r in rules.items()}
+    missing = [v for v, (_, w) in parsed.items() if v not in df.columns or (w is not None and w not in df.columns)]
+    if missing:
+        print(f"Warning: not consolidated (column or weight missing): {missing}")
+    parsed = {v: r for v, r in parsed.items() if v not in missing}
+    not_numeric = [v for v, (how, _) in parsed.items() if how != "first" and not is_numeric_dtype(df[v].dtype)]
+    if not_numeric:
+        raise TypeError(f"Only 'first' applies to non-numeric columns: {not_numeric}")
+
+    df = df[df[parent_col].notna() & df[date_col].notna()]
+    with profile("consolidate", rows=len(df), variables=len(parsed)) as rec:
+        # 1) One sort on (parent, quarter), then the start of every group
+        parents = df[parent_col].to_numpy("int64")
+        keys = parents * 2**20 + quarter_number(df[date_col])
+        order = np.lexsort((df["idrssd"].to_numpy("int64"), keys)) if "idrssd" in df else np.argsort(keys, kind="stable")
+        keys = keys[order]
+        starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]])) if len(keys) else np.array([], "int64")
+
+        out = pd.DataFrame({parent_col: parents[order][starts],
+                            date_col: df[date_col].to_numpy()[order][starts],
+                            "n_banks": np.diff(np.append(starts, len(keys))).astype("int64")})
+
+        def values(cols):
+            return df[cols].to_numpy(dtype="float64", na_value=np.nan)[order]
+
+        def reduce(ufunc, x):
+            if not len(starts):
+                return np.empty((0,) + x.shape[1:])
+            return ufunc.reduceat(x, starts, axis=0)
+
+        results = {}
+        # 2) sum / mean / count: totals and counts of the known values, for every such variable at once
+        plain = [v for v, (how, _) in parsed.items() if how in ("sum", "mean", "count")]
+        if plain:
+            x = values(plain)
+            known = ~np.isnan(x)
+            total = reduce(np.add, np.where(known, x, 0.0))
+            count = reduce(np.add, known.astype("int64"))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = total / count
+            for j, v in enumerate(plain):
+                how = parsed[v][0]
+                if how == "count":
+                    results[v] = count[:, j]
+                else:
+                    results[v] = np.where(count[:, j] > 0, total[:, j] if how == "sum" else mean[:, j], np.nan)
+
+        # 3) min / max: fmin / fmax skip NaN
+        for how, ufunc in (("min", np.fmin), ("max", np.fmax)):
+            cols = [v for v, (h, _) in parsed.items() if h == how]
+            if cols:
+                res = reduce(ufunc, values(cols))
+                results.update({v: res[:, j] for j, v in enumerate(cols)})
+
+        # 4) Weighted means: sum(x * w) / sum(w) over the rows where both are known
+        weighted = [(v, w) for v, (h, w) in parsed.items() if h == "wmean"]
+        if weighted:
+            x = values([v for v, _ in weighted])
+            w = values([w for _, w in weighted])
+            both = ~(np.isnan(x) | np.isnan(w))
+            num = reduce(np.add, np.where(both, x * w, 0.0))
+            den = reduce(np.add, np.where(both, w, 0.0))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                res = np.where(den != 0, num / den, np.nan)
+            results.update({v: res[:, j] for j, (v, _) in enumerate(weighted)})
+
+        # 5) first: position of the first known value of each group (len(keys) when there is none)
+        if len(starts):
+            stops = np.append(starts[1:], len(keys))
+            for v in [v for v, (h, _) in parsed.items() if h == "first"]:
+                col = df[v].iloc[order]
+                pos = np.minimum.reduceat(np.where(col.notna().to_numpy(), np.arange(len(keys)), len(keys)), starts)
+                found = pos < stops
+                first = col.iloc[np.where(found, pos, starts)].reset_index(drop=True)
+                results[v] = first.where(found)
+        else:
+            results.update({v: df[v].iloc[:0].reset_index(drop=True) for v, (h, _) in parsed.items() if h == "first"})
+
+        out = pd.concat([out, pd.DataFrame({v: results[v] for v in parsed}, index=out.index)], axis=1)
+        rec.frame_out(out)
+    return out
+
+
+def _quarter_file(out_dir, quarter):
+    return os.path.join(out_dir, f"date={quarter}.parquet")
+
+
+def consolidate_panel(panel_dir, out_dir, rules, parent_col="top_parent_idrssd"):
+    """
+    Consolidate the clean panel to the holding-company level, one report date at a time:
+
+        out_dir/
+            date=2019-12-31.parquet   (top_parent_idrssd, date, n_banks, variables) of one report date
+            ...
+            _consolidation.json       rules digest and digest of the bank rows behind every report date
+
+    Incremental by quarter: a report date is consolidated again only when its bank rows (the parent,
+    the variables and their weights) or the rules changed, so adding a quarter to the panel consolidates
+    that quarter alone. Report dates no longer in the panel are removed.
+
+    Parameters:
+      panel_dir (str): Folder written by PanelWriter (after add_external_data_tic).
+      out_dir (str): Output folder.
+      rules (dict): Variable → rule (see consolidate and default_rules).
+      parent_col (str): Parent identifier.
+
+    Returns:
+        list: Report dates ('YYYY-MM-DD') that were (re)consolidated.
+    """
+    columns = [parent_col] + list(dict.fromkeys(
+        [v for v in rules] + [r[1] for r in rules.values() if isinstance(r, (list, tuple))]))
+    schema_names = set(open_panel(panel_dir).schema.names)
+    if parent_col not in schema_names:
+        raise KeyError(f"'{parent_col}' is not a column of {panel_dir}: run add_external_data_tic first.")
+    # Missing columns are reported by consolidate()
+    columns = [c for c in columns if c in schema_names]
+
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    rules_digest = content_digest({"rules": rules, "parent": parent_col})
+    done = manifest.get("quarters", {}) if manifest.get("rules") == rules_digest else {}
+
+    # 1) The panel one report date at a time; unchanged bank rows and rules keep their consolidated file
+    updated, digests = [], {}
+    for q, rows in iter_report_dates(panel_dir, columns):
+        digests[q] = frame_digest(rows)
+        if done.get(q) == digests[q] and os.path.exists(_quarter_file(out_dir, q)):
+            continue
+        consolidate(rows, rules, parent_col=parent_col).to_parquet(_quarter_file(out_dir, q), index=False)
+        updated.append(q)
+
+    # 2) Report dates that left the panel
+    for name in os.listdir(out_dir):
+        if name.startswith("date=") and name[len("date="):-len(".parquet")] not in digests:
+            os.remove(os.path.join(out_dir, name))
+
+    with open(manifest_path, "w") as f:
+        json.dump({"rules": rules_digest, "parent": parent_col, "quarters": digests}, f, indent=2)
+    print(f"Info: consolidated {len(updated)} of {len(digests)} report dates to {parent_col} in {out_dir}")
+    return updated
+
+
+def read_consolidated(out_dir, columns=None, start=None, end=None):
+    """
+    Read the holding-company panel written by consolidate_panel().
+
+    Args:
+        out_dir (str): Folder written by consolidate_panel.
+        columns (list[str], optional): Columns to read (the parent, 'date' and 'n_banks' are always included).
+        start, end (str or datetime, optional): Inclusive range of report dates.
+
+    Returns:
+        pd.DataFrame: Sorted by report date and parent.
+    """
+    with open(os.path.join(out_dir, MANIFEST_FILE)) as f:
+        parent_col = json.load(f)["parent"]
+    if columns is not None:
+        columns = [parent_col, "date", "n_banks"] + [c for c in columns if c not in (parent_col, "date", "n_banks")]
+    frames = []
+    for name in sorted(os.listdir(out_dir)):
+        if not name.startswith("date="):
+            continue
+        date = pd.Timestamp(name[len("date="):-len(".parquet")])
+        if (start is not None and date < pd.Timestamp(start)) or (end is not None and date > pd.Timestamp(end)):
+            continue
+        frames.append(pd.read_parquet(os.path.join(out_dir, name), columns=columns))
+    if not frames:
+        return pd.DataFrame(columns=columns or [parent_col, "date", "n_banks"])
+    return pd.concat(frames, ignore_index=True)
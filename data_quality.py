@@ -0,0 +1,234 @@
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from panel_store import open_panel, read_panel
+from panel_windows import PanelWindow
+from profiling import profile
+
+# Kinds of checks:
+#   identity      lhs equals the sum of rhs, within max(abs_tol, rel_tol * |lhs|)
+#   bound         the sum of rhs does not exceed lhs, within the same tolerance
+#   non_negative  every column is >= 0
+#   jump          quarter-over-quarter change of every column: x_t / x_{t-1} above 1 + threshold or below
+#                 1 / (1 + threshold), between consecutive quarters of the same bank with positive values
+# Identities and bounds are evaluated on the rows where lhs and every rhs are known.
+KINDS = ("identity", "bound", "non_negative", "jump")
+
+checks = [
+    # Balance sheet: assets = liabilities + equity capital (the tolerance absorbs minority interests)
+    {
+        "name":     "balance_sheet",
+        "kind":     "identity",
+        "lhs":      "total_assets",
+        "rhs":      ["total_liabilities", "total_equity_capital"],
+        "rel_tol":  0.01,
+    },
+    # Cash and balances due (rcon0010) = currency and coin + interest-bearing balances
+    {
+        "name":     "cash_components",
+        "kind":     "identity",
+        "lhs":      "cash1",
+        "rhs":      ["cash2"],
+        "rel_tol":  0.01,
+    },
+    {
+        "name":     "loans_within_assets",
+        "kind":     "bound",
+        "lhs":      "total_assets",
+        "rhs":      ["total_loans"],
+    },
+    {
+        "name":     "deposits_within_liabilities",
+        "kind":     "bound",
+        "lhs":      "total_liabilities",
+        "rhs":      ["total_deposits"],
+    },
+    {
+        "name":     "securities_within_assets",
+        "kind":     "bound",
+        "lhs":      "total_assets",
+        "rhs":      ["securities_htm_ac", "securities_afs_fv"],
+    },
+    {
+        "name":     "interest_income_components",
+        "kind":     "bound",
+        "lhs":      "total_interest_income",
+        "rhs":      ["interest_income_loans_leases", "interest_income_securities"],
+    },
+    {
+        "name":     "noninterest_expense_components",
+        "kind":     "bound",
+        "lhs":      "total_noninterest_expenses",
+        "rhs":      ["salaries_expenses", "premises_fixed_assets_expenses"],
+    },
+    {
+        "name":     "non_negative_balances",
+        "kind":     "non_negative",
+        "columns":  ["total_assets", "total_loans", "total_deposits", "cash"],
+    },
+    # Total assets, loans or deposits doubling or halving in a quarter
+    {
+        "name":     "balance_sheet_jump",
+        "kind":     "jump",
+        "columns":  ["total_assets", "total_loans", "total_deposits"],
+        "threshold": 1.0,
+    },
+]
+
+VIOLATION_COLUMNS = ["idrssd", "date", "check", "variable", "value", "expected", "deviation"]
+
+
+def check_columns(checks):
+    """Columns read by a list of checks."""
+    cols = []
+    for check in checks:
+        cols += [check["lhs"], *check["rhs"]] if check["kind"] in ("identity", "bound") else check["columns"]
+    return list(dict.fromkeys(cols))
+
+
+def _available(checks, columns):
+    """The checks whose columns are all in `columns`; the others are reported and dropped."""
+    kept = []
+    for check in checks:
+        if check.get("kind") not in KINDS:
+            raise ValueError(f"Unknown kind '{check.get('kind')}' of check '{check.get('name')}' (expected one of {KINDS}).")
+        missing = [c for c in check_columns([check]) if c not in columns]
+        if missing:
+            print(f"Warning: check '{check['name']}' skipped, missing columns: {missing}")
+        else:
+            kept.append(check)
+    return kept
+
+
+def _relative(value, expected):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (value - expected) / np.abs(np.where(expected == 0, np.nan, expected))
+
+
+def check_panel(df, checks=checks):
+    """
+    Evaluate declarative accounting identities, bounds and jump detectors on every row of a panel at once.
+
+    All the columns of the checks are gathered once into a float matrix. The identities and bounds are then
+    a single matrix product (the sums of their right-hand sides) and comparison, the non-negativity checks
+    one comparison, and the jump detectors one lag of every column on PanelWindow.
+
+    Parameters:
+      df (pd.DataFrame): Panel with 'idrssd', 'date' and the columns of the checks. Checks with missing
+                         columns are skipped with a warning.
+      checks (list): Check definitions (see the module `checks`).
+
+    Returns:
+        pd.DataFrame: One row per violation, sorted by idrssd, date and check:
+                      idrssd, date, check, variable (lhs or checked column), value, expected
+                      (sum of rhs, bound, 0 or previous quarter's value) and deviation
+                      (relative difference for identities, bounds and jumps, the value itself for non_negative).
+    """
+    checks = _available(checks, set(df.columns))
+    cols = check_columns(checks)
+    col_index = {c: j for j, c in enumerate(cols)}
+    with profile("check_panel", rows=len(df), checks=len(checks)) as rec:
+        x = df[cols].to_numpy(dtype="float64", na_value=np.nan)
+        known = ~np.isnan(x)
+        filled = np.where(known, x, 0.0)
+        found = []  # (rows, check, variable, value, expected, deviation) of every violation
+
+        # 1) Identities and bounds: rhs sums as one product with a (columns × checks) 0/1 matrix
+        linear = [c for c in checks if c["kind"] in ("identity", "bound")]
+        if linear:
+            weights = np.zeros((len(cols), len(linear)))
+            for k, check in enumerate(linear):
+                for col in check["rhs"]:
+                    weights[col_index[col], k] += 1
+            lhs_idx = [col_index[c["lhs"]] for c in linear]
+            rhs = filled @ weights
+            complete = ((~known).astype("float64") @ weights == 0) & known[:, lhs_idx]
+            lhs = x[:, lhs_idx]
+            tol = np.maximum([c.get("abs_tol", 1.0) for c in linear], np.abs(lhs) * [c.get("rel_tol", 0.0) for c in linear])
+            is_identity = np.array([c["kind"] == "identity" for c in linear])
+            with np.errstate(invalid="ignore"):
+                bad = complete & np.where(is_identity, np.abs(lhs - rhs) > tol, rhs - lhs > tol)
+            for k, check in enumerate(linear):
+                rows = np.flatnonzero(bad[:, k])
+                value, expected = (lhs[rows, k], rhs[rows, k]) if check["kind"] == "identity" else (rhs[rows, k], lhs[rows, k])
+                found.append((rows, check["name"], check["lhs"], value, expected, _relative(value, expected)))
+
+        # 2) Non-negative columns
+        for check in (c for c in checks if c["kind"] == "non_negative"):
+            idx = [col_index[c] for c in check["columns"]]
+            with np.errstate(invalid="ignore"):
+                rows, j = np.nonzero(x[:, idx] < 0)
+            for jj, col in enumerate(check["columns"]):
+                r = rows[j == jj]
+                value = x[r, idx[jj]]
+                found.append((r, check["name"], col, value, np.zeros(len(r)), value))
+
+        # 3) Jumps between consecutive quarters of a bank
+        jumps = [c for c in checks if c["kind"] == "jump"]
+        if jumps:
+            window = PanelWindow(df)
+            for check in jumps:
+                idx = [col_index[c] for c in check["columns"]]
+                prev = window.lag(check["columns"], 1).to_numpy()
+                cur = x[:, idx]
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    ratio = cur / prev
+                    bad = (cur > 0) & (prev > 0) & ((ratio > 1 + check["threshold"]) | (ratio < 1 / (1 + check["threshold"])))
+                for jj, col in enumerate(check["columns"]):
+                    r = np.flatnonzero(bad[:, jj])
+                    found.append((r, check["name"], col, cur[r, jj], prev[r, jj], ratio[r, jj] - 1))
+
+        # 4) One compact table
+        frames = []
+        for rows, name, variable, value, expected, deviation in found:
+            if not len(rows):
+                continue
+            frames.append(pd.DataFrame({"idrssd": df["idrssd"].to_numpy()[rows], "date": df["date"].to_numpy()[rows],
+                                        "check": name, "variable": variable, "value": value,
+                                        "expected": expected, "deviation": deviation}))
+        if not frames:
+            out = pd.DataFrame({c: pd.Series(dtype="float64") for c in VIOLATION_COLUMNS})
+        else:
+            out = pd.concat(frames, ignore_index=True)
+            out = out.sort_values(["idrssd", "date", "check"], kind="mergesort").reset_index(drop=True)
+        rec.frame_out(out)
+    return out
+
+
+def run_quality_checks(panel_dir, output_path, checks=checks):
+    """
+    Run the checks on the clean panel, reading only their columns, and save the violations as Parquet.
+
+    Args:
+        panel_dir (str): Folder written by PanelWriter.
+        output_path (str): Parquet file of the violations (see check_panel).
+        checks (list): Check definitions (default: the module `checks`).
+
+    Returns:
+        pd.DataFrame: The violations.
+    """
+    available = set(open_panel(panel_dir).schema.names)
+    checks = _available(checks, available)
+    df = read_panel(panel_dir, columns=check_columns(checks))
+    violations = check_panel(df, checks)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    violations.to_parquet(output_path, index=False)
+
+    n_rows = violations[["idrssd", "date"]].drop_duplicates().shape[0]
+    print(f"Info: data quality: {len(violations)} violations in {n_rows} of {len(df)} bank-quarters, saved to {output_path}")
+    for name, count in violations["check"].value_counts().items():
+        print(f"    {name}: {count}")
+    return violations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check accounting identities and quarter-over-quarter jumps in the clean panel.")
+    parser.add_argument("panel_dir", help="Clean panel folder (e.g. data/clean/final_call_reports_dataset).")
+    parser.add_argument("--output", metavar="PATH", default="data_quality_violations.parquet",
+                        help="Parquet file of the violations (default: data_quality_violations.parquet).")
+    args = parser.parse_args()
+
+    run_quality_checks(args.panel_dir, args.output)
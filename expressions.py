@@ -0,0 +1,444 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+from profiling import profile
+from combine_kernels import combine_arrays
+
+# Mapping keys that hold input columns
+MAPPING_KEYS = ("first_col", "second_col", "first_col_post", "second_col_post")
+
+# Operations whose result does not depend on the order of their two operands
+_COMMUTATIVE = {"add", "mul"}
+
+
+class Expr:
+    """
+    A lazy expression over the columns of the selected call reports.
+
+    Expressions are only descriptions: nothing is computed until they are compiled into a Plan
+    together with the other definitions and executed. Build them with col() and lit() and combine
+    them with the functions below or the arithmetic operators:
+
+        total_assets = col("rcon2170").coalesce(col("rcfd2170")).alias("total_assets")
+        securities_gains = total(col("riad3521").ytd_diff(), col("riad3196").ytd_diff()).alias("realized_gains_losses_securities")
+        loans_to_assets = ratio(col("total_loans"), col("total_assets")).alias("loans_to_assets")
+
+    A col() may name an MDRM column or a variable defined earlier in the same list of definitions;
+    the latter is replaced by its definition when the plan is compiled.
+
+    Missing values are NaN. The arithmetic operators (+, -, *, /) propagate them, and a division by zero
+    gives NaN (as the 'ratio' method); coalesce, total, least, greatest, mean_of and ratio follow the
+    rules of the combine_cols methods 'first', 'sum', 'min', 'max', 'mean' and 'ratio'.
+    """
+    __slots__ = ("op", "args", "params", "name")
+
+    def __init__(self, op, args=(), params=(), name=None):
+        self.op = op
+        self.args = tuple(args)
+        self.params = tuple(params)
+        self.name = name
+
+    def alias(self, name):
+        """The same expression, stored under `name` when used as a definition."""
+        return Expr(self.op, self.args, self.params, name)
+
+    def coalesce(self, *others):
+        return coalesce(self, *others)
+
+    def fill_null(self, value):
+        """Replace missing values by `value`."""
+        return Expr("fill_null", [self], [float(value)])
+
+    def ytd_diff(self):
+        """Quarterly flow from a year-to-date amount: the difference with the previous report of the bank in the year."""
+        return Expr("ytd_diff", [self], [None, None])
+
+    def abs(self):
+        return Expr("abs", [self])
+
+    def __add__(self, other):
+        return Expr("add", [self, _expr(other)])
+
+    def __radd__(self, other):
+        return Expr("add", [_expr(other), self])
+
+    def __sub__(self, other):
+        return Expr("sub", [self, _expr(other)])
+
+    def __rsub__(self, other):
+        return Expr("sub", [_expr(other), self])
+
+    def __mul__(self, other):
+        return Expr("mul", [self, _expr(other)])
+
+    def __rmul__(self, other):
+        return Expr("mul", [_expr(other), self])
+
+    def __truediv__(self, other):
+        return Expr("div", [self, _expr(other)])
+
+    def __rtruediv__(self, other):
+        return Expr("div", [_expr(other), self])
+
+    def __neg__(self):
+        return Expr("neg", [self])
+
+    def columns(self):
+        """Names of the columns (MDRM codes or variables) the expression reads."""
+        names, stack, seen = [], [self], set()
+        while stack:
+            e = stack.pop()
+            if id(e) in seen:
+                continue
+            seen.add(id(e))
+            if e.op == "col":
+                names.append(e.params[0])
+            stack.extend(e.args)
+        return sorted(set(names))
+
+    def __repr__(self):
+        text = _format(self)
+        return f"{text}.alias({self.name!r})" if self.name is not None else text
+
+
+def _expr(value):
+    return value if isinstance(value, Expr) else lit(value)
+
+
+def col(name):
+    """A column of the selected call reports (e.g. 'rcon2170'), or a variable defined earlier."""
+    return Expr("col", params=[name])
+
+
+def lit(value):
+    """A constant."""
+    return Expr("lit", params=[float(value)])
+
+
+def coalesce(*exprs):
+    """First non-missing value, left to right (combine_cols 'first')."""
+    return exprs[0] if len(exprs) == 1 else Expr("first", [_expr(e) for e in exprs])
+
+
+def total(*exprs, skip_na=True):
+    """Sum, with missing values counted as 0 when skip_na (combine_cols 'sum')."""
+    return Expr("sum", [_expr(e) for e in exprs], [skip_na])
+
+
+def least(*exprs, skip_na=True):
+    return Expr("min", [_expr(e) for e in exprs], [skip_na])
+
+
+def greatest(*exprs, skip_na=True):
+    return Expr("max", [_expr(e) for e in exprs], [skip_na])
+
+
+def mean_of(*exprs, skip_na=True):
+    return Expr("mean", [_expr(e) for e in exprs], [skip_na])
+
+
+def ratio(numerator, denominator, skip_na=True):
+    """numerator / denominator, with a missing numerator as 0 when skip_na and a zero denominator as NaN."""
+    return Expr("ratio", [_expr(numerator), _expr(denominator)], [skip_na])
+
+
+def switch(date, before, after=None):
+    """`before` for report dates before `date`, `after` from `date` on (missing when after is None)."""
+    return Expr("switch", [_expr(before), _expr(after if after is not None else np.nan)],
+                [pd.Timestamp(date)])
+
+
+_FUNCTIONS = {"first": "coalesce", "sum": "total", "min": "least", "max": "greatest", "mean": "mean_of",
+              "ratio": "ratio"}
+_OPERATORS = {"add": "+", "sub": "-", "mul": "*", "div": "/"}
+
+
+def _format(e):
+    if e.op == "col":
+        return f"col({e.params[0]!r})"
+    if e.op == "lit":
+        return f"lit({e.params[0]!r})"
+    args = [_format(a) for a in e.args]
+    if e.op in _OPERATORS:
+        return f"({args[0]} {_OPERATORS[e.op]} {args[1]})"
+    if e.op == "neg":
+        return f"-{args[0]}"
+    if e.op == "abs":
+        return f"{args[0]}.abs()"
+    if e.op == "fill_null":
+        return f"{args[0]}.fill_null({e.params[0]!r})"
+    if e.op == "ytd_diff":
+        since, before = e.params
+        if since is None and before is None:
+            return f"{args[0]}.ytd_diff()"
+        return f"ytd_diff({args[0]}, since={since and str(since.date())!r}, before={before and str(before.date())!r})"
+    if e.op == "switch":
+        return f"switch({str(e.params[0].date())!r}, {', '.join(args)})"
+    if e.op in ("sum", "min", "max", "mean", "ratio") and not e.params[0]:
+        args.append("skip_na=False")
+    return f"{_FUNCTIONS[e.op]}({', '.join(args)})"
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Dict mappings
+# ----------------------------------------------------------------------------------------------------------------------
+
+def _part(first_col, second_col, method, available, period):
+    """Expression of one (pre- or post-switch) part of a dict mapping, as combine_cols would compute it."""
+    if method == "sum":
+        cols = list(first_col) if isinstance(first_col, (list, tuple)) else [first_col, second_col] if second_col else [first_col]
+        missing = [c for c in cols if c not in available]
+        if missing:
+            raise KeyError(f"Cannot sum columns, these are missing: {missing}")
+        return total(*[col(c) for c in cols])
+
+    missing = [c for c in (first_col, second_col) if c is not None and c not in available]
+    if missing:
+        # combine_cols reports the missing columns and leaves the variable empty
+        print(f"❌ SPECIFIC MISSING COLUMNS: {missing}")
+        return lit(np.nan)
+    a = col(first_col)
+    b = col(second_col) if second_col is not None else None
+    inputs = [a] if b is None else [a, b]
+    if method == "first":
+        return coalesce(*inputs)
+    if method == "secondary":
+        return coalesce(*inputs[::-1])
+    if method == "rename":
+        return a
+    if method in ("min", "max", "mean"):
+        return Expr(method, inputs, [True])
+    if method == "ratio":
+        if b is None:
+            raise ValueError(f"Method 'ratio' needs a second_col (first_col='{first_col}').")
+        return ratio(a, b)
+    if method == "ytd_diff":
+        # The year-to-date difference only looks at the rows of its period, as combine_cols on the masked rows
+        return Expr("ytd_diff", [a], period)
+    raise ValueError(f"Unknown combine method '{method}'")
+
+
+def from_mapping(mapping, available, skip_na=True):
+    """
+    The expression of a dict mapping (see CallReportsCleaner.construct_definitions), aliased to its new_var.
+
+    Parameters:
+      mapping (dict): One entry of mappings.py.
+      available (set): Columns that can be read: those of the selected data and the new_vars.
+      skip_na (bool): As in combine_cols.
+    """
+    method = mapping.get("method", "first")
+    switch_date = pd.Timestamp(mapping.get("switch_date", "2100-01-01"))
+    pre = _part(mapping["first_col"], mapping.get("second_col"), method, available, [None, switch_date])
+    post = None
+    if "switch_date" in mapping:
+        if "first_col_post" not in mapping:
+            raise ValueError("Mapping must include 'first_col_post' for post-switch calculations.")
+        post = _part(mapping["first_col_post"], mapping.get("second_col_post"), mapping.get("method_post", method),
+                     available, [switch_date, None])
+    expr = switch(switch_date, pre, post)
+    if not skip_na:
+        expr = _without_skip_na(expr)
+    return expr.alias(mapping["new_var"])
+
+
+def _without_skip_na(e):
+    args = [_without_skip_na(a) for a in e.args]
+    params = [False] if e.op in ("sum", "min", "max", "mean", "ratio") else e.params
+    return Expr(e.op, args, params, e.name)
+
+
+def definition_name(mapping):
+    """Name of the variable a mapping defines (dict 'new_var' or Expr alias)."""
+    return mapping.name if isinstance(mapping, Expr) else mapping["new_var"]
+
+
+def mapping_columns(mapping):
+    """Input columns of a mapping (dict or Expr)."""
+    if isinstance(mapping, Expr):
+        return mapping.columns()
+    refs = []
+    for key in MAPPING_KEYS:
+        value = mapping.get(key)
+        refs.extend(value if isinstance(value, (list, tuple)) else [value])
+    return [r for r in refs if isinstance(r, str)]
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Plan
+# ----------------------------------------------------------------------------------------------------------------------
+
+class Plan:
+    def __init__(self, definitions, keep=None):
+        """
+        Compile named expressions into one evaluation plan.
+
+        Variables used by later definitions are inlined rather than stored, and identical
+        subexpressions (same operation on the same inputs, wherever they appear) are computed once.
+        Only the variables in `keep` are returned by execute(); every other intermediate array is
+        released as soon as its last consumer has been computed, and definitions that nothing kept
+        depends on are never computed.
+
+        Parameters:
+          definitions (list): (name, Expr) pairs, in order. A col() naming an earlier definition refers to it.
+          keep (list, optional): Names of the variables to return (default: all).
+        """
+        names = [name for name, _ in definitions]
+        if keep is None:
+            keep = list(dict.fromkeys(names))
+        unknown = [k for k in keep if k not in names]
+        if unknown:
+            raise KeyError(f"Variables to keep are not defined: {unknown}")
+
+        # 1) Inline every reference to an earlier definition
+        env, memo = {}, {}
+        for name, expr in definitions:
+            env[name] = self._resolve(expr, env, memo, set(names) - set(env) - {name}, name)
+
+        # 2) Hash-cons the kept expressions into a DAG of unique nodes
+        self.nodes, self._ids, memo = [], {}, {}
+        self.outputs = {name: self._intern(env[name], memo) for name in keep}
+
+        # 3) Number of consumers of each node, to release intermediates early
+        self.consumers = [0] * len(self.nodes)
+        for _, _, children in self.nodes:
+            for c in children:
+                self.consumers[c] += 1
+        self.n_definitions = len(names)
+
+    @staticmethod
+    def _resolve(expr, env, memo, pending, name):
+        def walk(e):
+            if id(e) in memo:
+                return memo[id(e)]
+            if e.op == "col" and e.params[0] in env:
+                out = env[e.params[0]]
+            elif e.op == "col" and e.params[0] in pending:
+                raise ValueError(f"'{name}' uses '{e.params[0]}' before the definition of '{e.params[0]}'.")
+            else:
+                out = Expr(e.op, [walk(a) for a in e.args], e.params) if e.args else e
+            memo[id(e)] = out
+            return out
+        return walk(expr)
+
+    def _intern(self, expr, memo):
+        # Iterative post-order walk: inlined definitions can nest deeper than the recursion limit
+        stack = [(expr, False)]
+        while stack:
+            e, expanded = stack.pop()
+            if id(e) in memo:
+                continue
+            if not expanded:
+                stack.append((e, True))
+                stack.extend((a, False) for a in e.args if id(a) not in memo)
+                continue
+            children = tuple(memo[id(a)] for a in e.args)
+            if e.op in _COMMUTATIVE:
+                children = tuple(sorted(children))
+            key = (e.op, tuple(map(repr, e.params)), children)
+            if key not in self._ids:
+                self._ids[key] = len(self.nodes)
+                self.nodes.append((e.op, e.params, children))
+            memo[id(e)] = self._ids[key]
+        return memo[id(expr)]
+
+    def columns(self):
+        """Columns of the data the plan reads."""
+        return sorted({params[0] for op, params, _ in self.nodes if op == "col"})
+
+    def explain(self):
+        """A readable listing of the plan: one line per node, with the variables it produces."""
+        produced = {}
+        for name, i in self.outputs.items():
+            produced.setdefault(i, []).append(name)
+        lines = [f"Plan: {len(self.nodes)} nodes, {len(self.outputs)} variables kept out of {self.n_definitions} "
+                 f"definitions, {sum(c > 1 for c in self.consumers)} shared subexpressions"]
+        for i, (op, params, children) in enumerate(self.nodes):
+            args = [f"n{c}" for c in children] + [repr(p) for p in params if p is not None]
+            line = f"  n{i} = {op}({', '.join(args)})"
+            if i in produced:
+                line += f"  → {', '.join(produced[i])}"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def execute(self, df):
+        """
+        Evaluate the plan on `df` (which must have every column of columns(), plus 'idrssd' and 'date').
+
+        Returns:
+          pd.DataFrame: The kept variables, on the index of df.
+        """
+        missing = [c for c in self.columns() if c not in df.columns]
+        if missing:
+            raise KeyError(f"Columns not in the data: {missing}")
+        n = len(df)
+        dates = pd.to_datetime(df["date"]).to_numpy() if "date" in df.columns else None
+        produced = {}
+        for name, i in self.outputs.items():
+            produced.setdefault(i, []).append(name)
+
+        values, out = {}, {}
+        remaining = list(self.consumers)
+        with profile("construct_plan", nodes=len(self.nodes), variables=len(self.outputs)) as rec:
+            for i, (op, params, children) in enumerate(self.nodes):
+                values[i] = _evaluate(op, params, [values[c] for c in children], df, dates, n)
+                for name in produced.get(i, ()):
+                    out[name] = values[i]
+                for c in children:
+                    remaining[c] -= 1
+                    if remaining[c] == 0:
+                        del values[c]
+                if remaining[i] == 0:
+                    del values[i]
+            rec.rows_out, rec.cols_out = n, len(out)
+        return pd.DataFrame({name: out[name] for name in self.outputs}, index=df.index)
+
+
+def _column(df, name):
+    s = df[name]
+    if isinstance(s, pd.DataFrame) or not is_numeric_dtype(s.dtype):
+        raise TypeError(f"Column '{name}' is not numeric: expressions only combine numeric columns.")
+    return s.to_numpy() if s.dtype == "float64" else s.to_numpy(dtype="float64", na_value=np.nan)
+
+
+def _evaluate(op, params, args, df, dates, n):
+    if op == "col":
+        return _column(df, params[0])
+    if op == "lit":
+        return np.full(n, params[0])
+    if op in ("first", "sum", "min", "max", "mean", "ratio"):
+        return combine_arrays(op, np.stack(args), params[0] if params else True)
+    if op == "switch":
+        out = np.full(n, np.nan)
+        before = dates < params[0]
+        after = dates >= params[0]
+        out[before] = args[0][before]
+        out[after] = args[1][after]
+        return out
+    if op == "ytd_diff":
+        since, before = params
+        rows = np.ones(n, dtype=bool) if since is None else dates >= since
+        if before is not None:
+            rows &= dates < before
+        x = pd.Series(args[0][rows])
+        keys = [df["idrssd"].to_numpy()[rows], pd.DatetimeIndex(dates[rows]).year]
+        out = np.full(n, np.nan)
+        out[rows] = x.groupby(keys).diff().fillna(x).to_numpy()
+        return out
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if op == "add":
+            return args[0] + args[1]
+        if op == "sub":
+            return args[0] - args[1]
+        if op == "mul":
+            return args[0] * args[1]
+        if op == "div":
+            return args[0] / np.where(args[1] == 0, np.nan, args[1])
+        if op == "neg":
+            return -args[0]
+        if op == "abs":
+            return np.abs(args[0])
+        if op == "fill_null":
+            return np.where(np.isnan(args[0]), params[0], args[0])
+    raise ValueError(f"Unknown operation '{op}'")
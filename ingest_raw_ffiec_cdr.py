@@ -1,16 +1,47 @@
 import pandas as pd, csv, pathlib
+from pandas.api.types import is_numeric_dtype
 import os
 import glob
+import fnmatch
+import zipfile
+from contextlib import contextmanager
 from tqdm import tqdm
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import profile
+from memory_budget import get_memory_budget
+from mdrm_catalog import merge_provenance, quarter_column_stats, write_quarter_stats
+
+# Schedules merged into every quarter, in merge order
+SCHEDULES = ['Schedule RC', 'Schedule RCCI', 'Schedule RCA', 'Schedule RCG', 'Schedule RCEI', 'Bulk POR',
+             'Schedule RCK', 'Schedule RI', 'Schedule RIBI', 'Schedule RCO', 'Schedule RCB']
+
+# Name of the bulk download of one quarter: a folder when unzipped, else the .zip archive itself
+BULK_NAME = 'FFIEC CDR Call Bulk All Schedules {date}'
+
+def is_archive(path):
+    return str(path).lower().endswith('.zip')
+
+@contextmanager
+def _open_schedule(path, archive=None):
+    """The schedule file to parse: its path, or an uncompressing stream of the archive member (nothing is extracted)."""
+    if archive is None:
+        yield path
+        return
+    with zipfile.ZipFile(archive) as zf, zf.open(path) as member:
+        yield member
 
 # Create function to load schedules dealing quoting issues
-def load_schedule(path):
+def load_schedule(path, archive=None):
     """
     Load a single FFIEC CDR schedule file, handling potential parsing errors due to quoting.
 
     Args:
-        path (str): Filesystem path to the raw schedule .txt file (tab-delimited).
+        path (str): Filesystem path to the raw schedule .txt file (tab-delimited),
+                    or the member name of the file when `archive` is given.
+        archive (str, optional): Bulk download .zip holding the file. The member is streamed
+                                 through the parser without being extracted to disk.
 
     Returns:
         pandas.DataFrame: A DataFrame of the schedule with an integer IDRSSD column.
@@ -20,68 +51,208 @@ def load_schedule(path):
         - Some files may include unescaped quotes, causing pandas.ParserError. In that case,
           we retry with quoting=csv.QUOTE_NONE, strip stray quotes from data, and reapply the IDRSSD conversion.
     """
-    try:
-        df = pd.read_csv(
-            path,
-            sep='\t',
-            low_memory=False,
-        ).drop(index=0).reset_index(drop=True)
-        df['IDRSSD'] = (
-            pd.to_numeric(df['IDRSSD'], errors='coerce')
-            .astype('Int64')
-        )
-        return df
-    except pd.errors.ParserError as err:
-        # Handle files with unescaped quotes by disabling pandas' internal quoting
-        print(f'ParserError in {path} -> {err}')
-        df = pd.read_csv(
-            path,
-            sep='\t',
-            quoting=csv.QUOTE_NONE,
-            engine='python',
-            #low_memory=False,
-        ).drop(index=0).reset_index(drop=True)
-        df = df.replace({ '"': '' }, regex=True)
-        df.columns = df.columns.str.replace('"', '', regex=False)
-        df['IDRSSD'] = (
-            pd.to_numeric(df['IDRSSD'], errors='coerce')
-            .astype('Int64')
-        )
-        return df
+    with profile("load_schedule", file=os.path.basename(path)) as rec:
+        try:
+            with _open_schedule(path, archive) as source:
+                df = pd.read_csv(
+                    source,
+                    sep='\t',
+                    low_memory=False,
+                ).drop(index=0).reset_index(drop=True)
+            df['IDRSSD'] = (
+                pd.to_numeric(df['IDRSSD'], errors='coerce')
+                .astype('Int64')
+            )
+            rec.frame_out(df)
+            return df
+        except pd.errors.ParserError as err:
+            # Handle files with unescaped quotes by disabling pandas' internal quoting
+            print(f'ParserError in {path} -> {err}')
+            with _open_schedule(path, archive) as source:
+                df = pd.read_csv(
+                    source,
+                    sep='\t',
+                    quoting=csv.QUOTE_NONE,
+                    engine='python',
+                    #low_memory=False,
+                ).drop(index=0).reset_index(drop=True)
+            df = df.replace({ '"': '' }, regex=True)
+            df.columns = df.columns.str.replace('"', '', regex=False)
+            df['IDRSSD'] = (
+                pd.to_numeric(df['IDRSSD'], errors='coerce')
+                .astype('Int64')
+            )
+            rec.meta["fallback_parser"] = True
+            rec.frame_out(df)
+            return df
+
+def schedule_files(prefix, date, cr_path):
+    """
+    Paths of the parts of one schedule for one date: files of the folder `cr_path`, or members of the
+    archive `cr_path` (matched on their file name with the same pattern).
+    """
+    pattern = f'FFIEC CDR Call {prefix} {date}*.txt'
+    if is_archive(cr_path):
+        with zipfile.ZipFile(cr_path) as zf:
+            return [m for m in zf.namelist() if fnmatch.fnmatchcase(m.rsplit('/', 1)[-1], pattern)]
+    return glob.glob(os.path.join(cr_path, pattern))
+
+def quarter_sources(cr_path):
+    """
+    Date → bulk download of the quarter under cr_path: the unzipped folder when there is one,
+    else the .zip archive. Other folders are listed by their trailing 8-digit code, as before.
+    """
+    sources = {}
+    for name in sorted(os.listdir(cr_path)):
+        path = os.path.join(cr_path, name)
+        if os.path.isdir(path):
+            sources[name[-8:]] = path
+        elif is_archive(name) and name[:-4].startswith(BULK_NAME.format(date='')):
+            sources.setdefault(name[-12:-4], path)
+    return sources
 
 # Helper to merge all parts of a given schedule prefix
-def merge_schedule_parts(prefix, date, cr_path):
+def merge_schedule_parts(prefix, date, cr_path, load=None):
     """
     Locate and merge all file parts for a given schedule and date into one DataFrame.
 
     Args:
         prefix (str): The schedule name prefix (e.g., 'Schedule RC', 'Bulk POR').
         date (str): The 8-digit date code corresponding to the call report cycle.
-        cr_path (str): Directory where the schedule .txt files for that date reside.
+        cr_path (str): Directory where the schedule .txt files for that date reside, or the bulk .zip archive.
+        load (callable): Returns the DataFrame of a part from its path (default: load_schedule). Parts are
+                         requested one at a time, so each merge can run while later parts are still being read.
 
     Returns:
         pandas.DataFrame: An outer-merged DataFrame combining all parts of the schedule.
                           If no files are found, returns an empty DataFrame and logs a warning.
     """
-    pattern = os.path.join(cr_path, f'FFIEC CDR Call {prefix} {date}*.txt')
-    files = glob.glob(pattern)
+    files = schedule_files(prefix, date, cr_path)
     if not files:
         print(f'Warning: no files found for schedule {prefix} on date {date}')
         return pd.DataFrame()
-    dfs = [load_schedule(fp) for fp in files]
-    merged = dfs[0]
-    for df_part in dfs[1:]:
-        merged = pd.merge(merged, df_part, on='IDRSSD', how='outer')
+    if load is None:
+        archive = cr_path if is_archive(cr_path) else None
+        load = lambda fp: load_schedule(fp, archive)
+    merged = load(files[0])
+    for fp in files[1:]:
+        df_part = load(fp)
+        with profile("merge_schedule_parts", schedule=prefix, date=date, part=os.path.basename(fp)) as rec:
+            merged = pd.merge(merged, df_part, on='IDRSSD', how='outer')
+            rec.frame_out(merged)
     return merged
 
+def load_quarter(date, schedule_dir, threads=None):
+    """
+    Read every schedule part of one quarter on a thread pool and merge each schedule's parts.
+
+    All parts are submitted at once, in SCHEDULES order, and the pandas CSV parser releases the GIL
+    while it tokenizes, so files are read and parsed concurrently; each schedule is merged as soon as
+    its parts are ready, while the parts of the following schedules are still being read.
+
+    Args:
+        date (str): The 8-digit date code of the quarter.
+        schedule_dir (str): Folder with the schedule .txt files of that date, or the bulk .zip archive.
+        threads (int, optional): Reader threads (default: up to 8, one per CPU). 1 reads one file at a time.
+
+    Returns:
+        dict: Schedule prefix → merged DataFrame (empty when the schedule has no files), in SCHEDULES order.
+    """
+    threads = threads or min(8, os.cpu_count() or 1)
+    if threads <= 1:
+        return {prefix: merge_schedule_parts(prefix, date, schedule_dir) for prefix in SCHEDULES}
+
+    pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='load_schedule')
+    try:
+        archive = schedule_dir if is_archive(schedule_dir) else None
+        futures = {fp: pool.submit(load_schedule, fp, archive)
+                   for prefix in SCHEDULES for fp in schedule_files(prefix, date, schedule_dir)}
+        # A part is dropped from `futures` once merged, so it is not kept alive until the end of the quarter
+        return {prefix: merge_schedule_parts(prefix, date, schedule_dir, load=lambda fp: futures.pop(fp).result())
+                for prefix in SCHEDULES}
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def iter_quarters(cr_path):
+    """(date, folder or archive) of every quarter under cr_path, warning about folders not named as expected."""
+    sources = quarter_sources(cr_path)
+    for date in tqdm(list(sources), desc='Processing dates'):
+        schedule_dir = sources[date]
+        if not is_archive(schedule_dir):
+            schedule_dir = os.path.join(cr_path, BULK_NAME.format(date=date))
+            if not os.path.isdir(schedule_dir):
+                print(f'Warning: directory not found for date {date}')
+                continue
+        yield date, schedule_dir
+
+def merge_quarter(date, schedule_dir, threads=None):
+    """
+    All the schedules of one quarter, outer-merged on IDRSSD, with a 'Date' column ('MMDDYYYY').
+
+    Returns:
+        tuple: (merged DataFrame, provenance dict: column → source schedule, see merge_provenance).
+    """
+    # Read all schedule parts of the quarter concurrently and merge each schedule robustly
+    schedules = load_quarter(date, schedule_dir, threads)
+
+    # Merge all schedules on 'IDRSSD' without losing any rows,
+    # keeping track of the schedule every column (and suffix variant) comes from
+    dt = schedules['Schedule RC']
+    provenance = merge_provenance({}, dt.columns, 'Schedule RC')
+    for prefix in SCHEDULES[1:]:
+        df = schedules.pop(prefix)
+        if not df.empty:
+            dt = pd.merge(dt, df, on='IDRSSD', how='outer')
+            provenance = merge_provenance(provenance, df.columns, prefix)
+    dt['Date'] = date
+    return dt, provenance
+
+def parse_numbers(df):
+    """
+    Every column of a raw quarter parsed as numbers, once, for the column statistics and typed_like_csv.
+
+    Returns:
+        tuple: (dict column → parsed column, NaN where a cell is not a number,
+                dict column → True when every non-empty cell of the column is a number).
+    """
+    parsed, numeric = {}, {}
+    for c in df.columns:
+        s = df[c]
+        if is_numeric_dtype(s.dtype) and not isinstance(s.dtype, pd.Int64Dtype):
+            parsed[c], numeric[c] = s, True
+            continue
+        parsed[c] = pd.to_numeric(s, errors='coerce')
+        numeric[c] = parsed[c].count() == s.count()
+    return parsed, numeric
+
+def save_quarter(dt, provenance, date, save_path, numbers=None):
+    """
+    Write the merged quarter as save_path/{date}.csv and its column statistics to the MDRM catalog.
+    numbers is parse_numbers(dt) when the caller already has it.
+    """
+    os.makedirs(save_path, exist_ok=True)
+    # Record the column statistics of the quarter in the MDRM catalog
+    with profile("column_stats", date=date):
+        _, numeric = numbers or parse_numbers(dt)
+        write_quarter_stats(quarter_column_stats(dt, provenance, date, numeric), save_path, date)
+
+    # Save the merged data
+    output_file = os.path.join(save_path, f'{date}.csv')
+    with profile("write_quarter_csv", date=date) as rec:
+        rec.frame_in(dt)
+        dt.to_csv(output_file, index=False)
+
 # Main ingestion function
-def ingest(cr_path, save_path):
+def ingest(cr_path, save_path, threads=None):
     """
     Traverse all call report date folders, merge their schedules, and save a combined CSV per date.
 
     Args:
-        cr_path (str): Root directory containing subfolders named 'FFIEC CDR Call Bulk All Schedules {date}'.
+        cr_path (str): Root directory containing subfolders named 'FFIEC CDR Call Bulk All Schedules {date}',
+                       or the downloaded archives 'FFIEC CDR Call Bulk All Schedules {date}.zip' (read without unzipping).
         save_path (str): Directory path where the final per-date CSV files will be written.
+        threads (int, optional): Threads reading the schedule files of a quarter (see load_quarter).
+                                 Under a memory budget, files are read one at a time.
 
     Returns:
         None: Writes output files but does not return a value.
@@ -90,41 +261,76 @@ def ingest(cr_path, save_path):
         - Ensures the save_path exists.
         - Uses tqdm for visual progress over dates.
         - Performs outer merges on IDRSSD to preserve all entries.
+        - Reads the schedule files of a quarter concurrently, overlapping the merges with the reads (load_quarter).
+        - Records per-quarter column statistics (schedule, non-empty cells, dtype) in save_path/_catalog/,
+          the source of the MDRM catalog (see mdrm_catalog.py).
     """
     # Ensure output directory exists
     os.makedirs(save_path, exist_ok=True)
-    # List available date folders by their trailing 8-digit code
-    dates = [folder[-8:] for folder in os.listdir(cr_path)
-             if os.path.isdir(os.path.join(cr_path, folder))]
+
+    # Concurrent reads hold every part of a quarter in memory at once
+    budget = get_memory_budget()
+    if budget is not None:
+        threads = 1
 
     # Progress bar over dates
-    for date in tqdm(dates, desc='Processing dates'):
-        schedule_dir = os.path.join(cr_path, f'FFIEC CDR Call Bulk All Schedules {date}')
-        if not os.path.isdir(schedule_dir):
-            print(f'Warning: directory not found for date {date}')
-            continue
+    for date, schedule_dir in iter_quarters(cr_path):
+        dt, provenance = merge_quarter(date, schedule_dir, threads)
+        save_quarter(dt, provenance, date, save_path)
 
-        # Merge all schedule parts robustly
-        rc   = merge_schedule_parts('Schedule RC', date, schedule_dir)
-        rcci = merge_schedule_parts('Schedule RCCI', date, schedule_dir)
-        rca  = merge_schedule_parts('Schedule RCA', date, schedule_dir)
-        rcg  = merge_schedule_parts('Schedule RCG', date, schedule_dir)
-        rce1 = merge_schedule_parts('Schedule RCEI', date, schedule_dir)
-        por  = merge_schedule_parts('Bulk POR', date, schedule_dir)
-        rck  = merge_schedule_parts('Schedule RCK', date, schedule_dir)
-        ri   = merge_schedule_parts('Schedule RI', date, schedule_dir)
-        ribi = merge_schedule_parts('Schedule RIBI', date, schedule_dir)
-        rco  = merge_schedule_parts('Schedule RCO', date, schedule_dir)
-        rcb  = merge_schedule_parts('Schedule RCB', date, schedule_dir)
-
-        # Merge all schedules on 'IDRSSD' without losing any rows
-        dt = rc
-        for df in [rcci, rca, rcg, rce1, por, rck, ri, ribi, rco, rcb]:
-            if not df.empty:
-                dt = pd.merge(dt, df, on='IDRSSD', how='outer')
-        dt['Date'] = date
-
-        # Save the merged data
-        output_file = os.path.join(save_path, f'{date}.csv')
-        dt.to_csv(output_file, index=False)
+        # A quarter is the smallest unit ingestion can work on: fail early if it does not fit
+        if budget is not None:
+            budget.check(f"ingest ({date})")
+
+def typed_like_csv(df, numbers=None):
+    """
+    Give the text columns of a raw quarter the types a CSV round trip would: a column whose every non-empty
+    cell is a number becomes int64 (float64 with missing cells), the others stay text. IDRSSD becomes int64.
+    numbers is parse_numbers() of df (or of a frame with more columns) when the caller already has it.
+    """
+    parsed, numeric = numbers or parse_numbers(df)
+    out = {}
+    for c in df.columns:
+        s = df[c]
+        if numeric[c]:
+            s = parsed[c]
+            if isinstance(s.dtype, pd.Int64Dtype):
+                s = s.astype('float64' if s.isna().any() else 'int64')
+        out[c] = s
+    return pd.DataFrame(out, index=df.index)
 
+def ingest_frames(cr_path, select=None, threads=None, save_path=None):
+    """
+    Ingest quarter by quarter, yielding each merged quarter in memory instead of going through the CSV files.
+
+    Every frame is pruned to the columns `select` keeps, typed as if it had been written to CSV and read back
+    (typed_like_csv), and has a datetime 'Date' column, like the rows of the merged call reports.
+
+    Args:
+        cr_path (str): As in ingest().
+        select (callable, optional): Columns of a quarter → columns to keep (default: all).
+        threads (int, optional): As in ingest().
+        save_path (str, optional): Also write the per-quarter CSVs and column statistics there, as ingest() does.
+
+    Yields:
+        pandas.DataFrame: One quarter.
+    """
+    budget = get_memory_budget()
+    if budget is not None:
+        threads = 1
+    for date, schedule_dir in iter_quarters(cr_path):
+        dt, provenance = merge_quarter(date, schedule_dir, threads)
+        # The columns are parsed once, for the column statistics and the types
+        numbers = None
+        if save_path is not None:
+            numbers = parse_numbers(dt)
+            save_quarter(dt, provenance, date, save_path, numbers)
+        if select is not None:
+            dt = dt[select(list(dt.columns))]
+        with profile("type_quarter", date=date) as rec:
+            dt = typed_like_csv(dt, numbers)
+            dt['Date'] = pd.to_datetime(dt['Date'], format='%m%d%Y')
+            rec.frame_out(dt)
+        if budget is not None:
+            budget.check(f"ingest ({date})")
+        yield dt
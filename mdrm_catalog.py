@@ -0,0 +1,147 @@
+import os
+import glob
+
+import pandas as pd
+
+# Per-quarter column statistics written by ingest(), one file per report date
+CATALOG_DIR = "_catalog"
+# The statistics of all quarters, copied next to the merged call reports by merge_cr_dates_fast()
+STATS_FILE = "column_stats.parquet"
+
+STATS_COLUMNS = ["mdrm", "schedule", "quarter", "rows", "non_null", "dtype"]
+
+
+def merge_provenance(left, right_cols, schedule):
+    """
+    Source schedule of every column after pd.merge(left_df, right_df, on='IDRSSD').
+
+    Replays the suffix rule of pandas: a column present on both sides becomes '{col}_x' (left)
+    and '{col}_y' (right).
+
+    Parameters:
+      left (dict): Column → schedule of the left frame.
+      right_cols (list): Columns of the right frame.
+      schedule (str): Schedule of the right frame (e.g. 'Schedule RC').
+
+    Returns:
+      dict: Column → schedule of the merged frame.
+    """
+    right_cols = [c for c in right_cols if c != "IDRSSD"]
+    overlap = set(left) & set(right_cols)
+    merged = {(f"{c}_x" if c in overlap else c): s for c, s in left.items()}
+    merged.update({(f"{c}_y" if c in overlap else c): schedule for c in right_cols})
+    return merged
+
+
+def quarter_column_stats(df, provenance, date, numeric):
+    """
+    Statistics of every column of one ingested quarter.
+
+    Parameters:
+      df (pd.DataFrame): The merged schedules of the quarter (as written by ingest()).
+      provenance (dict): Column → source schedule (see merge_provenance).
+      date (str): Report date as MMDDYYYY.
+      numeric (dict): Column → True when every non-empty cell is a number (see ingest_raw_ffiec_cdr.parse_numbers;
+                      raw schedules are read as text).
+
+    Returns:
+      pd.DataFrame: One row per column with STATS_COLUMNS: the MDRM code (or suffix variant), its schedule,
+                    the quarter, the number of rows of the quarter, the number of non-empty cells, and
+                    'numeric' or 'text'.
+    """
+    cols = [c for c in df.columns if c not in ("IDRSSD", "Date")]
+    non_null = df[cols].notna().sum()
+    return pd.DataFrame({
+        "mdrm": cols,
+        "schedule": [provenance.get(c) for c in cols],
+        "quarter": pd.to_datetime(date, format="%m%d%Y"),
+        "rows": len(df),
+        "non_null": non_null.reindex(cols).to_numpy(dtype="int64"),
+        "dtype": ["numeric" if numeric[c] else "text" for c in cols],
+    })
+
+
+def write_quarter_stats(stats, save_path, date):
+    """Store the statistics of one quarter under save_path/_catalog/{date}.parquet."""
+    folder = os.path.join(save_path, CATALOG_DIR)
+    os.makedirs(folder, exist_ok=True)
+    stats.to_parquet(os.path.join(folder, f"{date}.parquet"), index=False)
+
+
+def collect_column_stats(ingest_path):
+    """
+    Statistics of every quarter ingested into `ingest_path` (only the quarters whose CSV is present),
+    or None when the quarters were ingested without statistics.
+    """
+    dates = {os.path.basename(f)[:-4] for f in glob.glob(os.path.join(ingest_path, "*.csv"))}
+    files = [os.path.join(ingest_path, CATALOG_DIR, f"{d}.parquet") for d in sorted(dates)]
+    if not files or not all(os.path.exists(f) for f in files):
+        return None
+    return pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+
+
+def write_column_stats(stats, folder):
+    stats.to_parquet(os.path.join(folder, STATS_FILE), index=False)
+
+
+def read_column_stats(folder):
+    """The per-quarter column statistics stored next to the merged call reports, or None."""
+    path = os.path.join(folder, STATS_FILE)
+    return pd.read_parquet(path) if os.path.exists(path) else None
+
+
+def mdrm_catalog(stats):
+    """
+    One row per MDRM code and suffix variant, from the per-quarter statistics.
+
+    Returns:
+      pd.DataFrame indexed by 'mdrm' with: base (code without suffix), schedule (source schedules, ', '-joined),
+      first_quarter, last_quarter, n_quarters (quarters where it has data), non_null, dtype.
+    """
+    filled = stats[stats["non_null"] > 0]
+    catalog = stats.groupby("mdrm").agg(
+        schedule=("schedule", lambda s: ", ".join(sorted(s.dropna().unique()))),
+        non_null=("non_null", "sum"),
+        dtype=("dtype", lambda s: "text" if (s == "text").any() else "numeric"),
+    )
+    spans = filled.groupby("mdrm").agg(first_quarter=("quarter", "min"), last_quarter=("quarter", "max"),
+                                       n_quarters=("quarter", "nunique"))
+    catalog = catalog.join(spans)
+    catalog["n_quarters"] = catalog["n_quarters"].fillna(0).astype("int64")
+    catalog.insert(0, "base", catalog.index.str.split("_", n=1).str[0])
+    return catalog[["base", "schedule", "first_quarter", "last_quarter", "n_quarters", "non_null", "dtype"]]
+
+
+def codes_without_data(stats, codes, start=None, end=None):
+    """
+    Columns among `codes` (exact names, suffix variants included) with no non-empty cell in [start, end].
+
+    Returns:
+      list: The empty codes, in the order given.
+    """
+    window = stats
+    if start is not None:
+        window = window[window["quarter"] >= pd.Timestamp(start)]
+    if end is not None:
+        window = window[window["quarter"] <= pd.Timestamp(end)]
+    filled = set(window.loc[window["non_null"] > 0, "mdrm"])
+    return [c for c in codes if c not in filled]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print or export the MDRM catalog of the merged call reports.")
+    parser.add_argument("folder", help="Folder with column_stats.parquet (e.g. data/intermediate/ffiec_cdr_all_dates_merged).")
+    parser.add_argument("--output", help="Write the catalog to this CSV file instead of printing it.")
+    args = parser.parse_args()
+
+    stats = read_column_stats(args.folder)
+    if stats is None:
+        raise SystemExit(f"No {STATS_FILE} in {args.folder}: rerun the ingestion and the merge.")
+    catalog = mdrm_catalog(stats)
+    if args.output:
+        catalog.to_csv(args.output)
+        print(f"Catalog of {len(catalog)} columns saved to {args.output}")
+    else:
+        print(catalog.to_string())
@@ -0,0 +1,134 @@
+import math
+import re
+import threading
+
+from profiling import rss_bytes
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """Raised when the process goes over the --memory-limit budget, or cannot stay under it."""
+
+
+def parse_memory_size(text):
+    """
+    Parse a memory size such as '8G', '512M', '1.5GB' or a plain number of bytes.
+
+    Returns:
+        int: The size in bytes.
+    """
+    m = re.fullmatch(r"\s*([0-9]*\.?[0-9]+)\s*([KMGT]?)I?B?\s*", str(text).upper())
+    if not m:
+        raise ValueError(f"Cannot parse memory size '{text}'. Use e.g. 512M, 8G or 1.5GB.")
+    factor = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}[m.group(2)]
+    return int(float(m.group(1)) * factor)
+
+
+def _fmt(n_bytes):
+    return f"{n_bytes / 2**30:.2f} GB"
+
+
+class MemoryBudget:
+    def __init__(self, limit_bytes, sample_interval=0.2):
+        """
+        Memory budget for the whole process.
+
+        A background thread samples the resident set size (RSS) to keep track of the peak.
+        Stages call check() at chunk boundaries, which raises MemoryBudgetExceeded as soon as
+        the sampled peak went over the limit, and rows_per_chunk() to size their chunks from
+        the memory still available.
+
+        Parameters:
+          limit_bytes (int): Budget in bytes.
+          sample_interval (float): Seconds between two RSS samples.
+        """
+        self.limit = int(limit_bytes)
+        self.peak = rss_bytes() or 0
+        self._interval = sample_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    # -- peak tracking --------------------------------------------------------
+    def _sample(self):
+        while not self._stop.wait(self._interval):
+            rss = rss_bytes()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._sample, name="memory-budget", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # -- enforcement ----------------------------------------------------------
+    def current(self):
+        rss = rss_bytes() or 0
+        self.peak = max(self.peak, rss)
+        return rss
+
+    def available(self):
+        """Bytes left under the budget, given the current RSS."""
+        return max(self.limit - self.current(), 0)
+
+    def check(self, where):
+        """Raise MemoryBudgetExceeded if the peak RSS went over the budget."""
+        self.current()
+        if self.peak > self.limit:
+            raise MemoryBudgetExceeded(
+                f"Memory budget exceeded in '{where}': peak RSS {_fmt(self.peak)} > limit {_fmt(self.limit)}. "
+                "Increase --memory-limit, or request fewer variables / quarters."
+            )
+
+    def rows_per_chunk(self, bytes_per_row, where, share=0.25, minimum=1_000):
+        """
+        Number of rows whose working set (bytes_per_row each) fits in `share` of the memory left.
+
+        Raises MemoryBudgetExceeded when not even `minimum` rows fit.
+        """
+        fit = int(self.available() * share / max(bytes_per_row, 1))
+        if fit < minimum:
+            raise MemoryBudgetExceeded(
+                f"Cannot meet the memory budget in '{where}': {_fmt(self.available())} left under "
+                f"the {_fmt(self.limit)} limit, but {minimum} rows need about {_fmt(minimum * bytes_per_row)}. "
+                "Increase --memory-limit."
+            )
+        return fit
+
+    def partitions_for(self, total_bytes, where, share=0.25, max_partitions=4096):
+        """
+        Number of partitions such that each one's working set fits in `share` of the memory left.
+
+        Raises MemoryBudgetExceeded when even `max_partitions` partitions would not fit.
+        """
+        room = self.available() * share
+        n = max(1, math.ceil(total_bytes / max(room, 1)))
+        if n > max_partitions:
+            raise MemoryBudgetExceeded(
+                f"Cannot meet the memory budget in '{where}': the data needs about {_fmt(total_bytes)} "
+                f"and only {_fmt(self.available())} is left under the {_fmt(self.limit)} limit. "
+                "Increase --memory-limit."
+            )
+        return n
+
+
+_ACTIVE = None
+
+
+def set_memory_budget(budget):
+    """Install `budget` (a MemoryBudget, or None to remove the limit) for the stages of this process."""
+    global _ACTIVE
+    if _ACTIVE is not None:
+        _ACTIVE.stop()
+    _ACTIVE = budget.start() if budget is not None else None
+    return _ACTIVE
+
+
+def get_memory_budget():
+    """The active MemoryBudget, or None when running without --memory-limit."""
+    return _ACTIVE
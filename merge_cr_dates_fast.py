@@ -1,25 +1,53 @@
 import pandas as pd
+from pandas.api.types import is_numeric_dtype
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
+import json
+import shutil
 from pathlib import Path
 import gc
 from tqdm import tqdm
 import argparse
 
+from memory_budget import get_memory_budget
+from mdrm_catalog import STATS_FILE, collect_column_stats, write_column_stats
 
-def merge_cr_dates_fast(input_path: str, output_folder: str) -> None:
+
+# Long-format companion of the wide CSV in sparse storage mode: one row per non-empty cell
+SPARSE_FILE = "call_reports_sparse.parquet"
+SPARSE_CODES_KEY = b"sparse_codes"
+
+# Never moved to the long table
+KEY_COLS = ["IDRSSD", "Financial Institution Name", "Date"]
+
+
+def merge_cr_dates_fast(input_path: str, output_folder: str, storage: str = "wide",
+                        sparse_threshold: float = 0.1) -> None:
     """
     Efficiently merge per-date CSV files into one dataset by streaming and aligning columns.
 
     Args:
         input_path (str): Path to the folder containing per-date CSV files.
         output_folder (str): Path to the folder where the merged CSV will be saved.
+        storage (str): 'wide' writes every column to the CSV. 'sparse' keeps in the CSV only the columns
+                       filled in at least `sparse_threshold` of the rows, and stores the non-empty cells of the
+                       other (numeric) columns in long form (IDRSSD, Date, mdrm, value) in call_reports_sparse.parquet.
+                       CallReportsCleaner pivots the requested sparse codes back to wide.
+        sparse_threshold (float): Share of non-empty rows below which a numeric column is stored in long form.
 
-    The merged file will be named 'call_reports_all_dates.csv' in the specified output_folder.
+    The merged file will be named 'call_reports_all_dates.csv' in the specified output_folder. When the dates were
+    ingested with column statistics, they are stored next to it as 'column_stats.parquet' (the MDRM catalog).
     """
+    if storage not in ("wide", "sparse"):
+        raise ValueError(f"storage must be 'wide' or 'sparse', got '{storage}'.")
     input_dir = Path(input_path)
     output_dir = Path(output_folder)
     output_dir.mkdir(parents=True, exist_ok=True)
     output_csv = output_dir / 'call_reports_all_dates.csv'
+    sparse_path = output_dir / SPARSE_FILE
+    if sparse_path.exists():
+        sparse_path.unlink()
 
     # 1) Discover all CSVs
     files = sorted(input_dir.glob("*.csv"))
@@ -33,17 +61,144 @@ def merge_cr_dates_fast(input_path: str, output_folder: str) -> None:
         master_cols_set.update(cols)
     master_cols = list(master_cols_set)
 
+    # Under a memory budget, each file is streamed in chunks sized from the memory left
+    # (about 8 bytes per cell for the aligned frame, twice for the CSV formatting buffers).
+    budget = get_memory_budget()
+    chunksize = None
+    if budget is not None:
+        chunksize = budget.rows_per_chunk(16 * len(master_cols), "merge_cr_dates_fast")
+
+    def read_chunks(f):
+        return pd.read_csv(f, low_memory=False, chunksize=chunksize) if chunksize else [pd.read_csv(f, low_memory=False)]
+
+    # The column statistics recorded by ingest() follow the merged data as the MDRM catalog
+    stats = collect_column_stats(input_dir)
+    stats_path = output_dir / STATS_FILE
+    if stats is not None:
+        write_column_stats(stats, output_dir)
+    elif stats_path.exists():
+        stats_path.unlink()
+
+    if storage == "sparse":
+        _merge_sparse(files, master_cols, read_chunks, output_csv, sparse_path, sparse_threshold, budget, stats)
+        print(f"Merged file saved to: {output_csv} (sparse columns in {sparse_path})")
+        return
+
     # 3) Initialize output with header only
     pd.DataFrame(columns=master_cols).to_csv(output_csv, index=False)
 
-    # 4) Read each file, align columns, parse Date, and append
+    # 4) Read each file, align columns, parse Date, and append.
     for f in tqdm(files, desc="Merging files", unit="file"):
-        df_part = pd.read_csv(f, low_memory=False)
-        df_part = df_part.reindex(columns=master_cols)
-        df_part["Date"] = pd.to_datetime(df_part["Date"], format="%m%d%Y")
-        df_part.to_csv(output_csv, 
-                       mode="a", header=False, index=False)
-        del df_part
+        for df_part in read_chunks(f):
+            df_part = df_part.reindex(columns=master_cols)
+            df_part["Date"] = pd.to_datetime(df_part["Date"], format="%m%d%Y")
+            df_part.to_csv(output_csv, 
+                           mode="a", header=False, index=False)
+            del df_part
+            if budget is not None:
+                budget.check("merge_cr_dates_fast")
         gc.collect()
 
     print(f"Merged file saved to: {output_csv}")
+
+
+def _merge_sparse(files, master_cols, read_chunks, output_csv, sparse_path, sparse_threshold, budget, stats=None):
+    """
+    Sparse storage mode of merge_cr_dates_fast.
+
+    The CSVs are parsed once. With the column statistics of the MDRM catalog (`stats`), the columns are
+    classified up front and every chunk is split as it is read. Without them, a first pass counts the
+    non-empty cells of every column and caches each chunk as Parquet, and a second pass splits the
+    cached chunks into the wide CSV and the long table.
+    """
+    tmp_dir = output_csv.parent / "_merge_tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # 1) Column statistics: non-empty cells and whether every value is numeric
+    if stats is not None:
+        non_null = stats.groupby("mdrm")["non_null"].sum().reindex(master_cols, fill_value=0)
+        numeric = stats.groupby("mdrm")["dtype"].agg(lambda s: (s == "numeric").all()).reindex(master_cols, fill_value=True)
+        n_rows = stats.groupby("quarter")["rows"].first().sum()
+
+        def chunks():
+            for f in tqdm(files, desc="Merging files", unit="file"):
+                for df_part in read_chunks(f):
+                    df_part["Date"] = pd.to_datetime(df_part["Date"], format="%m%d%Y")
+                    yield df_part
+    else:
+        tmp_dir.mkdir()
+        non_null = pd.Series(0, index=master_cols, dtype="int64")
+        numeric = pd.Series(True, index=master_cols)
+        n_rows = 0
+        cached = []
+        for f in tqdm(files, desc="Scanning columns", unit="file"):
+            for i, df_part in enumerate(read_chunks(f)):
+                df_part["Date"] = pd.to_datetime(df_part["Date"], format="%m%d%Y")
+                counts = df_part.notna().sum()
+                non_null[counts.index] += counts
+                text_cols = [c for c in df_part.columns if counts[c] and not is_numeric_dtype(df_part[c])]
+                numeric[text_cols] = False
+                n_rows += len(df_part)
+                path = tmp_dir / f"{f.stem}-{i:06d}.parquet"
+                df_part.to_parquet(path, index=False)
+                cached.append(path)
+                del df_part
+                if budget is not None:
+                    budget.check("merge_cr_dates_fast (scan)")
+
+        def chunks():
+            for path in tqdm(cached, desc="Merging files", unit="chunk"):
+                yield pd.read_parquet(path)
+                path.unlink()
+
+    sparse = numeric & (non_null < sparse_threshold * max(n_rows, 1))
+    sparse[[c for c in KEY_COLS if c in sparse.index]] = False
+    sparse_cols = [c for c in master_cols if sparse[c]]
+    dense_cols = [c for c in master_cols if not sparse[c]]
+    print(f"Info: {len(sparse_cols)} of {len(master_cols)} columns are filled in less than "
+          f"{sparse_threshold:.0%} of the rows and are stored in long form.")
+
+    # 2) Split every chunk into the wide CSV and the long table
+    pd.DataFrame(columns=dense_cols).to_csv(output_csv, index=False)
+    schema = pa.schema([("IDRSSD", pa.int64()), ("Date", pa.timestamp("ns")),
+                        ("mdrm", pa.string()), ("value", pa.float64())],
+                       metadata={SPARSE_CODES_KEY: json.dumps(sparse_cols).encode()})
+    with pq.ParquetWriter(sparse_path, schema, compression="zstd") as writer:
+        for df_part in chunks():
+            df_part.reindex(columns=dense_cols).to_csv(output_csv, mode="a", header=False, index=False)
+
+            present = [c for c in sparse_cols if c in df_part.columns]
+            long = (df_part[["IDRSSD", "Date"] + present]
+                    .melt(id_vars=["IDRSSD", "Date"], var_name="mdrm", value_name="value")
+                    .dropna(subset=["value"]))
+            long["Date"] = long["Date"].astype("datetime64[ns]")
+            writer.write_table(pa.Table.from_pandas(long, schema=schema, preserve_index=False))
+            del df_part, long
+            if budget is not None:
+                budget.check("merge_cr_dates_fast")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def read_sparse_codes(folder_path):
+    """Codes stored in long form next to the merged CSV of `folder_path` ([] in wide storage mode)."""
+    path = os.path.join(folder_path, SPARSE_FILE)
+    if not os.path.exists(path):
+        return []
+    return json.loads(pq.read_schema(path).metadata[SPARSE_CODES_KEY])
+
+
+def load_sparse_columns(folder_path, codes):
+    """
+    Pivot the long-form cells of `codes` back to wide.
+
+    Returns:
+        pd.DataFrame: One row per (IDRSSD, Date) with at least one non-empty cell, one column per code.
+    """
+    path = os.path.join(folder_path, SPARSE_FILE)
+    long = pq.read_table(path, filters=[("mdrm", "in", list(codes))]).to_pandas()
+    if long.empty:
+        return pd.DataFrame(columns=["IDRSSD", "Date"] + list(codes))
+    wide = long.pivot_table(index=["IDRSSD", "Date"], columns="mdrm", values="value", aggfunc="first")
+    wide = wide.reindex(columns=list(codes)).reset_index()
+    wide.columns.name = None
+    return wide
@@ -0,0 +1,154 @@
+import json
+import os
+
+import pandas as pd
+
+# Bump whenever the on-disk cache layout or the CSV parsing rules change,
+# so that every existing cache is rebuilt on the next run.
+CACHE_VERSION = 1
+
+# NIC tables used by the pipeline and their file names inside the NIC folder.
+NIC_FILES = {
+    "attributes_active": "CSV_ATTRIBUTES_ACTIVE.CSV",
+    "attributes_closed": "CSV_ATTRIBUTES_CLOSED.CSV",
+    "relationships":     "CSV_RELATIONSHIPS.csv",
+    "transformations":   "CSV_TRANSFORMATIONS.CSV",
+}
+
+
+def file_fingerprint(path):
+    """
+    Cheap fingerprint of a source file, used to invalidate derived caches.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        dict: The file name, size in bytes and modification time in nanoseconds.
+    """
+    st = os.stat(path)
+    return {"file": os.path.basename(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def nic_cache_dir(nic_folder):
+    """Folder where the binary NIC caches live (inside the NIC folder)."""
+    return os.path.join(nic_folder, "_cache")
+
+
+def _cache_paths(nic_folder, table):
+    cache_dir = nic_cache_dir(nic_folder)
+    return (os.path.join(cache_dir, f"{table}.parquet"),
+            os.path.join(cache_dir, f"{table}.json"))
+
+
+def _read_meta(meta_fp):
+    try:
+        with open(meta_fp) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _build_cache(source_fp, data_fp, meta_fp, fingerprint):
+    """
+    Parse the NIC CSV once and store it as a typed, compressed Parquet file.
+
+    Mixed-type object columns are stored as nullable strings so that the
+    columnar writer accepts them; numeric columns keep the dtypes pandas infers.
+    """
+    df = pd.read_csv(source_fp, low_memory=False)
+    for c in df.columns:
+        if df[c].dtype == object:
+            df[c] = df[c].astype("string")
+
+    os.makedirs(os.path.dirname(data_fp), exist_ok=True)
+    # Write to temporary files first, then swap in, so an interrupted run never leaves
+    # a half-written cache that looks valid.
+    df.to_parquet(data_fp + ".tmp", index=False, compression="zstd")
+    with open(meta_fp + ".tmp", "w") as f:
+        json.dump({"version": CACHE_VERSION, "source": fingerprint,
+                   "columns": list(df.columns)}, f)
+    os.replace(data_fp + ".tmp", data_fp)
+    os.replace(meta_fp + ".tmp", meta_fp)
+
+
+def ensure_nic_cache(nic_folder, table):
+    """
+    Make sure the binary cache for `table` exists and matches the current source file.
+
+    Args:
+        nic_folder (str): Folder containing the NIC CSV files.
+        table (str): One of the keys of NIC_FILES.
+
+    Returns:
+        tuple[str, dict]: Path to the Parquet cache and the source fingerprint it was built from.
+    """
+    if table not in NIC_FILES:
+        raise KeyError(f"Unknown NIC table '{table}'. Expected one of {list(NIC_FILES)}")
+
+    source_fp = os.path.join(nic_folder, NIC_FILES[table])
+    if not os.path.isfile(source_fp):
+        raise FileNotFoundError(f"NIC file not found: {source_fp}")
+
+    data_fp, meta_fp = _cache_paths(nic_folder, table)
+    fingerprint = file_fingerprint(source_fp)
+    meta = _read_meta(meta_fp)
+
+    fresh = (
+        meta is not None
+        and meta.get("version") == CACHE_VERSION
+        and meta.get("source") == fingerprint
+        and os.path.isfile(data_fp)
+    )
+    if not fresh:
+        print(f"Info: building NIC cache for {NIC_FILES[table]}")
+        _build_cache(source_fp, data_fp, meta_fp, fingerprint)
+
+    return data_fp, fingerprint
+
+
+def read_nic_table(nic_folder, table, columns=None):
+    """
+    Read (a subset of columns of) a NIC table through its binary cache.
+
+    The CSV is parsed only when the cache is missing or the source file changed
+    (size or modification time). Otherwise only the requested columns are read from
+    the Parquet cache; nothing is kept in memory between calls.
+
+    Args:
+        nic_folder (str): Folder containing the NIC CSV files.
+        table (str): One of the keys of NIC_FILES (e.g. 'attributes_active').
+        columns (list, optional): Columns to load, using the names in the CSV header.
+
+    Returns:
+        pandas.DataFrame: A new frame the caller is free to modify.
+    """
+    data_fp, _ = ensure_nic_cache(nic_folder, table)
+    return pd.read_parquet(data_fp, columns=list(columns) if columns is not None else None)
+
+
+def read_nic_attributes(nic_folder, columns):
+    """
+    Read the given columns from the active and the closed NIC attributes files,
+    stacked in that order (active first, closed second).
+    """
+    active = read_nic_table(nic_folder, "attributes_active", columns)
+    closed = read_nic_table(nic_folder, "attributes_closed", columns)
+    return pd.concat([active, closed], ignore_index=True)
+
+
+def prepare_nic_reference(nic_folder):
+    """
+    Convert every NIC file present in `nic_folder` into its binary cache.
+
+    Args:
+        nic_folder (str): Folder containing the NIC CSV files.
+
+    Returns:
+        dict: table name → source fingerprint, for the tables that were found.
+    """
+    fingerprints = {}
+    for table, fname in NIC_FILES.items():
+        if os.path.isfile(os.path.join(nic_folder, fname)):
+            _, fingerprints[table] = ensure_nic_cache(nic_folder, table)
+    return fingerprints
@@ -0,0 +1,254 @@
+import os
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from panel_store import open_panel, iter_report_dates, frame_digest
+from stage_graph import content_digest
+from profiling import profile
+
+# Asset-size classes: lower bounds of total_assets (thousands of dollars, as reported) and labels
+SIZE_BUCKETS = ((0, "<$100M"), (1e5, "$100M-$1B"), (1e6, "$1B-$10B"), (1e7, "$10B-$100B"), (1e8, ">$100B"))
+UNKNOWN = "unknown"
+
+# Relative accuracy of the quantile sketches: every quantile is within 1% of a value of the data
+SKETCH_ACCURACY = 0.01
+
+# Bookkeeping of an aggregates folder: the settings and the digest of the bank rows behind every quarter
+MANIFEST_FILE = "_aggregates.json"
+
+CELL = ["date", "charter_type", "size_bucket"]
+
+
+def size_buckets(total_assets, buckets=SIZE_BUCKETS):
+    """Label of the asset-size class of every bank ('unknown' when total_assets is missing)."""
+    assets = np.asarray(total_assets, dtype="float64")
+    bounds = np.array([b for b, _ in buckets], dtype="float64")
+    labels = np.array([label for _, label in buckets] + [UNKNOWN], dtype=object)
+    pos = np.searchsorted(bounds, assets, side="right") - 1
+    return labels[np.where(np.isnan(assets), len(buckets), np.maximum(pos, 0))]
+
+
+def _gamma(accuracy):
+    return (1 + accuracy) / (1 - accuracy)
+
+
+def sketch_bins(x, accuracy=SKETCH_ACCURACY):
+    """
+    Bin of every value in a logarithmic quantile sketch: sign (-1, 0, 1) and index k, with |x| in
+    (gamma**(k-1), gamma**k]. Every value of a bin is within `accuracy` of its representative
+    (representative_values), and sketches merge by adding the counts of equal bins.
+    """
+    x = np.asarray(x, dtype="float64")
+    sign = np.sign(x).astype("int8")
+    with np.errstate(divide="ignore"):
+        k = np.ceil(np.log(np.abs(x)) / np.log(_gamma(accuracy)))
+    return sign, np.where(sign == 0, 0, k).astype("int32")
+
+
+def representative_values(sign, k, accuracy=SKETCH_ACCURACY):
+    """Value standing for the bins (sign, k) of sketch_bins."""
+    gamma = _gamma(accuracy)
+    return sign * 2 * gamma ** np.asarray(k, dtype="float64") / (gamma + 1)
+
+
+def aggregate_quarter(df, variables, buckets=SIZE_BUCKETS, accuracy=SKETCH_ACCURACY):
+    """
+    Sums, counts, minimum, maximum and quantile sketch of every variable per (date, charter_type, size_bucket).
+
+    Parameters:
+      df (pd.DataFrame): Bank rows with 'date', 'charter_type', 'total_assets' and the variables.
+      variables (list): Numeric columns to aggregate.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame):
+          summary: date, charter_type, size_bucket, variable, n_banks, count (banks with a value), sum, min, max;
+          sketch:  date, charter_type, size_bucket, variable, sign, bin, count.
+        Banks without a charter type get charter_type -1.
+    """
+    with profile("aggregate_quarter", rows=len(df), variables=len(variables)) as rec:
+        # 1) Cell of every bank
+        cells = pd.DataFrame({"date": df["date"].to_numpy(),
+                              "charter_type": df["charter_type"].fillna(-1).to_numpy("int64"),
+                              "size_bucket": size_buckets(df["total_assets"], buckets)})
+        codes, keys = pd.MultiIndex.from_frame(cells).factorize()
+        keys = pd.DataFrame(list(keys), columns=CELL)
+        n_cells = len(keys)
+        x = df[variables].to_numpy(dtype="float64", na_value=np.nan)
+        known = ~np.isnan(x)
+
+        # 2) Per cell and variable: np.add.at / fmin.at / fmax.at over all variables at once
+        shape = (n_cells, len(variables))
+        count = np.zeros(shape, "int64")
+        total = np.zeros(shape)
+        low = np.full(shape, np.nan)
+        high = np.full(shape, np.nan)
+        np.add.at(count, codes, known)
+        np.add.at(total, codes, np.where(known, x, 0.0))
+        np.fmin.at(low, codes, x)
+        np.fmax.at(high, codes, x)
+        n_banks = np.bincount(codes, minlength=n_cells)
+
+        summary = keys.iloc[np.repeat(np.arange(n_cells), len(variables))].reset_index(drop=True)
+        summary["variable"] = np.tile(np.array(variables, dtype=object), n_cells)
+        summary["n_banks"] = np.repeat(n_banks, len(variables))
+        summary["count"] = count.ravel()
+        summary["sum"] = np.where(count > 0, total, np.nan).ravel()
+        summary["min"] = low.ravel()
+        summary["max"] = high.ravel()
+
+        # 3) Sketch: count of the known values per (cell, variable, bin)
+        row, var = np.nonzero(known)
+        sign, k = sketch_bins(x[row, var], accuracy)
+        bins = pd.DataFrame({"cell": codes[row], "var": var, "sign": sign, "bin": k})
+        bins = bins.groupby(["cell", "var", "sign", "bin"], sort=True).size().reset_index(name="count")
+        sketch = keys.iloc[bins["cell"].to_numpy()].reset_index(drop=True)
+        sketch["variable"] = np.array(variables, dtype=object)[bins["var"].to_numpy()]
+        sketch = pd.concat([sketch, bins[["sign", "bin", "count"]]], axis=1)
+        rec.frame_out(summary)
+    return summary, sketch
+
+
+def _quarter_dir(out_dir, quarter):
+    return os.path.join(out_dir, f"date={quarter}")
+
+
+def materialize_aggregates(panel_dir, out_dir, variables, buckets=SIZE_BUCKETS, accuracy=SKETCH_ACCURACY):
+    """
+    Precompute the industry aggregates of the clean panel per (date, charter_type, size_bucket):
+
+        out_dir/
+            date=2019-12-31/summary.parquet   n_banks, count, sum, min, max of every variable and cell
+            date=2019-12-31/sketch.parquet    quantile sketch bins of every variable and cell
+            ...
+            _aggregates.json                  settings and digest of the bank rows behind every report date
+
+    Incremental by quarter: a report date is aggregated again only when its bank rows or the settings
+    changed, so adding a quarter to the panel aggregates that quarter alone. Report dates no longer in
+    the panel are removed. Read the result with read_aggregates() and aggregate_quantiles().
+
+    Parameters:
+      panel_dir (str): Folder written by PanelWriter (with 'charter_type' and 'total_assets').
+      out_dir (str): Output folder.
+      variables (list): Variables to aggregate (e.g. the new_vars of mappings.py). Missing or
+                        non-numeric columns are skipped with a warning.
+      buckets (tuple): (lower bound of total_assets, label) of the size classes.
+      accuracy (float): Relative accuracy of the quantile sketches.
+
+    Returns:
+        list: Report dates ('YYYY-MM-DD') that were (re)aggregated.
+    """
+    schema = open_panel(panel_dir).schema
+    for col in ("charter_type", "total_assets"):
+        if col not in schema.names:
+            raise KeyError(f"'{col}' is not a column of {panel_dir}.")
+    numeric = [v for v in dict.fromkeys(variables) if v in schema.names
+               and (pa.types.is_integer(schema.field(v).type) or pa.types.is_floating(schema.field(v).type))]
+    skipped = [v for v in variables if v not in numeric]
+    if skipped:
+        print(f"Warning: not aggregated (missing or not numeric): {skipped}")
+
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    settings = content_digest({"variables": numeric, "buckets": buckets, "accuracy": accuracy})
+    done = manifest.get("quarters", {}) if manifest.get("settings") == settings else {}
+
+    # 1) The panel one report date at a time; unchanged bank rows and settings keep their aggregates
+    updated, digests = [], {}
+    for q, rows in iter_report_dates(panel_dir, list(dict.fromkeys(["charter_type", "total_assets"] + numeric))):
+        digests[q] = frame_digest(rows)
+        if done.get(q) == digests[q] and os.path.isdir(_quarter_dir(out_dir, q)):
+            continue
+        summary, sketch = aggregate_quarter(rows, numeric, buckets, accuracy)
+        os.makedirs(_quarter_dir(out_dir, q), exist_ok=True)
+        summary.to_parquet(os.path.join(_quarter_dir(out_dir, q), "summary.parquet"), index=False)
+        sketch.to_parquet(os.path.join(_quarter_dir(out_dir, q), "sketch.parquet"), index=False)
+        updated.append(q)
+
+    # 2) Report dates that left the panel
+    for name in os.listdir(out_dir):
+        if name.startswith("date=") and name[len("date="):] not in digests:
+            shutil.rmtree(os.path.join(out_dir, name))
+
+    with open(manifest_path, "w") as f:
+        json.dump({"settings": settings, "variables": numeric, "accuracy": accuracy, "quarters": digests}, f, indent=2)
+    print(f"Info: aggregated {len(updated)} of {len(digests)} report dates in {out_dir}")
+    return updated
+
+
+def _read(out_dir, name, variables=None, start=None, end=None):
+    filters = [("variable", "in", list(variables))] if variables is not None else None
+    frames = []
+    for entry in sorted(os.listdir(out_dir)):
+        if not entry.startswith("date="):
+            continue
+        date = pd.Timestamp(entry[len("date="):])
+        if (start is not None and date < pd.Timestamp(start)) or (end is not None and date > pd.Timestamp(end)):
+            continue
+        frames.append(pd.read_parquet(os.path.join(out_dir, entry, name), filters=filters))
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+
+def read_aggregates(out_dir, variables=None, start=None, end=None):
+    """
+    Industry totals written by materialize_aggregates(): one row per (date, charter_type, size_bucket, variable)
+    with n_banks, count, sum, min and max. Coarser totals are sums of these rows, e.g.
+    read_aggregates(d, ["total_assets"]).groupby("date")["sum"].sum().
+
+    Args:
+        out_dir (str): Folder written by materialize_aggregates.
+        variables (list[str], optional): Variables to read (default: all).
+        start, end (str or datetime, optional): Inclusive range of report dates.
+    """
+    df = _read(out_dir, "summary.parquet", variables, start, end)
+    return df if df is not None else pd.DataFrame(columns=CELL + ["variable", "n_banks", "count", "sum", "min", "max"])
+
+
+def aggregate_quantiles(out_dir, variable, quantiles=(0.1, 0.25, 0.5, 0.75, 0.9), by=("date", "charter_type"),
+                        start=None, end=None):
+    """
+    Quantiles of a variable over the banks of each group, from the sketches of materialize_aggregates():
+    the sketches of the cells of a group are merged, so any grouping coarser than
+    (date, charter_type, size_bucket) is available without the panel.
+
+    Args:
+        out_dir (str): Folder written by materialize_aggregates.
+        variable (str): Variable.
+        quantiles (tuple): Quantiles to compute, in [0, 1].
+        by (tuple): Grouping columns among 'date', 'charter_type' and 'size_bucket'.
+        start, end (str or datetime, optional): Inclusive range of report dates.
+
+    Returns:
+        pd.DataFrame: The `by` columns, 'count' and one column per quantile ('q0.5', …), exact within the
+                      sketch accuracy.
+    """
+    by = list(by)
+    sketch = _read(out_dir, "sketch.parquet", [variable], start, end)
+    columns = by + ["count"] + [f"q{q:g}" for q in quantiles]
+    if sketch is None or sketch.empty:
+        return pd.DataFrame(columns=columns)
+    with open(os.path.join(out_dir, MANIFEST_FILE)) as f:
+        accuracy = json.load(f)["accuracy"]
+
+    # 1) Merged sketch of every group, its bins in increasing value order
+    merged = sketch.groupby(by + ["sign", "bin"], sort=False)["count"].sum().reset_index()
+    merged["value"] = representative_values(merged["sign"].to_numpy(), merged["bin"].to_numpy(), accuracy)
+    merged = merged.sort_values(by + ["value"], kind="mergesort").reset_index(drop=True)
+    groups = merged.groupby(by, sort=False)
+    cum = groups["count"].cumsum().to_numpy()
+    n = groups["count"].transform("sum").to_numpy()
+
+    # 2) Quantile q: the value of the first bin whose cumulative count goes past rank q * (n - 1)
+    out = groups["count"].sum().reset_index()
+    first = groups.ngroup().to_numpy()
+    for q in quantiles:
+        past = merged[cum > q * (n - 1)]
+        out[f"q{q:g}"] = past["value"].to_numpy()[np.unique(first[past.index], return_index=True)[1]]
+    return out[columns]
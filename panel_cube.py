@@ -0,0 +1,162 @@
+import os
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from pandas.api.types import is_numeric_dtype
+
+from profiling import profile
+
+# Files of a cube folder
+VALUES_FILE = "values.npy"
+BANKS_FILE = "idrssd.npy"
+QUARTERS_FILE = "quarters.npy"
+META_FILE = "cube.json"
+
+
+def _frame(source, columns=None):
+    if isinstance(source, pd.DataFrame):
+        return source if columns is None else source[columns]
+    return pd.read_parquet(source, columns=columns)
+
+
+def _dtypes(source):
+    if isinstance(source, pd.DataFrame):
+        return source.dtypes
+    return pq.read_schema(source).empty_table().to_pandas().dtypes
+
+
+def write_cube(cube_dir, sources, variables, dtype="float64", metadata=None):
+    """
+    Write constructed variables as a dense bank × quarter × variable array, memory-mapped on disk:
+
+        cube_dir/
+            values.npy     (n_banks, n_quarters, n_variables) float32 or float64, NaN where a bank did not report
+            idrssd.npy     sorted bank IDs (axis 0)
+            quarters.npy   sorted report dates, datetime64[D] (axis 1)
+            cube.json      variable names (axis 2), dtype and `metadata`
+
+    The sources are read twice: once for the idrssd and date columns, to size the axes, then one at a time
+    to fill the array, so only one source and the memory-mapped file are in memory at once.
+
+    Parameters:
+      cube_dir (str): Output folder. Any previous content is removed.
+      sources (list): DataFrames or Parquet files with 'idrssd', 'date' and the variables
+                      (e.g. the bank partitions of the constructed dataset).
+      variables (list): Columns to store, in order (e.g. the new_vars of mappings.py). Non-numeric ones are skipped.
+      dtype (str): 'float32' (half the size) or 'float64'.
+      metadata (dict, optional): JSON-serialisable information stored in cube.json.
+
+    Returns:
+      Cube: The written cube, opened read-only.
+    """
+    if dtype not in ("float32", "float64"):
+        raise ValueError(f"dtype must be 'float32' or 'float64', got '{dtype}'.")
+
+    # 1) Axes: every bank and every report date of the sources
+    banks, quarters, numeric = [], [], None
+    for source in sources:
+        keys = _frame(source, ["idrssd", "date"])
+        banks.append(keys["idrssd"].unique())
+        quarters.append(pd.to_datetime(keys["date"]).dropna().unique())
+        if numeric is None:
+            dtypes = _dtypes(source)
+            numeric = [v for v in variables if v in dtypes.index and is_numeric_dtype(dtypes[v])]
+    banks = np.unique(np.concatenate(banks)).astype("int64")
+    quarters = np.unique(np.concatenate(quarters)).astype("datetime64[D]")
+    skipped = [v for v in variables if v not in numeric]
+    if skipped:
+        print(f"Warning: not stored in the cube (missing or not numeric): {skipped}")
+
+    shutil.rmtree(cube_dir, ignore_errors=True)
+    os.makedirs(cube_dir)
+    np.save(os.path.join(cube_dir, BANKS_FILE), banks)
+    np.save(os.path.join(cube_dir, QUARTERS_FILE), quarters)
+
+    # 2) Values: NaN everywhere, then the rows of each source at their (bank, quarter) cells
+    shape = (len(banks), len(quarters), len(numeric))
+    values = np.lib.format.open_memmap(os.path.join(cube_dir, VALUES_FILE), mode="w+", dtype=dtype, shape=shape)
+    values[:] = np.nan
+    with profile("write_cube", banks=shape[0], quarters=shape[1], variables=shape[2]) as rec:
+        for source in sources:
+            df = _frame(source, ["idrssd", "date"] + numeric)
+            df = df[df["date"].notna()]
+            b = np.searchsorted(banks, df["idrssd"].to_numpy("int64"))
+            q = np.searchsorted(quarters, pd.to_datetime(df["date"]).to_numpy().astype("datetime64[D]"))
+            values[b, q, :] = df[numeric].to_numpy(dtype=dtype, na_value=np.nan)
+            del df
+        values.flush()
+        rec.meta["cube_bytes"] = values.nbytes
+    del values
+
+    with open(os.path.join(cube_dir, META_FILE), "w") as f:
+        json.dump({"variables": numeric, "dtype": dtype, "shape": list(shape), **(metadata or {})}, f, indent=2)
+    print(f"Info: cube of {shape[0]} banks × {shape[1]} quarters × {shape[2]} variables saved to {cube_dir}")
+    return Cube(cube_dir)
+
+
+class Cube:
+    def __init__(self, cube_dir, mode="r"):
+        """
+        A cube written by write_cube(), opened without reading it: `values` is a NumPy memmap, so the
+        pages are loaded on access and shared by every process that opens the same cube.
+
+        Every selection below returns a view of `values` (no copy):
+
+            cube = Cube("data/clean/call_reports_cube")
+            cube.bank(480228)                    # quarters × variables
+            cube.quarter("2020-12-31")           # banks × variables
+            cube.variable("total_assets")        # banks × quarters
+            cube.values[:, -8:, cube.var_index["total_loans"]]
+
+        Parameters:
+          cube_dir (str): Folder written by write_cube().
+          mode (str): 'r' (read-only) or 'r+' (writes go to the file).
+
+        Attributes:
+          values (np.memmap): (n_banks, n_quarters, n_variables) array.
+          banks (np.ndarray): Bank IDs of axis 0. quarters (np.ndarray): Report dates of axis 1.
+          variables (list): Variable names of axis 2.
+          bank_index, quarter_index, var_index (dict): Label → position on each axis.
+          meta (dict): Content of cube.json.
+        """
+        self.cube_dir = cube_dir
+        with open(os.path.join(cube_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.values = np.load(os.path.join(cube_dir, VALUES_FILE), mmap_mode=mode)
+        self.banks = np.load(os.path.join(cube_dir, BANKS_FILE))
+        self.quarters = np.load(os.path.join(cube_dir, QUARTERS_FILE))
+        self.variables = list(self.meta["variables"])
+        self.bank_index = {int(b): i for i, b in enumerate(self.banks)}
+        self.quarter_index = {pd.Timestamp(q): i for i, q in enumerate(self.quarters)}
+        self.var_index = {v: i for i, v in enumerate(self.variables)}
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def bank(self, idrssd):
+        """quarters × variables view of one bank."""
+        return self.values[self.bank_index[int(idrssd)]]
+
+    def quarter(self, date):
+        """banks × variables view of one report date."""
+        return self.values[:, self.quarter_index[pd.Timestamp(date)]]
+
+    def variable(self, name):
+        """banks × quarters view of one variable."""
+        return self.values[:, :, self.var_index[name]]
+
+    def to_frame(self, variables=None):
+        """The cube back as a long DataFrame (idrssd, date, variables), without the empty bank-quarters."""
+        variables = variables or self.variables
+        cols = [self.var_index[v] for v in variables]
+        flat = self.values[:, :, cols].reshape(-1, len(cols))
+        filled = ~np.isnan(flat).all(axis=1)
+        bank, quarter = np.divmod(np.flatnonzero(filled), len(self.quarters))
+        df = pd.DataFrame(flat[filled], columns=variables)
+        df.insert(0, "date", pd.to_datetime(self.quarters[quarter]))
+        df.insert(0, "idrssd", self.banks[bank])
+        return df
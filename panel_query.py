@@ -0,0 +1,156 @@
+import os
+
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:  # optional: without it, queries fall back to pyarrow + pandas
+    duckdb = None
+
+from panel_store import PARTITION_KEYS, open_panel, read_panel
+
+# Aggregates accepted in query_panel(aggregates=...): name → DuckDB SQL function / pandas method
+AGGREGATES = {
+    "sum": ("sum", "sum"),
+    "mean": ("avg", "mean"),
+    "median": ("median", "median"),
+    "min": ("min", "min"),
+    "max": ("max", "max"),
+    "std": ("stddev_samp", "std"),
+    "count": ("count", "count"),
+}
+
+
+def _as_list(values):
+    if values is None:
+        return None
+    if isinstance(values, (str, int, float)):
+        return [values]
+    return list(values)
+
+
+def _normalize_aggregates(aggregates):
+    """{'total_deposits': 'sum'} or [('total_deposits', 'sum'), …] → [(column, func, output name), …]."""
+    items = aggregates.items() if isinstance(aggregates, dict) else aggregates
+    out = []
+    for column, func in items:
+        for f in _as_list(func):
+            if f not in AGGREGATES:
+                raise ValueError(f"Unknown aggregate '{f}'. Use one of {sorted(AGGREGATES)}.")
+            out.append((column, f, f"{column}_{f}"))
+    return out
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def query_panel(dataset_dir, columns=None, idrssd=None, start=None, end=None, charter_type=None, tic=None,
+                group_by=None, aggregates=None, engine="auto"):
+    """
+    Filter, project and aggregate the clean panel without loading it.
+
+    Filters and the column projection are pushed down to the Parquet files: only the partitions
+    overlapping [start, end] are opened, and only the requested columns are read.
+
+    Examples:
+        # Total deposits by charter type per quarter
+        query_panel(path, group_by=["charter_type", "date"], aggregates={"total_deposits": "sum"})
+        # Two banks' balance sheets over 2019
+        query_panel(path, ["total_assets", "total_deposits"], idrssd=[480228, 852218],
+                    start="2019-01-01", end="2019-12-31")
+
+    Args:
+        dataset_dir (str): The clean Parquet dataset (clean/final_call_reports_dataset).
+        columns (list[str], optional): Columns to return when not aggregating ('idrssd' and 'date'
+                                       are always included). Default: all.
+        idrssd, charter_type, tic (scalar or list, optional): Keep only these banks / charter types / tickers.
+        start, end (str or datetime, optional): Inclusive range of report dates.
+        group_by (list[str], optional): Grouping columns of the aggregates (e.g. ['charter_type', 'date']).
+        aggregates (dict or list of pairs, optional): {column: func or [funcs]}, with func one of AGGREGATES.
+                                                      Output columns are named '{column}_{func}'.
+        engine (str): 'duckdb', 'pandas' (pyarrow scan + pandas), or 'auto' (DuckDB when installed).
+
+    Returns:
+        pd.DataFrame
+    """
+    filters = {"idrssd": _as_list(idrssd), "charter_type": _as_list(charter_type), "tic": _as_list(tic)}
+    filters = {k: v for k, v in filters.items() if v is not None}
+    group_by = _as_list(group_by) or []
+    aggs = _normalize_aggregates(aggregates) if aggregates else []
+    if group_by and not aggs:
+        raise ValueError("group_by needs at least one aggregate.")
+
+    if engine == "auto":
+        engine = "duckdb" if duckdb is not None else "pandas"
+    if engine == "duckdb":
+        if duckdb is None:
+            raise ImportError("engine='duckdb' requires the duckdb package (pip install duckdb).")
+        return _query_duckdb(dataset_dir, columns, filters, start, end, group_by, aggs)
+    if engine == "pandas":
+        return _query_pandas(dataset_dir, columns, filters, start, end, group_by, aggs)
+    raise ValueError(f"Unknown engine '{engine}'. Use 'auto', 'duckdb' or 'pandas'.")
+
+
+def _query_duckdb(dataset_dir, columns, filters, start, end, group_by, aggs):
+    dataset = open_panel(dataset_dir)
+    key = dataset.partitioning.schema.names[0]
+    available = set(dataset.schema.names)
+    wanted = (group_by + [c for c, _, _ in aggs]) if aggs else (columns or [])
+    missing = [c for c in wanted + list(filters) if c not in available]
+    if missing:
+        raise KeyError(f"Columns not in the panel: {missing}")
+
+    where, params = [], []
+    for column, values in filters.items():
+        where.append(f"{_quote(column)} IN ({', '.join('?' * len(values))})")
+        params.extend(values)
+    # The partition column lets DuckDB skip whole year/quarter folders
+    for bound, op in ((start, ">="), (end, "<=")):
+        if bound is None:
+            continue
+        bound = pd.Timestamp(bound)
+        where.append(f"{_quote(key)} {op} ?")
+        params.append(bound.year if key == "year" else f"{bound.year}Q{bound.quarter}")
+        where.append(f"date {op} ?")
+        params.append(bound.to_pydatetime())
+
+    if aggs:
+        select = [_quote(c) for c in group_by] + [
+            f"{AGGREGATES[f][0]}({_quote(c)}) AS {_quote(name)}" for c, f, name in aggs]
+    elif columns:
+        select = [_quote(c) for c in ["idrssd", "date"] + [c for c in columns if c not in ("idrssd", "date")]]
+    else:
+        select = ["* EXCLUDE (" + _quote(key) + ")"]
+
+    files = os.path.join(dataset_dir, f"{key}=*", "*.parquet").replace("\\", "/")
+    sql = (f"SELECT {', '.join(select)} FROM read_parquet(?, hive_partitioning = true, "
+           f"hive_types = {{'{key}': {'INTEGER' if key == 'year' else 'VARCHAR'}}})")
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if group_by:
+        cols = ", ".join(_quote(c) for c in group_by)
+        sql += f" GROUP BY {cols} ORDER BY {cols}"
+
+    with duckdb.connect() as con:
+        return con.execute(sql, [files] + params).df()
+
+
+def _query_pandas(dataset_dir, columns, filters, start, end, group_by, aggs):
+    needed = (group_by + [c for c, _, _ in aggs]) if aggs else columns
+    if needed is not None:
+        needed = list(dict.fromkeys(needed + list(filters)))
+    df = read_panel(dataset_dir, needed, start=start, end=end)
+    df = df.drop(columns=[c for c in PARTITION_KEYS if c in df.columns and c not in (needed or [])])
+    for column, values in filters.items():
+        df = df[df[column].isin(values)]
+
+    if not aggs:
+        if columns is not None:
+            df = df[["idrssd", "date"] + [c for c in columns if c not in ("idrssd", "date")]]
+        return df.reset_index(drop=True)
+
+    named = {name: (c, AGGREGATES[f][1]) for c, f, name in aggs}
+    if group_by:
+        return df.groupby(group_by, sort=True, dropna=False).agg(**named).reset_index()
+    return pd.DataFrame({name: [getattr(df[c], method)()] for name, (c, method) in named.items()})
@@ -0,0 +1,307 @@
+import os
+import json
+import shutil
+import hashlib
+import functools
+
+import numpy as np
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Key of the JSON metadata embedded in the Parquet schema of every file of the panel
+PANEL_METADATA_KEY = b"call_reports"
+
+PARTITION_KEYS = ("year", "quarter")
+
+# Row ranges of every bank in every file of the panel, next to the data
+BANK_INDEX_FILE = "_bank_index.parquet"
+
+# Rows per Parquet row group: the unit read by get_bank_history
+ROW_GROUP_ROWS = 16_384
+
+
+def _partition_values(dates, partition_by):
+    """Partition value of each row: the year (2020) or the quarter ('2020Q1') of its report date."""
+    dates = pd.to_datetime(dates)
+    if partition_by == "year":
+        return dates.dt.year
+    if partition_by == "quarter":
+        return dates.dt.year.astype(str) + "Q" + dates.dt.quarter.astype(str)
+    raise ValueError(f"partition_by must be one of {PARTITION_KEYS}, got '{partition_by}'.")
+
+
+def _quarters(dates):
+    return sorted(pd.to_datetime(dates).dropna().dt.strftime("%Y-%m-%d").unique().tolist())
+
+
+class PanelWriter:
+    def __init__(self, dataset_dir, partition_by="year", metadata=None):
+        """
+        Write the clean panel as a Parquet dataset partitioned by report year or quarter:
+
+            dataset_dir/
+                year=2019/part-00000.parquet
+                year=2020/part-00000.parquet
+                ...
+                _common_metadata
+
+        Frames are written one at a time with write(), so the panel never has to be held in memory
+        as a whole. The first frame fixes the column types; later frames are cast to the same schema.
+        Every file carries the JSON `metadata` (e.g. the mappings version) in its schema, together
+        with the report dates it contains; _common_metadata lists the report dates of the whole panel.
+
+        The rows of every file are sorted by (idrssd, date), and _bank_index.parquet records the row
+        range of each bank in each file, so get_bank_history() reads one bank without scanning the panel.
+
+        Parameters:
+          dataset_dir (str): Output folder. Any previous content is removed.
+          partition_by (str): 'year' or 'quarter'.
+          metadata (dict, optional): JSON-serialisable information embedded in every file.
+        """
+        if partition_by not in PARTITION_KEYS:
+            raise ValueError(f"partition_by must be one of {PARTITION_KEYS}, got '{partition_by}'.")
+        self.dataset_dir = dataset_dir
+        self.partition_by = partition_by
+        self.metadata = dict(metadata or {})
+        self.schema = None
+        self.quarters = set()
+        self._n_written = 0
+        self._bank_index = []
+
+        shutil.rmtree(dataset_dir, ignore_errors=True)
+        os.makedirs(dataset_dir)
+
+    def _schema_with(self, quarters):
+        meta = {**self.metadata, "partition_by": self.partition_by, "quarters": quarters}
+        return self.schema.with_metadata({PANEL_METADATA_KEY: json.dumps(meta).encode()})
+
+    def _to_table(self, df):
+        if self.schema is None:
+            # Typed columns: text as strings (also when a column is entirely missing), dates as timestamps
+            df = df.astype({c: "string" for c in df.columns if df[c].dtype == object})
+            self.schema = pa.Schema.from_pandas(df, preserve_index=False).remove_metadata()
+        return pa.Table.from_pandas(df[self.schema.names], schema=self.schema, preserve_index=False)
+
+    def write(self, df):
+        """Append a DataFrame with a 'date' column to the dataset, one file per partition it touches."""
+        keys = _partition_values(df["date"], self.partition_by)
+        for key, part in df.groupby(keys, sort=True):
+            part = part.sort_values(["idrssd", "date"], kind="mergesort")
+            quarters = _quarters(part["date"])
+            self.quarters.update(quarters)
+            table = self._to_table(part).replace_schema_metadata(self._schema_with(quarters).metadata)
+            file = os.path.join(f"{self.partition_by}={key}", f"part-{self._n_written:05d}.parquet")
+            os.makedirs(os.path.join(self.dataset_dir, os.path.dirname(file)), exist_ok=True)
+            pq.write_table(table, os.path.join(self.dataset_dir, file), compression="zstd",
+                           row_group_size=ROW_GROUP_ROWS)
+            self._bank_index.append(_bank_ranges(part, file))
+        self._n_written += 1
+
+    def close(self):
+        """Write the dataset-level schema and metadata (_common_metadata)."""
+        if self.schema is not None:
+            pq.write_metadata(self._schema_with(sorted(self.quarters)),
+                              os.path.join(self.dataset_dir, "_common_metadata"))
+            index = pd.concat(self._bank_index, ignore_index=True).sort_values(["idrssd", "file"], kind="mergesort")
+            index.to_parquet(os.path.join(self.dataset_dir, BANK_INDEX_FILE), index=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+def _bank_ranges(part, file):
+    """[start, stop) row range and first/last report date of every bank of a file sorted by (idrssd, date)."""
+    ids = part["idrssd"].to_numpy()
+    dates = pd.to_datetime(part["date"]).to_numpy()
+    bounds = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+    starts = np.concatenate([[0], bounds]).astype("int64")
+    stops = np.concatenate([bounds, [len(ids)]]).astype("int64")
+    return pd.DataFrame({"idrssd": ids[starts], "file": file, "start": starts, "stop": stops,
+                         "first_date": dates[starts], "last_date": dates[stops - 1]})
+
+
+def _partition_by(dataset_dir):
+    for name in sorted(os.listdir(dataset_dir)):
+        key = name.split("=", 1)[0]
+        if key in PARTITION_KEYS:
+            return key
+    raise FileNotFoundError(f"No year=… or quarter=… partitions found in {dataset_dir}.")
+
+
+def open_panel(dataset_dir):
+    """The panel as a pyarrow dataset (hive partitioning on 'year' or 'quarter')."""
+    key = _partition_by(dataset_dir)
+    partitioning = ds.partitioning(pa.schema([(key, pa.int32() if key == "year" else pa.string())]),
+                                   flavor="hive")
+    return ds.dataset(dataset_dir, format="parquet", partitioning=partitioning,
+                      exclude_invalid_files=False, ignore_prefixes=[".", "_"])
+
+
+def read_panel_metadata(dataset_dir):
+    """The metadata written with the panel: mappings version, partitioning and report dates."""
+    schema = pq.read_schema(os.path.join(dataset_dir, "_common_metadata"))
+    return json.loads(schema.metadata[PANEL_METADATA_KEY])
+
+
+def read_panel(dataset_dir, columns=None, start=None, end=None):
+    """
+    Read part of the clean panel into a DataFrame.
+
+    Only the requested columns are read, and only the partitions overlapping [start, end]
+    are opened.
+
+    Args:
+        dataset_dir (str): Folder written by PanelWriter.
+        columns (list[str], optional): Columns to read ('idrssd' and 'date' are always included).
+        start, end (str or datetime, optional): Inclusive range of report dates.
+
+    Returns:
+        pd.DataFrame
+    """
+    dataset = open_panel(dataset_dir)
+    key = dataset.partitioning.schema.names[0]
+    if columns is not None:
+        columns = ["idrssd", "date"] + [c for c in columns if c not in ("idrssd", "date")]
+
+    def part_of(ts):
+        return ts.year if key == "year" else f"{ts.year}Q{ts.quarter}"
+
+    def date_of(ts):
+        return pa.scalar(ts.to_datetime64(), type=dataset.schema.field("date").type)
+
+    # Partition pruning on the year/quarter folder, then the exact filter on the date column
+    expr = None
+    if start is not None:
+        start = pd.Timestamp(start)
+        expr = (ds.field(key) >= part_of(start)) & (ds.field("date") >= date_of(start))
+    if end is not None:
+        end = pd.Timestamp(end)
+        cond = (ds.field(key) <= part_of(end)) & (ds.field("date") <= date_of(end))
+        expr = cond if expr is None else expr & cond
+
+    return dataset.to_table(columns=columns, filter=expr).to_pandas()
+
+
+def iter_report_dates(dataset_dir, columns=None):
+    """
+    Yield the panel one report date at a time, reading each year or quarter partition once.
+
+    Args:
+        dataset_dir (str): Folder written by PanelWriter.
+        columns (list[str], optional): Columns to read ('idrssd' and 'date' are always included).
+
+    Yields:
+        (str, pd.DataFrame): The report date ('YYYY-MM-DD') and its rows, sorted by idrssd.
+    """
+    meta = read_panel_metadata(dataset_dir)
+    by_partition = {}
+    for q in meta["quarters"]:
+        ts = pd.Timestamp(q)
+        by_partition.setdefault(ts.year if meta["partition_by"] == "year" else (ts.year, ts.quarter), []).append(q)
+    for quarters in by_partition.values():
+        part = read_panel(dataset_dir, columns=columns, start=quarters[0], end=quarters[-1])
+        for date, rows in part.groupby("date", sort=True):
+            yield pd.Timestamp(date).strftime("%Y-%m-%d"), rows.sort_values("idrssd", kind="mergesort")
+        del part
+
+
+def frame_digest(df):
+    """SHA-256 of the values of a DataFrame (not its index): equal frames give equal digests."""
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()
+
+
+def export_panel_csv(dataset_dir, csv_path, columns=None, batch_rows=100_000):
+    """
+    Stream the panel into a single CSV file, one record batch at a time, in partition order.
+
+    Args:
+        dataset_dir (str): Folder written by PanelWriter.
+        csv_path (str): Output CSV.
+        columns (list[str], optional): Columns to export (default: all but the partition key).
+        batch_rows (int): Maximum number of rows held in memory at once.
+    """
+    dataset = open_panel(dataset_dir)
+    key = dataset.partitioning.schema.names[0]
+    columns = columns or [c for c in dataset.schema.names if c != key]
+    first = True
+    for fragment in sorted(dataset.get_fragments(), key=lambda f: f.path):
+        for batch in fragment.to_batches(columns=columns, batch_size=batch_rows):
+            batch.to_pandas().to_csv(csv_path, index=False, mode="w" if first else "a", header=first)
+            first = False
+    print(f"Info: exported {dataset_dir} to {csv_path}")
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_bank_index(path, mtime):
+    return pd.read_parquet(path)
+
+
+def read_bank_index(dataset_dir):
+    """The bank index of the panel (idrssd, file, start, stop, first_date, last_date), sorted by idrssd."""
+    path = os.path.join(dataset_dir, BANK_INDEX_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No {BANK_INDEX_FILE} in {dataset_dir}: rebuild the panel to index it.")
+    return _cached_bank_index(path, os.path.getmtime(path))
+
+
+@functools.lru_cache(maxsize=1024)
+def _row_group_offsets(path, mtime):
+    """First row of every row group of a Parquet file, plus its total number of rows."""
+    meta = pq.ParquetFile(path).metadata
+    return np.cumsum([0] + [meta.row_group(i).num_rows for i in range(meta.num_row_groups)])
+
+
+def get_bank_history(dataset_dir, idrssd, columns=None, start=None, end=None):
+    """
+    One bank's rows of the panel, in date order, reading only the row groups that hold them.
+
+    The bank index gives the files and row ranges of the bank; only the files whose dates overlap
+    [start, end] are opened, and in each only the row groups covering the range are decoded.
+
+    Args:
+        dataset_dir (str): Folder written by PanelWriter.
+        idrssd (int): The bank.
+        columns (list[str], optional): Columns to read ('idrssd' and 'date' are always included). Default: all.
+        start, end (str or datetime, optional): Inclusive range of report dates.
+
+    Returns:
+        pd.DataFrame: Empty (with the requested columns) when the bank is not in the panel.
+    """
+    index = read_bank_index(dataset_dir)
+    ids = index["idrssd"].to_numpy()
+    lo, hi = np.searchsorted(ids, idrssd, side="left"), np.searchsorted(ids, idrssd, side="right")
+    entries = index.iloc[lo:hi]
+    if start is not None:
+        start = pd.Timestamp(start)
+        entries = entries[entries["last_date"] >= start]
+    if end is not None:
+        end = pd.Timestamp(end)
+        entries = entries[entries["first_date"] <= end]
+    if columns is not None:
+        columns = ["idrssd", "date"] + [c for c in columns if c not in ("idrssd", "date")]
+
+    tables = []
+    for entry in entries.itertuples():
+        path = os.path.join(dataset_dir, entry.file)
+        offsets = _row_group_offsets(path, os.path.getmtime(path))
+        first = np.searchsorted(offsets, entry.start, side="right") - 1
+        last = np.searchsorted(offsets, entry.stop, side="left")
+        table = pq.ParquetFile(path).read_row_groups(list(range(first, last)), columns=columns)
+        tables.append(table.slice(entry.start - offsets[first], entry.stop - entry.start))
+    if not tables:
+        schema = pq.read_schema(os.path.join(dataset_dir, "_common_metadata"))
+        return schema.empty_table().to_pandas()[columns or schema.names]
+
+    df = pa.concat_tables(tables).to_pandas()
+    if start is not None:
+        df = df[df["date"] >= start]
+    if end is not None:
+        df = df[df["date"] <= end]
+    return df.sort_values("date", kind="mergesort").reset_index(drop=True)
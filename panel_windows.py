@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+
+def quarter_number(dates):
+    """Consecutive integers for consecutive calendar quarters (2001Q1 → 8004, 2001Q2 → 8005, …)."""
+    dates = pd.DatetimeIndex(pd.to_datetime(dates))
+    return dates.year.to_numpy("int64") * 4 + (dates.month.to_numpy("int64") - 1) // 3
+
+
+class PanelWindow:
+    def __init__(self, df, id_col="idrssd", date_col="date"):
+        """
+        Lags, leads and trailing windows of many panel variables at once, on NumPy arrays.
+
+        Every bank-quarter is located once on a (bank, quarter) key. A lag or lead of p quarters reads
+        the row of the same bank exactly p quarters away, and a trailing window of w quarters needs
+        the w consecutive quarters: when one is missing (the bank did not report, or the row was dropped),
+        the result is NaN instead of silently spanning the gap. A NaN value inside a window also gives NaN.
+
+        Example (quarterly flows from ytd_diff → trailing-year figures):
+
+            w = PanelWindow(panel)
+            panel = panel.join(w.rolling_sum(["salaries_expenses", "charge_off_loans"], 4))
+            panel = panel.join(w.growth(["total_assets"], 4))            # year-over-year growth
+            panel["charge_off_rate"] = w.annualized_rate("charge_off_loans", "total_loans")
+
+        Parameters:
+          df (pd.DataFrame): The panel, one row per bank and quarter (rows in any order).
+          id_col, date_col (str): Bank and report date columns.
+
+        All methods return frames on the index of df, with one column per input column.
+        """
+        self.df = df
+        banks = df[id_col].to_numpy("int64")
+        quarters = quarter_number(df[date_col])
+        # (bank, quarter) as one sortable integer: quarter numbers stay far below 2**20
+        keys = banks * 2**20 + quarters
+        self._order = np.argsort(keys, kind="stable")
+        self._keys = keys[self._order]
+        if (self._keys[1:] == self._keys[:-1]).any():
+            raise ValueError(f"The panel has several rows for the same {id_col} and quarter.")
+        self._shifts = {}
+
+    def _shift(self, periods):
+        """Sorted position of the row `periods` quarters earlier (later when negative), and whether it exists."""
+        if periods not in self._shifts:
+            target = self._keys - periods
+            pos = np.searchsorted(self._keys, target)
+            pos = np.minimum(pos, len(self._keys) - 1)
+            self._shifts[periods] = (pos, self._keys[pos] == target)
+        return self._shifts[periods]
+
+    def _values(self, columns):
+        return self.df[columns].to_numpy(dtype="float64", na_value=np.nan)[self._order]
+
+    def _shifted(self, x, periods):
+        pos, found = self._shift(periods)
+        return np.where(found[:, None], x[pos], np.nan)
+
+    def _frame(self, values, columns, suffix):
+        out = np.empty_like(values)
+        out[self._order] = values
+        return pd.DataFrame(out, index=self.df.index, columns=[f"{c}{suffix}" for c in columns])
+
+    def lag(self, columns, periods=1):
+        """Value `periods` quarters earlier ('{col}_lag{periods}')."""
+        return self._frame(self._shifted(self._values(columns), periods), columns, f"_lag{periods}")
+
+    def lead(self, columns, periods=1):
+        """Value `periods` quarters later ('{col}_lead{periods}')."""
+        return self._frame(self._shifted(self._values(columns), -periods), columns, f"_lead{periods}")
+
+    def _window_sum(self, x, window):
+        total = x.copy()
+        for p in range(1, window):
+            total += self._shifted(x, p)
+        return total
+
+    def rolling_sum(self, columns, window=4):
+        """Sum over the last `window` quarters, the current one included ('{col}_sum{window}q')."""
+        return self._frame(self._window_sum(self._values(columns), window), columns, f"_sum{window}q")
+
+    def rolling_mean(self, columns, window=4):
+        """Mean over the last `window` quarters, the current one included ('{col}_mean{window}q')."""
+        return self._frame(self._window_sum(self._values(columns), window) / window, columns, f"_mean{window}q")
+
+    def diff(self, columns, periods=1):
+        """Change over `periods` quarters ('{col}_diff{periods}q')."""
+        x = self._values(columns)
+        return self._frame(x - self._shifted(x, periods), columns, f"_diff{periods}q")
+
+    def growth(self, columns, periods=1):
+        """Growth rate over `periods` quarters, x_t / x_{t-periods} - 1, NaN when the base is 0 ('{col}_growth{periods}q')."""
+        x = self._values(columns)
+        base = self._shifted(x, periods)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self._frame(x / np.where(base == 0, np.nan, base) - 1, columns, f"_growth{periods}q")
+
+    def annualized_rate(self, flow, stock, window=4):
+        """
+        Annualized ratio of a quarterly flow to a stock (e.g. ROA, charge-off rate): the flow summed over the
+        last `window` quarters, scaled to a year, over the mean of the stock over the same quarters.
+
+        Returns:
+          pd.Series named '{flow}_to_{stock}'.
+        """
+        x = self._values([flow, stock])
+        sums = self._window_sum(x, window)
+        annual_flow = sums[:, 0] * (4 / window)
+        mean_stock = sums[:, 1] / window
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rate = annual_flow / np.where(mean_stock == 0, np.nan, mean_stock)
+        return self._frame(rate[:, None], [f"{flow}_to_{stock}"], "").iloc[:, 0]
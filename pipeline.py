@@ -1,20 +1,75 @@
 # pipeline.py
 import os
 import sys
+import shutil
 import argparse
 
-from ingest_raw_ffiec_cdr import ingest
+import pandas as pd
+
+from ingest_raw_ffiec_cdr import ingest, ingest_frames
 from merge_cr_dates_fast import merge_cr_dates_fast
-from call_reports_cleaner import CallReportsCleaner
+from call_reports_cleaner import (CallReportsCleaner, construct_definitions_partitioned, estimate_csv_rows,
+                                  resolve_requested_columns)
 from add_external_information import add_external_data_attributes, add_external_data_tic
 from mappings import mappings
-from aux_functions import extract_variables_from_mappings
+from aux_functions import extract_variables_from_mappings, create_tic_parent_intervals
+from nic_reference import prepare_nic_reference, nic_cache_dir, NIC_FILES
+from stage_graph import Stage, run_stage_graph, content_digest
+from profiling import enable_profiling, disable_profiling, current_record
+from memory_budget import MemoryBudget, parse_memory_size, set_memory_budget, get_memory_budget
+from panel_store import PanelWriter, export_panel_csv
+from panel_cube import write_cube
+from expressions import definition_name
+from consolidation import consolidate_panel, default_rules
+from panel_aggregates import materialize_aggregates
+from data_quality import run_quality_checks, checks as quality_checks
+
+
+def build_stages(base_path, partition_by="year", csv=False, merged_storage="wide", fused=False,
+                 keep_intermediates=False, cube=None, consolidate=False, aggregates=False,
+                 quality_checks_enabled=True):
+    """
+    Describe the pipeline as a graph of stages with declared inputs and outputs.
+
+    Args:
+        base_path (str): Base data directory containing 'raw/'.
+        partition_by (str): Partitioning of the clean Parquet panel, 'year' or 'quarter'.
+        csv (bool): Also export the clean panel as a single CSV file.
+        merged_storage (str): Storage of the merged call reports, 'wide' or 'sparse' (see merge_cr_dates_fast).
+        fused (bool): Replace ingest, merge, construct and enrich by a single 'build' stage that hands each
+                      ingested quarter, pruned to the columns of mappings.py and typed, straight to the
+                      variable construction in memory, without the per-quarter and merged CSV files.
+        keep_intermediates (bool): In fused mode, still write the per-quarter CSVs (with their column
+                                   statistics) and the constructed dataset.
+        cube (str, optional): 'float32' or 'float64': also write the constructed variables as a memory-mapped
+                              bank × quarter × variable cube in clean/call_reports_cube (see panel_cube.py).
+        consolidate (bool): Also aggregate the panel to the (top_parent_idrssd, date) level in
+                            clean/holding_company_panel (see consolidation.py).
+        aggregates (bool): Also precompute sums, counts and quantile sketches of every new_var per
+                           (date, charter_type, size bucket) in clean/panel_aggregates (see panel_aggregates.py).
+        quality_checks_enabled (bool): Check the accounting identities and quarter-over-quarter jumps of
+                                       data_quality.py on the panel and save the violations in
+                                       clean/data_quality_violations.parquet.
 
+    Stage graph (arrows point to dependants):
 
-def run_pipeline(base_path):
+        ingest ──► merge ──► construct ──┐
+        nic_reference ──► tic_parent ────┼──► enrich
+        nic_reference ───────────────────┘
+
+    'nic_reference' and 'tic_parent' only depend on the NIC and WRDS files, so they run
+    alongside 'ingest' and 'merge' when more than one worker is available.
+
+    Fused mode: nic_reference ──► tic_parent ──► build
+
+    With a cube, a 'cube' stage also runs after 'construct' (in fused mode, 'build' writes it).
+    With consolidate, a 'consolidate' stage runs after 'enrich' (or 'build'); it only redoes the report
+    dates whose bank rows changed. The same holds for the 'aggregates' stage. The 'quality' stage
+    checks the panel after 'enrich' (or 'build') unless disabled.
+    """
     ### Define project paths:
 
-    # raw_data: 
+    # raw_data:
     raw_data       = os.path.join(base_path, "raw")
     # raw_ffiec: where the extracted FFIEC CDR folders are located:
     raw_ffiec      = os.path.join(base_path, "raw", "ffiec", "extracted", "cdr")
@@ -22,37 +77,263 @@ def run_pipeline(base_path):
     intermediate   = os.path.join(base_path, "intermediate", "ffiec_cdr_all_dates")
     # merged_output: where the final merged CSV will be saved:
     merged_output  = os.path.join(base_path, "intermediate", "ffiec_cdr_all_dates_merged")
+    # constructed: where the dataset with the mappings.py definitions will be saved:
+    constructed    = os.path.join(base_path, "intermediate", "ffiec_cdr_constructed")
+    # tic_parent: where the ticker / top parent spells will be saved:
+    tic_parent     = os.path.join(base_path, "intermediate", "tic_parent")
     # Atrributes files:
     attributes_dir = os.path.join(base_path, "raw", "ffiec", "extracted", "nic")
+    # WRDS and crosswalk files:
+    wrds_dir       = os.path.join(base_path, "raw", "wrds_compustat")
     # Clean data path:
     clean_data = os.path.join(base_path, "clean")
 
-    # Step 1: Ingest raw FFIEC schedules into per-date CSVs
-    print("Step 1: Ingesting raw FFIEC schedules…")
-    ingest(raw_ffiec, intermediate)
-
-    # Step 2: Merge all per-date CSVs into a single dataset
-    print("Step 2: Merging per-date CSVs into call_reports_all_dates.csv…")
-    merge_cr_dates_fast(intermediate, merged_output)
-
-    # Step 3: Clean and select variables
-    print("Step 3: Selecting variables from merged call reports…")
-    # Extract all variables defined in mappings.py:
-    all_variables_needed = extract_variables_from_mappings(mappings)
-    # Create a CallReportsCleaner instance:
-    crc = CallReportsCleaner(merged_output, all_variables_needed)
-    # Construct the dataset with the new definitions in mappings.py:
-    df = crc.construct_definitions(mappings)
-
-    # Step 4: Add external data attributes
-    print("Step 4: Adding external data attributes…")
-    df = add_external_data_tic(raw_data, df)
-    df = add_external_data_attributes(attributes_dir, df)
-    
-    # Step 5: Store dataset as csv in clean path as csv:
-    output_file = os.path.join(clean_data, "final_call_reports_dataset.csv")
-    df.to_csv(output_file, index=False)
-    print(f"Pipeline finished! Saved to {output_file}")
+    merged_file      = os.path.join(merged_output, "call_reports_all_dates.csv")
+    tic_parent_file  = os.path.join(tic_parent, "tic_parent_intervals.parquet")
+    panel_dir        = os.path.join(clean_data, "final_call_reports_dataset")
+    cube_dir         = os.path.join(clean_data, "call_reports_cube")
+    holding_dir      = os.path.join(clean_data, "holding_company_panel")
+    aggregates_dir   = os.path.join(clean_data, "panel_aggregates")
+    violations_file  = os.path.join(clean_data, "data_quality_violations.parquet")
+    output_file      = os.path.join(clean_data, "final_call_reports_dataset.csv")
+    nic_files        = [os.path.join(attributes_dir, f) for f in NIC_FILES.values()]
+
+    def step_ingest():
+        # Step 1: Ingest raw FFIEC schedules into per-date CSVs
+        print("Step 1: Ingesting raw FFIEC schedules…")
+        ingest(raw_ffiec, intermediate)
+
+    def step_merge():
+        # Step 2: Merge all per-date CSVs into a single dataset
+        print("Step 2: Merging per-date CSVs into call_reports_all_dates.csv…")
+        merge_cr_dates_fast(intermediate, merged_output, storage=merged_storage)
+
+    def step_construct():
+        # Step 3: Clean and select variables
+        print("Step 3: Selecting variables from merged call reports…")
+        # Extract all variables defined in mappings.py:
+        all_variables_needed = extract_variables_from_mappings(mappings)
+        # The constructed dataset is stored as one or more bank partitions: part-00000.parquet, …
+        shutil.rmtree(constructed, ignore_errors=True)
+        os.makedirs(constructed)
+
+        budget = get_memory_budget()
+        if budget is not None:
+            # Working set: selected + constructed columns, 8 bytes per cell, about 3 copies alive at once
+            n_cols = len(all_variables_needed) + len(mappings)
+            n_rows = estimate_csv_rows(merged_file)
+            n_parts = budget.partitions_for(n_rows * n_cols * 8 * 3, "construct")
+            chunk_rows = budget.rows_per_chunk(n_cols * 8 * 3, "construct")
+            if n_parts > 1:
+                print(f"Info: memory budget → constructing {n_parts} bank partitions, {chunk_rows} rows per chunk.")
+                construct_definitions_partitioned(merged_output, all_variables_needed, mappings, constructed,
+                                                  n_parts, chunk_rows, budget=budget)
+                return
+
+        # Create a CallReportsCleaner instance:
+        crc = CallReportsCleaner(merged_output, all_variables_needed)
+        # Construct the dataset with the new definitions in mappings.py:
+        df = crc.construct_definitions(mappings)
+        current_record().frame_out(df)
+        df.to_parquet(os.path.join(constructed, "part-00000.parquet"), index=False)
+
+    def step_cube(sources):
+        # Step 3b: Constructed variables as a dense bank × quarter × variable array
+        print("Step 3b: Writing the bank × quarter × variable cube…")
+        new_vars = list(dict.fromkeys(definition_name(m) for m in mappings))
+        write_cube(cube_dir, sources, new_vars, dtype=cube,
+                   metadata={"mappings_version": content_digest(mappings)})
+
+    def step_nic_reference():
+        # Convert the NIC CSVs into their binary cache (independent of the FFIEC steps)
+        print("Preparing NIC reference tables…")
+        prepare_nic_reference(attributes_dir)
+
+    def step_tic_parent():
+        # Build the ticker / top parent spells from WRDS, the crosswalk and NIC relationships
+        print("Building ticker and top parent spells…")
+        os.makedirs(tic_parent, exist_ok=True)
+        create_tic_parent_intervals(raw_data).to_parquet(tic_parent_file, index=False)
+
+    def write_panel(frames):
+        # Steps 4 and 5 on each constructed frame
+        df_tic_intervals = pd.read_parquet(tic_parent_file)
+        budget = get_memory_budget()
+
+        # Step 5: Store the dataset in clean path as a Parquet dataset partitioned by year or quarter.
+        with PanelWriter(panel_dir, partition_by, metadata={"mappings_version": content_digest(mappings)}) as writer:
+            for df in frames:
+                current_record().frame_in(df)
+                df = add_external_data_tic(raw_data, df, df_tic_intervals)
+                df = add_external_data_attributes(attributes_dir, df)
+                writer.write(df)
+                del df
+                if budget is not None:
+                    budget.check("enrich")
+        print(f"Pipeline finished! Saved to {panel_dir}")
+
+        if csv:
+            export_panel_csv(panel_dir, output_file)
+
+    def step_enrich():
+        # Step 4: Add external data attributes
+        print("Step 4: Adding external data attributes…")
+        # One bank partition at a time (a single one unless Step 3 ran under a memory budget)
+        parts = sorted(f for f in os.listdir(constructed) if f.endswith(".parquet"))
+        write_panel(pd.read_parquet(os.path.join(constructed, part)) for part in parts)
+
+    def step_build():
+        # Steps 1-3 fused: every quarter goes from the raw schedules to the selected columns in memory
+        print("Steps 1-3: Ingesting raw FFIEC schedules and constructing variables in memory…")
+        all_variables_needed = extract_variables_from_mappings(mappings)
+
+        def select(cols):
+            return resolve_requested_columns(cols, all_variables_needed, warn=False)
+
+        frames = list(ingest_frames(raw_ffiec, select, save_path=intermediate if keep_intermediates else None))
+        crc = CallReportsCleaner(None, all_variables_needed, data=pd.concat(frames, ignore_index=True))
+        del frames
+        df = crc.construct_definitions(mappings)
+        del crc
+        current_record().frame_out(df)
+        if keep_intermediates:
+            shutil.rmtree(constructed, ignore_errors=True)
+            os.makedirs(constructed)
+            df.to_parquet(os.path.join(constructed, "part-00000.parquet"), index=False)
+
+        if cube:
+            step_cube([df])
+
+        print("Step 4: Adding external data attributes…")
+        write_panel([df])
+
+    def step_consolidate():
+        # Step 6: Holding-company panel, aggregated from the banks of each top parent
+        print("Step 6: Consolidating banks to their top parent…")
+        consolidate_panel(panel_dir, holding_dir, default_rules(mappings))
+
+    def step_aggregates():
+        # Step 7: Industry totals and distributions per report date, charter type and size class
+        print("Step 7: Precomputing aggregates by charter type and size…")
+        materialize_aggregates(panel_dir, aggregates_dir, list(dict.fromkeys(definition_name(m) for m in mappings)))
+
+    def step_quality():
+        # Accounting identities and jumps on every bank-quarter
+        print("Checking data quality…")
+        run_quality_checks(panel_dir, violations_file, quality_checks)
+
+    panel_stages = []
+    if quality_checks_enabled:
+        panel_stages.append(Stage("quality", step_quality, inputs=[panel_dir], outputs=[violations_file],
+                                  deps=["build" if fused else "enrich"], code=["data_quality"],
+                                  params={"checks": content_digest(quality_checks)}))
+    if consolidate:
+        panel_stages.append(Stage("consolidate", step_consolidate, inputs=[panel_dir], outputs=[holding_dir],
+                                  deps=["build" if fused else "enrich"], code=["consolidation"],
+                                  params={"rules": content_digest(default_rules(mappings))}))
+    if aggregates:
+        panel_stages.append(Stage("aggregates", step_aggregates, inputs=[panel_dir], outputs=[aggregates_dir],
+                                  deps=["build" if fused else "enrich"], code=["panel_aggregates"],
+                                  params={"mappings": content_digest(mappings)}))
+
+    nic_stages = [
+        Stage("nic_reference", step_nic_reference, inputs=nic_files, outputs=[nic_cache_dir(attributes_dir)],
+              code=["nic_reference"]),
+        Stage("tic_parent", step_tic_parent, inputs=[wrds_dir, nic_cache_dir(attributes_dir)],
+              outputs=[tic_parent_file], deps=["nic_reference"], code=["aux_functions"]),
+    ]
+    if fused:
+        return nic_stages + [
+            Stage("build", step_build, inputs=[raw_ffiec, tic_parent_file, nic_cache_dir(attributes_dir)],
+                  outputs=[panel_dir] + ([output_file] if csv else []) + ([cube_dir] if cube else [])
+                          + ([intermediate, constructed] if keep_intermediates else []),
+                  deps=["tic_parent", "nic_reference"],
+                  params={"mappings": content_digest(mappings), "partition_by": partition_by, "csv": csv,
+                          "keep_intermediates": keep_intermediates, "cube": cube},
+                  code=["ingest_raw_ffiec_cdr", "call_reports_cleaner", "add_external_information", "panel_store",
+                        "panel_cube"]),
+            *panel_stages,
+        ]
+
+    cube_stages = []
+    if cube:
+        def constructed_parts():
+            return [os.path.join(constructed, f) for f in sorted(os.listdir(constructed)) if f.endswith(".parquet")]
+
+        cube_stages.append(Stage("cube", lambda: step_cube(constructed_parts()), inputs=[constructed],
+                                 outputs=[cube_dir], deps=["construct"],
+                                 params={"mappings": content_digest(mappings), "dtype": cube}, code=["panel_cube"]))
+
+    return [
+        Stage("ingest", step_ingest, inputs=[raw_ffiec], outputs=[intermediate], code=["ingest_raw_ffiec_cdr"]),
+        Stage("merge", step_merge, inputs=[intermediate], outputs=[merged_output], deps=["ingest"],
+              params={"storage": merged_storage}, code=["merge_cr_dates_fast"]),
+        Stage("construct", step_construct, inputs=[merged_output], outputs=[constructed], deps=["merge"],
+              params={"mappings": content_digest(mappings)}, code=["call_reports_cleaner"]),
+        *cube_stages,
+        *nic_stages,
+        Stage("enrich", step_enrich, inputs=[constructed, tic_parent_file, nic_cache_dir(attributes_dir)],
+              outputs=[panel_dir] + ([output_file] if csv else []), deps=["construct", "tic_parent", "nic_reference"],
+              params={"partition_by": partition_by, "csv": csv}, code=["add_external_information", "panel_store"]),
+        *panel_stages,
+    ]
+
+
+def run_pipeline(base_path, force=False, jobs=2, profile_path=None, trace_path=None, memory_limit=None,
+                 partition_by="year", csv=False, merged_storage="wide", fused=False, keep_intermediates=False,
+                 cube=None, consolidate=False, aggregates=False, quality_checks_enabled=True):
+    """
+    Run the stages that are out of date and checkpoint each one as it finishes.
+
+    Args:
+        base_path (str): Base data directory containing 'raw/'.
+        force (bool): Rerun every stage, ignoring checkpoints.
+        jobs (int): Maximum number of independent stages running at the same time.
+        profile_path (str, optional): Write per-stage and per-operation measurements
+                                      (wall/CPU time, RSS, rows/columns, bytes read/written) as JSON.
+        trace_path (str, optional): Write the same measurements as a Chrome trace file.
+        memory_limit (str or int, optional): Memory budget for the whole run (e.g. '8G'). Stages size their
+                                             chunks and partitions to stay under it, and the run stops with
+                                             MemoryBudgetExceeded if the peak RSS goes over it. Stages then
+                                             run one at a time.
+        partition_by (str): Partitioning of the clean Parquet panel, 'year' or 'quarter'.
+        csv (bool): Also export the clean panel as clean/final_call_reports_dataset.csv.
+        merged_storage (str): 'sparse' stores the rarely filled MDRM columns of the merged call reports in
+                              long form instead of as mostly empty CSV columns.
+        fused (bool): Build the panel straight from the raw schedules in memory (see build_stages). Every
+                      quarter is held in memory at once, so it cannot be combined with memory_limit.
+        keep_intermediates (bool): In fused mode, also write the per-quarter CSVs and the constructed dataset.
+        cube (str, optional): 'float32' or 'float64' to also write the memory-mapped variable cube.
+        consolidate (bool): Also write the holding-company panel (clean/holding_company_panel).
+        aggregates (bool): Also write the aggregates by charter type and size class (clean/panel_aggregates).
+        quality_checks_enabled (bool): Run the data quality checks (clean/data_quality_violations.parquet).
+    """
+    if fused and memory_limit is not None:
+        raise ValueError(
+            "The fused build holds every quarter in memory at once and cannot stay under a memory budget. "
+            "Drop --fused to run the staged pipeline under --memory-limit, or drop --memory-limit."
+        )
+    state_path = os.path.join(base_path, "intermediate", "pipeline_checkpoints.json")
+    profiler = enable_profiling() if (profile_path or trace_path) else None
+    budget = None
+    if memory_limit is not None:
+        budget = set_memory_budget(MemoryBudget(parse_memory_size(memory_limit)))
+        jobs = 1
+    try:
+        stages = build_stages(base_path, partition_by, csv, merged_storage, fused, keep_intermediates, cube,
+                              consolidate, aggregates, quality_checks_enabled)
+        return run_stage_graph(stages, state_path, max_workers=jobs, force=force)
+    finally:
+        if budget is not None:
+            set_memory_budget(None)
+            print(f"Peak memory: {budget.peak / 2**30:.2f} GB of a {budget.limit / 2**30:.2f} GB budget.")
+        if profiler is not None:
+            disable_profiling()
+            if profile_path:
+                profiler.write_json(profile_path)
+            if trace_path:
+                profiler.write_trace(trace_path)
+            print(profiler.summary().head(15).to_string())
 
 
 if __name__ == "__main__":
@@ -61,6 +342,88 @@ if __name__ == "__main__":
         "base_path",
         help="Base data directory (e.g. C:\\Users\\...\\banking_project\\data)"
     )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rerun every stage, even the ones whose checkpoint is up to date."
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=2,
+        help="Maximum number of independent stages to run concurrently (default: 2)."
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="Write per-stage and per-operation measurements to this JSON file."
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="Write the measurements as a Chrome trace file (chrome://tracing, ui.perfetto.dev)."
+    )
+    parser.add_argument(
+        "--memory-limit",
+        metavar="SIZE",
+        help="Memory budget for the run (e.g. 8G, 512M). Stages chunk and spill to disk to stay under it."
+    )
+    parser.add_argument(
+        "--partition-by",
+        choices=["year", "quarter"],
+        default="year",
+        help="Partitioning of the clean Parquet dataset (default: year)."
+    )
+    parser.add_argument(
+        "--csv",
+        action="store_true",
+        help="Also export the clean dataset as a single CSV file."
+    )
+    parser.add_argument(
+        "--merged-storage",
+        choices=["wide", "sparse"],
+        default="wide",
+        help="Storage of the merged call reports: 'sparse' keeps rarely filled columns in long form (default: wide)."
+    )
+    parser.add_argument(
+        "--fused",
+        action="store_true",
+        help="Build the dataset from the raw schedules in memory, without the intermediate CSV files "
+         "(not with --memory-limit)."
+    )
+    parser.add_argument(
+        "--keep-intermediates",
+        action="store_true",
+        help="With --fused, still write the per-quarter CSVs and the constructed dataset."
+    )
+    parser.add_argument(
+        "--cube",
+        choices=["float32", "float64"],
+        help="Also write the constructed variables as a memory-mapped bank × quarter × variable cube of this type."
+    )
+    parser.add_argument(
+        "--consolidate",
+        action="store_true",
+        help="Also aggregate the dataset to the top parent (holding company) level."
+    )
+    parser.add_argument(
+        "--aggregates",
+        action="store_true",
+        help="Also precompute sums, counts and quantile sketches by report date, charter type and size class."
+    )
+    parser.add_argument(
+        "--skip-quality-checks",
+        action="store_true",
+        help="Do not check the accounting identities and quarter-over-quarter jumps of the dataset."
+    )
     args = parser.parse_args()
+    if args.fused and args.memory_limit:
+        parser.error("--fused cannot be combined with --memory-limit: the fused build holds every quarter in "
+                     "memory at once. Drop --fused to run the staged pipeline under the budget.")
 
-    run_pipeline(args.base_path)
+    run_pipeline(args.base_path, force=args.force, jobs=args.jobs,
+                 profile_path=args.profile, trace_path=args.trace, memory_limit=args.memory_limit,
+                 partition_by=args.partition_by, csv=args.csv, merged_storage=args.merged_storage,
+                 fused=args.fused, keep_intermediates=args.keep_intermediates, cube=args.cube,
+                 consolidate=args.consolidate, aggregates=args.aggregates,
+                 quality_checks_enabled=not args.skip_quality_checks)
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+
+from nic_reference import read_nic_table
+from panel_windows import quarter_number
+from profiling import profile
+
+# NIC transformation codes where the predecessor's balance sheet ends up in the successor:
+# 1 = charter discontinued (merger or absorption), 50 = failure (assumed by the successor)
+MERGER_CODES = (1, 50)
+
+
+def read_transformations(nic_folder, codes=MERGER_CODES):
+    """
+    The predecessor → successor table of CSV_TRANSFORMATIONS.CSV, with the quarter of each transformation.
+
+    Args:
+        nic_folder (str): Folder containing the NIC CSV files.
+        codes (tuple, optional): TRNSFM_CD values to keep (None keeps every transformation).
+
+    Returns:
+        pd.DataFrame: pred, succ (int64), date (transformation date) and quarter (quarter_number of the date),
+                      without self-links or rows with a missing ID or date.
+    """
+    x = read_nic_table(nic_folder, "transformations",
+                       columns=["#ID_RSSD_PREDECESSOR", "ID_RSSD_SUCCESSOR", "D_DT_TRANS", "TRNSFM_CD"])
+    x = x.rename(columns={"#ID_RSSD_PREDECESSOR": "pred", "ID_RSSD_SUCCESSOR": "succ",
+                          "D_DT_TRANS": "date", "TRNSFM_CD": "code"})
+    if codes is not None:
+        x = x[pd.to_numeric(x["code"], errors="coerce").isin(codes)]
+
+    # Dates come as 2008-09-30 or as 20080930
+    raw = x["date"].astype("string").str.strip()
+    compact = raw.str.fullmatch(r"\d{8}").fillna(False)
+    dates = pd.to_datetime(raw.where(~compact), errors="coerce")
+    dates[compact] = pd.to_datetime(raw[compact], format="%Y%m%d", errors="coerce")
+
+    out = pd.DataFrame({"pred": pd.to_numeric(x["pred"], errors="coerce"),
+                        "succ": pd.to_numeric(x["succ"], errors="coerce"),
+                        "date": dates})
+    out = out.dropna().astype({"pred": "int64", "succ": "int64"})
+    out = out[out["pred"] != out["succ"]].drop_duplicates().reset_index(drop=True)
+    out["quarter"] = quarter_number(out["date"])
+    return out
+
+
+def final_successors(pred, succ):
+    """
+    Final successor of every predecessor when the links pred → succ are followed to their end,
+    by pointer jumping on the whole table: each pass maps every pointer through the pointers themselves,
+    so the distance covered doubles and the number of passes grows with the log of the longest chain.
+
+    A predecessor with several successors follows the last one, as in add_external_data_attributes.
+    Raises ValueError when the links contain a cycle of three or more banks (the pointers then never settle);
+    in a cycle of two, each bank keeps pointing to the other.
+    """
+    link = pd.Series(np.asarray(succ, dtype="int64"), index=np.asarray(pred, dtype="int64"))
+    link = link[~link.index.duplicated(keep="last")]
+    target = link.copy()
+    # A chain has at most len(link) links: log2 of that many passes reach its end
+    for _ in range(len(link).bit_length() + 1):
+        nxt = target.map(target)
+        jump = nxt.notna() & (nxt.to_numpy() != target.index.to_numpy())
+        if not jump.any():
+            break
+        target[jump] = nxt[jump].astype("int64")
+    else:
+        raise ValueError("The predecessor → successor links contain a cycle through banks "
+                         f"{sorted(target.index[jump])[:10]}.")
+    return target.reindex(np.asarray(pred, dtype="int64")).to_numpy()
+
+
+def pro_forma_lag(df, transformations, columns, periods=1, id_col="idrssd", date_col="date"):
+    """
+    Merger-adjusted value `periods` quarters earlier: the bank's own value plus the values, at that same
+    date, of every bank it absorbed since then (directly or through a chain of absorptions).
+
+    For each report quarter t, the transformations effective in the quarters t-periods+1 … t are
+    collapsed to their final successor, the predecessors' values at t-periods are summed per successor
+    and added to the successor's own value at t-periods. One pass per quarter, vectorized over banks.
+    A transformation is effective in the quarter of its date, or in the next one when the predecessor still
+    filed a report for that quarter. A predecessor without a row at t-periods adds nothing; a successor
+    without one gets NaN.
+
+    Parameters:
+      df (pd.DataFrame): Bank panel, one row per bank and quarter.
+      transformations (pd.DataFrame): pred, succ and quarter (see read_transformations).
+      columns (list): Variables to adjust (stocks, e.g. total_loans or total_deposits).
+      periods (int): Number of quarters back.
+
+    Returns:
+        pd.DataFrame: On the index of df, '{col}_lag{periods}_pf' for every column and
+                      'acquired{periods}q', the number of banks absorbed since t-periods.
+    """
+    banks = df[id_col].to_numpy("int64")
+    quarters = quarter_number(df[date_col])
+    keys = banks * 2**20 + quarters
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    x = df[columns].to_numpy(dtype="float64", na_value=np.nan)
+
+    def rows_of(bank, quarter):
+        """Row of each (bank, quarter) in df, -1 when the bank has no row that quarter."""
+        target = np.asarray(bank, dtype="int64") * 2**20 + quarter
+        pos = np.minimum(np.searchsorted(sorted_keys, target), len(sorted_keys) - 1)
+        return np.where(sorted_keys[pos] == target, order[pos], -1) if len(sorted_keys) else np.full(len(target), -1)
+
+    # 1) The bank's own value at t-periods
+    own = rows_of(banks, quarters - periods)
+    base = np.where((own >= 0)[:, None], x[np.maximum(own, 0)], np.nan)
+    acquired = np.zeros(len(df), "int64")
+
+    # 2) A predecessor that still reports in the quarter of its transformation is absorbed the next quarter
+    t_quarters = transformations["quarter"].to_numpy("int64")
+    t_quarters = t_quarters + (rows_of(transformations["pred"].to_numpy(), t_quarters) >= 0)
+
+    # 3) Absorbed banks, one report quarter at a time
+    with profile("pro_forma_lag", rows=len(df), transformations=len(transformations)):
+        for t in np.unique(quarters):
+            window = (t_quarters > t - periods) & (t_quarters <= t)
+            if not window.any():
+                continue
+            # One event per predecessor, the last one as in final_successors
+            events = transformations[window].drop_duplicates("pred", keep="last")
+            succ = final_successors(events["pred"], events["succ"])
+            at = rows_of(succ, t)
+            before = rows_of(events["pred"].to_numpy(), t - periods)
+            keep = (at >= 0) & (own[np.maximum(at, 0)] >= 0)
+            at, before = at[keep], before[keep]
+            if not len(at):
+                continue
+            np.add.at(acquired, at, 1)
+            found = before >= 0
+            values = np.where(np.isnan(x[before[found]]), 0.0, x[before[found]])
+            np.add.at(base, at[found], values)
+
+    out = pd.DataFrame(base, index=df.index, columns=[f"{c}_lag{periods}_pf" for c in columns])
+    out[f"acquired{periods}q"] = acquired
+    return out
+
+
+def pro_forma_growth(df, transformations, columns, periods=1, id_col="idrssd", date_col="date"):
+    """
+    Merger-adjusted growth over `periods` quarters: x_t / pro forma x_{t-periods} - 1, where the base adds the
+    values of the banks absorbed in between (see pro_forma_lag), so acquisitions do not show up as growth.
+    NaN when the base is missing or 0.
+
+    Example:
+
+        transformations = read_transformations("data/raw/ffiec/extracted/nic")
+        panel = panel.join(pro_forma_growth(panel, transformations, ["total_loans", "total_deposits"], 4))
+
+    Returns:
+        pd.DataFrame: On the index of df, '{col}_growth{periods}q_pf' for every column and 'acquired{periods}q'.
+    """
+    lag = pro_forma_lag(df, transformations, columns, periods, id_col, date_col)
+    base = lag[[f"{c}_lag{periods}_pf" for c in columns]].to_numpy()
+    x = df[columns].to_numpy(dtype="float64", na_value=np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        growth = x / np.where(base == 0, np.nan, base) - 1
+    out = pd.DataFrame(growth, index=df.index, columns=[f"{c}_growth{periods}q_pf" for c in columns])
+    out[f"acquired{periods}q"] = lag[f"acquired{periods}q"]
+    return out
@@ -0,0 +1,274 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:  # optional: only used where /proc and resource are not available
+    psutil = None
+
+
+# ----------------------------------------------------------------------------
+# Process-level measurements (None when the platform does not provide them)
+# ----------------------------------------------------------------------------
+
+def rss_bytes():
+    """Current resident set size of this process, in bytes."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _io_bytes():
+    """Bytes read and written by this process so far (including page-cache hits), or (None, None)."""
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        pass
+    if psutil is not None:
+        try:
+            io = psutil.Process().io_counters()
+            return io.read_bytes, io.write_bytes
+        except (AttributeError, psutil.Error):
+            pass
+    return None, None
+
+
+def _delta(end, start):
+    return None if end is None or start is None else end - start
+
+
+# ----------------------------------------------------------------------------
+# Records
+# ----------------------------------------------------------------------------
+
+class ProfileRecord:
+    def __init__(self, name, parent, meta):
+        """
+        Measurements of one stage or sub-operation.
+
+        Attributes:
+          name (str): Operation name (e.g. 'stage:ingest', 'load_schedule').
+          parent (str | None): Name of the enclosing operation in the same thread.
+          meta (dict): Free-form context (file name, mapping name, …).
+          rows_in, cols_in, rows_out, cols_out (int | None): Shapes of the frames in and out,
+                                                            set with frame_in / frame_out.
+        """
+        self.name = name
+        self.parent = parent
+        self.meta = dict(meta)
+        self.thread = threading.get_ident()
+        self.rows_in = self.cols_in = self.rows_out = self.cols_out = None
+        self._peak = None
+
+    def _observe(self, rss):
+        if rss is not None and (self._peak is None or rss > self._peak):
+            self._peak = rss
+
+    def frame_in(self, df):
+        """Record the shape of an input DataFrame (adds up over several calls)."""
+        self.rows_in = (self.rows_in or 0) + len(df)
+        self.cols_in = max(self.cols_in or 0, df.shape[1])
+
+    def frame_out(self, df):
+        """Record the shape of the output DataFrame."""
+        self.rows_out, self.cols_out = df.shape
+
+    def as_dict(self):
+        return {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
+
+
+class _NullRecord:
+    """Stand-in returned when profiling is disabled: every call is a no-op."""
+
+    @property
+    def meta(self):
+        # a fresh dict on every access, so writes are dropped instead of shared
+        return {}
+
+    def frame_in(self, df):
+        pass
+
+    def frame_out(self, df):
+        pass
+
+
+_NULL_RECORD = _NullRecord()
+
+
+class Profiler:
+    def __init__(self, sample_interval=0.05):
+        """
+        Collects ProfileRecords from every thread. Enable it with enable_profiling();
+        while no profiler is enabled, profile() costs a single attribute lookup.
+
+        A background thread samples the RSS every `sample_interval` seconds while any block
+        is open, so every record gets the peak RSS reached during its own block.
+        """
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._t0 = time.perf_counter()
+        self._open = set()
+        self._interval = sample_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    # -- peak RSS sampling ----------------------------------------------------
+    def _sample(self):
+        while not self._stop.wait(self._interval):
+            with self._lock:
+                if not self._open:
+                    continue
+                rss = rss_bytes()
+                for rec in self._open:
+                    rec._observe(rss)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._sample, name="profiler-rss", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _enter(self, rec):
+        with self._lock:
+            self._open.add(rec)
+
+    def _exit(self, rec):
+        with self._lock:
+            self._open.discard(rec)
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def to_frame(self):
+        """All records as a DataFrame, one row per operation, in completion order."""
+        return pd.DataFrame([r.as_dict() for r in self.records])
+
+    def summary(self):
+        """Totals per operation name: calls, wall and CPU time, bytes read and written, max peak RSS."""
+        df = self.to_frame()
+        if df.empty:
+            return df
+        return (df.groupby("name")
+                  .agg(calls=("name", "size"), wall_s=("wall_s", "sum"), cpu_s=("cpu_s", "sum"),
+                       bytes_read=("bytes_read", "sum"), bytes_written=("bytes_written", "sum"),
+                       peak_rss_mb=("peak_rss_mb", "max"))
+                  .sort_values("wall_s", ascending=False))
+
+    def write_json(self, path):
+        """Write every record as JSON: {'records': [...]}."""
+        with open(path, "w") as f:
+            json.dump({"records": [r.as_dict() for r in self.records]}, f, indent=1, default=str)
+
+    def write_trace(self, path):
+        """
+        Write the records in the Chrome trace event format, viewable in chrome://tracing
+        or https://ui.perfetto.dev (one lane per thread, nested operations stacked).
+        """
+        events = []
+        for r in self.records:
+            args = {k: v for k, v in r.as_dict().items() if k not in ("name", "thread", "start_s", "wall_s")}
+            events.append({"name": r.name, "ph": "X", "pid": os.getpid(), "tid": r.thread,
+                           "ts": r.start_s * 1e6, "dur": r.wall_s * 1e6, "args": args})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events}, f, default=str)
+
+
+_ACTIVE = None
+
+
+def enable_profiling():
+    """Start collecting records in a new Profiler and return it."""
+    global _ACTIVE
+    _ACTIVE = Profiler().start()
+    return _ACTIVE
+
+
+def disable_profiling():
+    """Stop collecting records; returns the profiler that was active (or None)."""
+    global _ACTIVE
+    prof, _ACTIVE = _ACTIVE, None
+    if prof is not None:
+        prof.stop()
+    return prof
+
+
+def current_record():
+    """Innermost operation being profiled in this thread (a no-op record if none)."""
+    prof = _ACTIVE
+    if prof is None or not prof._stack():
+        return _NULL_RECORD
+    return prof._stack()[-1]
+
+
+@contextmanager
+def profile(name, **meta):
+    """
+    Measure the enclosed block: wall and CPU time, RSS, bytes read/written.
+
+    Usage:
+        with profile("load_schedule", path=fp) as rec:
+            df = pd.read_csv(fp)
+            rec.frame_out(df)
+
+    CPU time is the time of the calling thread. peak_rss_mb is the highest RSS sampled while the block
+    ran (at its start and end, and every few tens of milliseconds in between), not the process's
+    lifetime high-water mark. RSS and I/O counters are process-wide, so they include the work of stages
+    running concurrently in other threads.
+    """
+    prof = _ACTIVE
+    if prof is None:
+        yield _NULL_RECORD
+        return
+
+    stack = prof._stack()
+    rec = ProfileRecord(name, stack[-1].name if stack else None, meta)
+    stack.append(rec)
+    read0, written0 = _io_bytes()
+    rss0 = rss_bytes()
+    rec._observe(rss0)
+    prof._enter(rec)
+    cpu0 = time.thread_time()
+    t0 = time.perf_counter()
+    try:
+        yield rec
+    finally:
+        rec.wall_s = time.perf_counter() - t0
+        rec.cpu_s = time.thread_time() - cpu0
+        rec.start_s = t0 - prof._t0
+        prof._exit(rec)
+        read1, written1 = _io_bytes()
+        rss1 = rss_bytes()
+        rec._observe(rss1)
+        peak = rec._peak
+        rec.bytes_read = _delta(read1, read0)
+        rec.bytes_written = _delta(written1, written0)
+        rec.rss_start_mb = None if rss0 is None else rss0 / 2**20
+        rec.rss_end_mb = None if rss1 is None else rss1 / 2**20
+        rec.peak_rss_mb = None if peak is None else peak / 2**20
+        stack.pop()
+        prof.add(rec)
+
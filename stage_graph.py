@@ -0,0 +1,240 @@
+import ast
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from nic_reference import file_fingerprint
+from profiling import profile
+
+
+class Stage:
+    def __init__(self, name, func, inputs=(), outputs=(), deps=(), params=None, code=()):
+        """
+        One step of the pipeline, with the files it reads and writes.
+
+        Parameters:
+          name (str): Unique stage name (e.g. 'ingest').
+          func (callable): Function called without arguments to run the stage.
+          inputs (list): Files or folders the stage reads. Their fingerprints enter the checkpoint.
+          outputs (list): Files or folders the stage writes. They must exist after a successful run.
+          deps (list): Names of the stages that must finish before this one starts.
+          params (dict, optional): JSON-serializable settings that change the result
+                                   (e.g. a hash of the mappings). They enter the checkpoint.
+          code (list): Names of the modules that produce the outputs (e.g. 'ingest_raw_ffiec_cdr').
+                       Their source, and that of the local modules they import, enters the checkpoint.
+        """
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.params = params or {}
+        self.code = list(code)
+
+
+def path_fingerprint(path):
+    """
+    Fingerprint a file or, recursively, every file inside a folder.
+
+    Returns:
+        list: [relative path, size, mtime_ns] entries, sorted; an empty list if the path is missing.
+    """
+    if os.path.isfile(path):
+        fp = file_fingerprint(path)
+        return [[fp["file"], fp["size"], fp["mtime_ns"]]]
+
+    entries = []
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for fname in files:
+                full = os.path.join(root, fname)
+                fp = file_fingerprint(full)
+                entries.append([os.path.relpath(full, path), fp["size"], fp["mtime_ns"]])
+    return sorted(entries)
+
+
+def content_digest(obj):
+    """SHA-256 of the JSON serialization of `obj` (keys sorted)."""
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def source_digest(modules, source_dir=os.path.dirname(os.path.abspath(__file__))):
+    """
+    SHA-256 of the source of `modules` and of every module of source_dir they import, directly or not,
+    so that a change to the code behind a stage invalidates its checkpoint.
+
+    Returns:
+        str: The digest; modules without a file in source_dir are ignored.
+    """
+    seen, todo = {}, list(modules)
+    while todo:
+        name = todo.pop()
+        path = os.path.join(source_dir, name + ".py")
+        if name in seen or not os.path.isfile(path):
+            continue
+        with open(path, "rb") as f:
+            source = f.read()
+        seen[name] = hashlib.sha256(source).hexdigest()
+        for node in ast.walk(ast.parse(source)):
+            if isinstance(node, ast.Import):
+                todo += [alias.name.split(".")[0] for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                todo.append(node.module.split(".")[0])
+    return content_digest(seen)
+
+
+def _topological_order(stages):
+    by_name = {s.name: s for s in stages}
+    if len(by_name) != len(stages):
+        raise ValueError("Stage names must be unique.")
+    for s in stages:
+        unknown = [d for d in s.deps if d not in by_name]
+        if unknown:
+            raise ValueError(f"Stage '{s.name}' depends on unknown stages: {unknown}")
+
+    order, state = [], {}  # state: 1 = visiting, 2 = done
+
+    def visit(name):
+        if state.get(name) == 2:
+            return
+        if state.get(name) == 1:
+            raise ValueError(f"Cycle detected in the stage graph at '{name}'.")
+        state[name] = 1
+        for d in by_name[name].deps:
+            visit(d)
+        state[name] = 2
+        order.append(by_name[name])
+
+    for s in stages:
+        visit(s.name)
+    return order
+
+
+def _run_profiled(stage):
+    with profile(f"stage:{stage.name}"):
+        stage.func()
+
+
+class CheckpointStore:
+    def __init__(self, state_path):
+        """
+        JSON file holding, for each stage, the signature of its last successful run
+        and the fingerprint of the outputs it produced.
+        """
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        try:
+            with open(state_path) as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+
+    def get(self, name):
+        return self.state.get(name)
+
+    def record(self, name, signature, outputs):
+        with self._lock:
+            self.state[name] = {
+                "signature": signature,
+                "outputs": content_digest([path_fingerprint(p) for p in outputs]),
+            }
+            # write-then-rename so a crash never leaves a truncated checkpoint file
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            tmp = self.state_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(tmp, self.state_path)
+
+
+def run_stage_graph(stages, state_path, max_workers=1, force=False):
+    """
+    Run a DAG of stages, skipping the ones whose checkpoint is still valid.
+
+    A stage's signature hashes its name, params, the source of its code modules (see source_digest),
+    the fingerprints (size and modification time) of its inputs and the signatures of its dependencies.
+    The stage is rerun when:
+      - force is True,
+      - it has no checkpoint or the signature changed (inputs, params, code or upstream changed),
+      - one of its outputs is missing or was modified after the checkpoint was written.
+    A checkpoint is written as soon as a stage succeeds, so after a crash the next run
+    resumes at the first unfinished stage. Stages whose dependencies are done run
+    concurrently on a thread pool of `max_workers` threads.
+
+    Args:
+        stages (list[Stage]): The stages of the graph.
+        state_path (str): JSON file where checkpoints are kept.
+        max_workers (int): Maximum number of stages running at the same time.
+        force (bool): Rerun every stage regardless of checkpoints.
+
+    Returns:
+        dict: stage name → 'ran' or 'skipped'.
+    """
+    order = _topological_order(stages)
+    store = CheckpointStore(state_path)
+    signatures, status = {}, {}
+    pending = {s.name: s for s in order}
+    running = {}
+
+    def is_fresh(stage, signature):
+        cp = store.get(stage.name)
+        if force or cp is None or cp.get("signature") != signature:
+            return False
+        if not all(os.path.exists(p) for p in stage.outputs):
+            return False
+        return cp.get("outputs") == content_digest([path_fingerprint(p) for p in stage.outputs])
+
+    def schedule_ready(pool):
+        for name, stage in list(pending.items()):
+            if not all(status.get(d) in ("ran", "skipped") for d in stage.deps):
+                continue
+            del pending[name]
+            signature = content_digest({
+                "stage": stage.name,
+                "params": stage.params,
+                "code": source_digest(stage.code),
+                "inputs": [path_fingerprint(p) for p in stage.inputs],
+                "deps": [signatures[d] for d in stage.deps],
+            })
+            signatures[name] = signature
+            if is_fresh(stage, signature):
+                print(f"Info: stage '{name}' is up to date, skipping.")
+                status[name] = "skipped"
+                # a skipped stage may unblock others straight away
+                return True
+            print(f"Info: running stage '{name}'…")
+            running[pool.submit(_run_profiled, stage)] = stage
+        return False
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            while schedule_ready(pool):
+                pass
+            if not running:
+                if pending:
+                    raise RuntimeError(f"Stages could not be scheduled: {list(pending)}")
+                break
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for fut in done:
+                stage = running.pop(fut)
+                try:
+                    fut.result()
+                except Exception:
+                    # let the other running stages finish (and checkpoint) before failing
+                    pending.clear()
+                    for other in list(running):
+                        other_stage = running.pop(other)
+                        if other.exception() is None:
+                            store.record(other_stage.name, signatures[other_stage.name], other_stage.outputs)
+                    print(f"Error: stage '{stage.name}' failed; completed stages are checkpointed.")
+                    raise
+
+                missing = [p for p in stage.outputs if not os.path.exists(p)]
+                if missing:
+                    raise RuntimeError(f"Stage '{stage.name}' finished without writing: {missing}")
+                store.record(stage.name, signatures[stage.name], stage.outputs)
+                status[stage.name] = "ran"
+
+    return status
@@ -0,0 +1,285 @@
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from mappings import mappings
+from aux_functions import extract_variables_from_mappings
+
+# Schedules read by ingest(), in the order used there.
+SCHEDULES = [
+    'Schedule RC', 'Schedule RCCI', 'Schedule RCA', 'Schedule RCG', 'Schedule RCEI', 'Bulk POR',
+    'Schedule RCK', 'Schedule RI', 'Schedule RIBI', 'Schedule RCO', 'Schedule RCB',
+]
+
+# Charter type codes found in the NIC attributes files.
+CHARTER_CODES = [200, 250, 300, 320, 340, 500]
+
+
+def _quarter_ends(start, n_quarters):
+    return list(pd.period_range(start=start, periods=n_quarters, freq="Q").end_time.normalize())
+
+
+def _schedule_of(code, rng_state):
+    """Deterministically assign an MDRM code to a schedule (RIAD codes go to the income statement)."""
+    h = sum(ord(ch) * (i + 1) for i, ch in enumerate(code)) + rng_state
+    if code.startswith("RIAD"):
+        return ['Schedule RI', 'Schedule RIBI'][h % 2]
+    balance_sheet = [s for s in SCHEDULES if s not in ('Bulk POR', 'Schedule RI', 'Schedule RIBI')]
+    return balance_sheet[h % len(balance_sheet)]
+
+
+def _write_schedule(df, descriptions, fp, bad_quote_row=None):
+    """
+    Write one tab-delimited schedule file the way the FFIEC CDR does:
+    header row, metadata (item description) row, then one row per bank.
+    """
+    lines = ["\t".join(f'"{c}"' for c in df.columns),
+             "\t".join(descriptions.get(c, "") for c in df.columns)]
+    values = df.astype(object).where(df.notna(), "").astype(str).to_numpy()
+    for i, row in enumerate(values):
+        if bad_quote_row is not None and i == bad_quote_row:
+            # an unescaped quote inside a text field, as found in some real files
+            row = row.copy()
+            row[-1] = f'"{row[-1]} BANK "NORTH'
+        lines.append("\t".join(row))
+    with open(fp, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def generate_ffiec_cdr(cr_path, bank_ids, dates, codes, n_extra_columns=0, split_parts=True,
+                       duplicate_share=0.05, bad_quoting=True, seed=0):
+    """
+    Write synthetic 'FFIEC CDR Call Bulk All Schedules {mmddyyyy}' folders.
+
+    Args:
+        cr_path (str): Destination folder (…/raw/ffiec/extracted/cdr).
+        bank_ids (array-like): IDRSSD of the reporting banks.
+        dates (list[pd.Timestamp]): Quarter-end report dates.
+        codes (list[str]): MDRM codes to populate (upper case, e.g. 'RCON2170').
+        n_extra_columns (int): Additional filler MDRM columns, to scale the width of the files.
+        split_parts (bool): Split the widest schedules into '(1 of 2)' / '(2 of 2)' files.
+        duplicate_share (float): Share of codes that are also reported in a second schedule,
+                                 which produces the '_x' / '_y' suffix variants after merging.
+        bad_quoting (bool): Put an unescaped quote in one institution name per quarter.
+        seed (int): Random seed.
+    """
+    rng = np.random.default_rng(seed)
+    bank_ids = np.asarray(bank_ids)
+    # filler codes 'RCON0000', 'RCON0001', … (hexadecimal suffix), skipping the real ones
+    filler = (f"RCON{i:04X}" for i in range(16**4))
+    codes = list(codes) + [c for c in filler if c not in set(codes)][:n_extra_columns]
+
+    by_schedule = {s: [] for s in SCHEDULES}
+    for code in codes:
+        by_schedule[_schedule_of(code, 0)].append(code)
+    n_dup = int(len(codes) * duplicate_share)
+    for code in rng.choice(codes, size=n_dup, replace=False) if n_dup else []:
+        other = [s for s in SCHEDULES if s not in ('Bulk POR',) and code not in by_schedule[s]]
+        by_schedule[other[int(rng.integers(len(other)))]].append(code)
+
+    # only some banks file the consolidated (RCFD) items: those with foreign offices
+    foreign = rng.random(len(bank_ids)) < 0.1
+    size = np.exp(rng.normal(11, 1.5, len(bank_ids)))
+    descriptions = {c: f"DESCRIPTION OF {c}" for c in codes}
+    descriptions["IDRSSD"] = ""
+
+    for q, date in enumerate(dates):
+        tag = date.strftime("%m%d%Y")
+        folder = os.path.join(cr_path, f"FFIEC CDR Call Bulk All Schedules {tag}")
+        os.makedirs(folder, exist_ok=True)
+
+        # banks file from a random quarter onwards (entry) and some exit
+        reporting = rng.random(len(bank_ids)) < 0.97
+        ids = bank_ids[reporting]
+        growth = (1.01 ** q) * size[reporting]
+        values = {}
+        for code in codes:
+            if code.startswith("RIAD"):
+                # income items are reported year to date
+                v = growth * rng.uniform(0.001, 0.01) * ((date.month // 3))
+            else:
+                v = growth * rng.uniform(0.0, 0.3)
+            v = np.round(v)
+            if code.startswith("RCFD"):
+                v = np.where(foreign[reporting], v, np.nan)
+            values[code] = v
+
+        for schedule, sched_codes in by_schedule.items():
+            if schedule == 'Bulk POR':
+                df = pd.DataFrame({
+                    "IDRSSD": ids,
+                    "FDIC Certificate Number": ids % 100000,
+                    "Financial Institution Name": [f"BANK {i}" for i in ids],
+                })
+                fp = os.path.join(folder, f"FFIEC CDR Call Bulk POR {tag}.txt")
+                _write_schedule(df, descriptions, fp, bad_quote_row=0 if bad_quoting else None)
+                continue
+            if not sched_codes:
+                continue
+            df = pd.DataFrame({"IDRSSD": ids, **{c: values[c] for c in sched_codes}})
+            name = f"FFIEC CDR Call {schedule} {tag}"
+            if split_parts and len(sched_codes) > 30:
+                half = len(sched_codes) // 2
+                parts = [sched_codes[:half], sched_codes[half:]]
+                for k, part in enumerate(parts, start=1):
+                    _write_schedule(df[["IDRSSD"] + part], descriptions,
+                                    os.path.join(folder, f"{name}({k} of {len(parts)}).txt"))
+            else:
+                _write_schedule(df, descriptions, os.path.join(folder, f"{name}.txt"))
+
+
+def _intermediate_id(top_id, level):
+    """Id of the intermediate holding company at `level` below the top holding company `top_id`."""
+    return 6_000_000 + top_id * 10 + level
+
+
+def generate_nic(nic_path, bank_ids, dates, hierarchy_depth=3, n_holding_companies=None, seed=0):
+    """
+    Write synthetic NIC attributes, relationships and transformations CSV files.
+
+    Banks are grouped under holding companies; each holding company sits on top of a chain of
+    `hierarchy_depth` - 1 intermediate holding companies. About 5% of the banks are closed and
+    absorbed by another bank (transformations), and their charter is missing in the attributes.
+
+    Returns:
+        np.ndarray: The ids of the top holding companies.
+    """
+    rng = np.random.default_rng(seed + 1)
+    os.makedirs(nic_path, exist_ok=True)
+    bank_ids = np.asarray(bank_ids)
+    n_hc = n_holding_companies or max(1, len(bank_ids) // 10)
+    top_ids = 5_000_000 + np.arange(n_hc)
+
+    # relationships: top → intermediate holding companies → banks
+    rel = []
+    start = dates[0] - pd.DateOffset(years=1)
+    leaf_parent = {}
+    for t in top_ids:
+        parent = t
+        for level in range(1, hierarchy_depth - 1):
+            mid = _intermediate_id(t, level)
+            rel.append((parent, mid, start, None))
+            parent = mid
+        leaf_parent[t] = parent
+    owner = rng.choice(top_ids, size=len(bank_ids))
+    switch = rng.random(len(bank_ids)) < 0.1
+    mid_date = dates[len(dates) // 2]
+    for b, t, sw in zip(bank_ids, owner, switch):
+        if sw:
+            other = top_ids[(np.searchsorted(top_ids, t) + 1) % len(top_ids)]
+            rel.append((leaf_parent[t], b, start, mid_date - pd.Timedelta(days=1)))
+            rel.append((leaf_parent[other], b, mid_date, None))
+        else:
+            rel.append((leaf_parent[t], b, start, None))
+
+    def fmt(d):
+        return "" if d is None else pd.Timestamp(d).strftime("%Y-%m-%d")
+
+    pd.DataFrame({
+        "#ID_RSSD_PARENT": [r[0] for r in rel],
+        "ID_RSSD_OFFSPRING": [r[1] for r in rel],
+        "D_DT_START": [fmt(r[2]) for r in rel],
+        "D_DT_END": [fmt(r[3]) for r in rel],
+    }).to_csv(os.path.join(nic_path, "CSV_RELATIONSHIPS.csv"), index=False)
+
+    closed = rng.random(len(bank_ids)) < 0.05
+    charter = rng.choice(CHARTER_CODES, size=len(bank_ids))
+    attrs = pd.DataFrame({
+        "#ID_RSSD": bank_ids,
+        "CHTR_TYPE_CD": charter,
+        "ID_FDIC_CERT": bank_ids % 100000,
+        "NM_SHORT": [f"BANK {i}" for i in bank_ids],
+    })
+    hc_ids = [top_ids] + [_intermediate_id(top_ids, level) for level in range(1, hierarchy_depth - 1)]
+    hc = pd.DataFrame({"#ID_RSSD": np.concatenate(hc_ids), "CHTR_TYPE_CD": 500, "ID_FDIC_CERT": 0})
+    hc["NM_SHORT"] = "HOLDING " + hc["#ID_RSSD"].astype(str)
+    active = pd.concat([attrs[~closed], hc], ignore_index=True)
+    closed_df = attrs[closed].assign(CHTR_TYPE_CD=np.nan)
+    active.to_csv(os.path.join(nic_path, "CSV_ATTRIBUTES_ACTIVE.CSV"), index=False)
+    closed_df.to_csv(os.path.join(nic_path, "CSV_ATTRIBUTES_CLOSED.CSV"), index=False)
+
+    # transformations: each closed bank is absorbed by an active bank of the same holding company
+    preds = bank_ids[closed]
+    active_banks = bank_ids[~closed]
+    succs = rng.choice(active_banks, size=len(preds)) if len(active_banks) else preds
+    trans_dates = rng.choice(dates, size=len(preds)) if len(preds) else []
+    pd.DataFrame({
+        "#ID_RSSD_PREDECESSOR": preds,
+        "ID_RSSD_SUCCESSOR": succs,
+        "D_DT_TRANS": [pd.Timestamp(d).strftime("%Y-%m-%d") for d in trans_dates],
+        "TRNSFM_CD": 1,
+    }).to_csv(os.path.join(nic_path, "CSV_TRANSFORMATIONS.CSV"), index=False)
+
+    return top_ids
+
+
+def generate_wrds(wrds_path, top_ids, dates, listed_share=0.6, seed=0):
+    """
+    Write a synthetic NY Fed crosswalk (permco_idrssd_xwalk.csv) and WRDS export (wrds_data.csv)
+    for a share of the top holding companies.
+    """
+    rng = np.random.default_rng(seed + 2)
+    os.makedirs(wrds_path, exist_ok=True)
+    listed = [t for t in top_ids if rng.random() < listed_share]
+    first = dates[0] - pd.DateOffset(years=1)
+    xwalk = pd.DataFrame({
+        "permco": 20000 + np.arange(len(listed)),
+        "entity": listed,
+        "dt_start": first.strftime("%Y%m%d"),
+        "dt_end": "20991231",
+    })
+    xwalk.to_csv(os.path.join(wrds_path, "permco_idrssd_xwalk.csv"), index=False)
+
+    rows = []
+    for permco in xwalk["permco"]:
+        for d in dates:
+            # a ticker change half-way for some firms
+            tic = f"T{permco}" if (permco % 7 or d < dates[len(dates) // 2]) else f"N{permco}"
+            rows.append({"LPERMCO": permco, "LPERMNO": permco + 1, "tic": tic,
+                         "datacqtr": f"{d.year}Q{d.quarter}"})
+    pd.DataFrame(rows).to_csv(os.path.join(wrds_path, "wrds_data.csv"), index=False)
+
+
+def generate_synthetic_dataset(base_path, n_banks=200, n_quarters=8, start="2001Q1", n_extra_columns=0,
+                               hierarchy_depth=3, split_parts=True, bad_quoting=True, seed=0):
+    """
+    Create a complete synthetic 'data/raw' tree that run_pipeline(base_path) can process.
+
+    Args:
+        base_path (str): Data directory; 'raw/' is created inside it.
+        n_banks (int): Number of reporting banks.
+        n_quarters (int): Number of quarters, starting at `start`.
+        start (str): First quarter (e.g. '2001Q1').
+        n_extra_columns (int): Filler MDRM columns added on top of the codes used in mappings.py.
+        hierarchy_depth (int): Levels of the holding company tree (top parent = level 1).
+        split_parts (bool): Write wide schedules in several '(k of n)' parts.
+        bad_quoting (bool): Include the unescaped quotes that force the fallback parser.
+        seed (int): Random seed.
+    """
+    dates = _quarter_ends(start, n_quarters)
+    bank_ids = 100_000 + np.arange(n_banks) * 7
+    codes = extract_variables_from_mappings(mappings)
+
+    generate_ffiec_cdr(os.path.join(base_path, "raw", "ffiec", "extracted", "cdr"), bank_ids, dates, codes,
+                       n_extra_columns=n_extra_columns, split_parts=split_parts, bad_quoting=bad_quoting,
+                       seed=seed)
+    top_ids = generate_nic(os.path.join(base_path, "raw", "ffiec", "extracted", "nic"), bank_ids, dates,
+                           hierarchy_depth=hierarchy_depth, seed=seed)
+    generate_wrds(os.path.join(base_path, "raw", "wrds_compustat"), top_ids, dates, seed=seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic FFIEC CDR / NIC / WRDS raw data tree.")
+    parser.add_argument("base_path", help="Data directory where 'raw/' will be created.")
+    parser.add_argument("--banks", type=int, default=200)
+    parser.add_argument("--quarters", type=int, default=8)
+    parser.add_argument("--start", default="2001Q1")
+    parser.add_argument("--extra-columns", type=int, default=0)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate_synthetic_dataset(args.base_path, n_banks=args.banks, n_quarters=args.quarters, start=args.start,
+                               n_extra_columns=args.extra_columns, hierarchy_depth=args.depth, seed=args.seed)
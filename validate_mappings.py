@@ -0,0 +1,204 @@
+import os
+import sys
+import argparse
+
+import pandas as pd
+
+from aux_functions import extract_variables_from_mappings
+from mdrm_catalog import read_column_stats, collect_column_stats
+from expressions import Expr
+
+# Methods understood by CallReportsCleaner.combine_cols
+METHODS = {"min", "max", "mean", "sum", "first", "secondary", "rename", "ratio", "ytd_diff"}
+
+
+def _refs(first_col, second_col):
+    refs = list(first_col) if isinstance(first_col, (list, tuple)) else [first_col]
+    if second_col:
+        refs.append(second_col)
+    return [r for r in refs if r]
+
+
+def _ranges(quarters):
+    """Sorted quarters → '2001-03-31..2001-12-31, 2005-06-30' (runs of consecutive report dates)."""
+    if not quarters:
+        return ""
+    out, run = [], [quarters[0]]
+    for q in quarters[1:]:
+        if (q.year * 4 + q.quarter) - (run[-1].year * 4 + run[-1].quarter) == 1:
+            run.append(q)
+        else:
+            out.append(run)
+            run = [q]
+    out.append(run)
+    fmt = "%Y-%m-%d"
+    return ", ".join(r[0].strftime(fmt) if len(r) == 1 else f"{r[0].strftime(fmt)}..{r[-1].strftime(fmt)}"
+                     for r in out)
+
+
+def validate_mappings(mappings, stats, start=None, end=None):
+    """
+    Check every mapping against the per-quarter column statistics, without loading any data.
+
+    For each mapping (expressions of expressions.py are checked on the columns they read):
+      - 'new_var' is present and unique, 'method' / 'method_post' are known combine_cols methods;
+      - 'switch_date' parses, comes with a 'first_col_post', and separates the quarters with data of the
+        codes used before it from those of the codes used after it;
+      - every 'first_col' / 'second_col' / '*_post' reference is an MDRM code of the catalog that
+        extract_variables_from_mappings selects, or a new_var defined by an earlier mapping;
+      - every referenced code has data in the period (before / after the switch) it is used for.
+    The coverage of a new_var is the set of quarters where at least one of its inputs has data
+    (both inputs for 'ratio'), and it propagates to the new_vars built on top of it.
+
+    Parameters:
+      mappings (list): Variable definitions (mappings.py).
+      stats (pd.DataFrame): Per-quarter column statistics (see mdrm_catalog.read_column_stats).
+      start, end (str or datetime, optional): Period to check (default: every ingested quarter).
+
+    Returns:
+      pd.DataFrame: One row per mapping with new_var, status ('ok', 'warning' or 'error'),
+                    covered (quarters with data), quarters (in the period), gaps and issues.
+    """
+    stats = stats[["mdrm", "quarter", "non_null"]]
+    if start is not None:
+        stats = stats[stats["quarter"] >= pd.Timestamp(start)]
+    if end is not None:
+        stats = stats[stats["quarter"] <= pd.Timestamp(end)]
+    quarters = sorted(stats["quarter"].unique())
+    all_quarters = set(quarters)
+
+    # Coverage of every code, suffix variants merged into their base as in CallReportsCleaner
+    base = stats["mdrm"].str.split("_", n=1).str[0].str.lower()
+    filled = stats[stats["non_null"] > 0]
+    code_cov = filled.groupby(base[filled.index])["quarter"].agg(set).to_dict()
+    known_codes = set(base)
+    selected = {v.lower() for v in extract_variables_from_mappings(mappings)}
+    # An expression is checked as a 'sum' of the columns it reads: data in any of them gives data
+    mappings = [{"new_var": m.name, "first_col": tuple(m.columns()), "method": "sum"} if isinstance(m, Expr) else m
+                for m in mappings]
+    all_new_vars = {m.get("new_var") for m in mappings if isinstance(m, dict)}
+
+    defined = {}
+    rows = []
+    for mapping in mappings:
+        issues, errors = [], False
+
+        def issue(text, error=False):
+            nonlocal errors
+            issues.append(text)
+            errors = errors or error
+
+        new_var = mapping.get("new_var")
+        if not new_var:
+            issue("missing 'new_var'", error=True)
+        elif new_var in defined:
+            issue(f"'{new_var}' is defined more than once", error=True)
+
+        method = mapping.get("method", "first")
+        method_post = mapping.get("method_post", method)
+        for m in {method, method_post}:
+            if m not in METHODS:
+                issue(f"unknown method '{m}'", error=True)
+
+        if "first_col" not in mapping:
+            issue("missing 'first_col'", error=True)
+        periods = [(all_quarters, _refs(mapping.get("first_col"), mapping.get("second_col")), method, "")]
+        if "switch_date" in mapping:
+            try:
+                switch = pd.Timestamp(mapping["switch_date"])
+            except (ValueError, TypeError):
+                issue(f"invalid switch_date '{mapping['switch_date']}'", error=True)
+                switch = None
+            if "first_col_post" not in mapping:
+                issue("switch_date without 'first_col_post'", error=True)
+            if switch is not None:
+                pre_refs = periods[0][1]
+                post_refs = _refs(mapping.get("first_col_post"), mapping.get("second_col_post"))
+                periods = [({q for q in quarters if q < switch}, pre_refs, method, " before the switch"),
+                           ({q for q in quarters if q >= switch}, post_refs, method_post, " after the switch")]
+                # The switch should separate the old codes' data from the new codes' data
+                for refs, side, outside in ((pre_refs, "after", periods[1][0]), (post_refs, "before", periods[0][0])):
+                    for ref in refs:
+                        if isinstance(ref, str) and ref not in all_new_vars:
+                            wasted = sorted(code_cov.get(ref.lower(), set()) & outside)
+                            if wasted:
+                                issue(f"'{ref}' also has data {side} the switch_date ({_ranges(wasted)})")
+
+        coverage = set()
+        for period, refs, m, label in periods:
+            covs = []
+            for ref in refs:
+                if not isinstance(ref, str):
+                    issue(f"invalid reference {ref!r}", error=True)
+                    continue
+                if ref in defined:
+                    cov = defined[ref]
+                elif ref in all_new_vars:
+                    issue(f"'{ref}' is used before the mapping that defines it", error=True)
+                    continue
+                elif ref.lower() in known_codes:
+                    cov = code_cov.get(ref.lower(), set())
+                    if ref.lower() not in selected:
+                        issue(f"'{ref}' is not selected by extract_variables_from_mappings", error=True)
+                else:
+                    issue(f"unknown column '{ref}' (not an MDRM code of the data nor a new_var)", error=True)
+                    continue
+                if period and not (cov & period):
+                    issue(f"'{ref}' has no data{label}")
+                covs.append(cov & period)
+            if covs:
+                coverage |= set.intersection(*covs) if m == "ratio" else set.union(*covs)
+
+        if new_var:
+            defined[new_var] = coverage
+        gaps = sorted(all_quarters - coverage)
+        rows.append({
+            "new_var": new_var,
+            "status": "error" if errors else ("warning" if issues or gaps else "ok"),
+            "covered": len(coverage),
+            "quarters": len(quarters),
+            "gaps": _ranges(gaps),
+            "issues": "; ".join(issues),
+        })
+    return pd.DataFrame(rows)
+
+
+def load_column_stats(base_path):
+    """Column statistics of the pipeline under base_path: from the merged folder, else from the ingested quarters."""
+    intermediate = os.path.join(base_path, "intermediate")
+    stats = read_column_stats(os.path.join(intermediate, "ffiec_cdr_all_dates_merged"))
+    if stats is None:
+        stats = collect_column_stats(os.path.join(intermediate, "ffiec_cdr_all_dates"))
+    if stats is None:
+        raise FileNotFoundError(
+            f"No column statistics under {intermediate}. Run the ingestion step first "
+            "(python src/pipeline.py <base_path>) to record them."
+        )
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate mappings.py against the MDRM column statistics.")
+    parser.add_argument("base_path", help="Base data directory (the one passed to pipeline.py).")
+    parser.add_argument("--start", help="First report date to check (default: first ingested quarter).")
+    parser.add_argument("--end", help="Last report date to check (default: last ingested quarter).")
+    parser.add_argument("--output", metavar="PATH", help="Write the full coverage report to this CSV file.")
+    args = parser.parse_args()
+
+    from mappings import mappings
+
+    report = validate_mappings(mappings, load_column_stats(args.base_path), start=args.start, end=args.end)
+    if args.output:
+        report.to_csv(args.output, index=False)
+
+    counts = report["status"].value_counts()
+    print(f"Checked {len(report)} mappings: {counts.get('ok', 0)} ok, "
+          f"{counts.get('warning', 0)} with warnings, {counts.get('error', 0)} with errors.")
+    for row in report[report["status"] != "ok"].itertuples():
+        print(f"{'Error' if row.status == 'error' else 'Warning'}: {row.new_var} "
+              f"(data in {row.covered} of {row.quarters} quarters)")
+        if row.gaps:
+            print(f"    no data: {row.gaps}")
+        for text in filter(None, row.issues.split("; ")):
+            print(f"    {text}")
+    sys.exit(1 if (report["status"] == "error").any() else 0)